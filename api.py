@@ -2,17 +2,31 @@
 import logging
 import aiohttp
 import json
-from cache_manager import CacheManager
+from async_cache_manager import AsyncCacheManager
+from cache_manager import canonical_params
+from outbox import Outbox, send_retries
 import asyncio
+import contextvars
+import time
 import traceback
-from itertools import groupby
-from operator import itemgetter
 from typing import List
 from commodity import Commodity
-from global_variables import persistent_cache_activated
+from global_variables import persistent_cache_activated, persistent_cache_format
+from global_variables import cache_lease_poll_interval, cache_lease_wait_timeout
 from metrics import Metrics
 
 
+class CacheSnapshot:
+    """A cache generation pinned by a search, with the rows it had to fetch because they were missing."""
+    def __init__(self, generation):
+        self.generation = generation
+        self.fetched = {}
+
+
+# Snapshot pinned by the running search, inherited by the tasks it creates
+pinned_cache_snapshot = contextvars.ContextVar("pinned_cache_snapshot", default=None)
+
+
 class API:
     _instance = None
     _lock = asyncio.Lock()
@@ -37,9 +51,11 @@ class API:
         if not hasattr(self, 'singleton'):  # Ensure __init__ is only called once
             self.config_manager = config_manager
             if persistent_cache_activated:
-                self.cache = CacheManager(backend="persistent", config_manager=config_manager)
+                backend = "log" if persistent_cache_format == "log" else "persistent"
+                self.cache = AsyncCacheManager(backend=backend, config_manager=config_manager)
             else:
-                self.cache = CacheManager(backend="local", config_manager=config_manager)
+                self.cache = AsyncCacheManager(backend="local", config_manager=config_manager)
+            self.outbox = Outbox(self._post_data)
             self.session = None
             self.metrics = None
             self.singleton = True
@@ -49,9 +65,13 @@ class API:
             if self.session is None:
                 self.session = aiohttp.ClientSession()
                 self.metrics = await Metrics.get_instance()
+                self.outbox.start()
+                self.cache.start_maintenance()
                 self._initialized.set()
 
     async def cleanup(self):
+        await self.outbox.stop()
+        await self.cache.stop_maintenance()
         if self.session:
             await self.session.close()
             self.session = None
@@ -80,28 +100,64 @@ class API:
         return logging.getLogger(__name__)
 
     @Metrics.track_async_fnc_exec
-    async def _fetch_data(self, endpoint, params=None, default_data=[], data_only=True):
+    async def _fetch_data(self, endpoint, params=None, default_data=[], data_only=True, use_cache=True):
         await self.ensure_initialized()
-        cached_data = self.cache.get(endpoint, params=params)
-        logger = self.get_logger()
-        if cached_data:
+        if not use_cache:
+            return await self._request_data(endpoint, params, default_data, data_only, use_cache)
+        cached_data = await self._get_cached_data(endpoint, params)
+        if cached_data is not None:
             self.metrics.track_api_call(endpoint, params, cache_hit=True)
             return cached_data, True
-        else:
-            self.metrics.track_api_call(endpoint, params, cache_hit=False)
+        return await self._fetch_leased(endpoint, params, lambda: self._get_cached_data(endpoint, params),
+                                        lambda: self._request_data(endpoint, params, default_data, data_only, use_cache))
+
+    async def _get_cached_data(self, endpoint, params):
+        # Empty data is fetched again
+        return (await self.cache.get(endpoint, params)) or None
+
+    @Metrics.track_async_fnc_exec
+    async def _fetch_leased(self, endpoint, params, read_cache, fetch):
+        """
+        Fetches a cache miss with fetch() while holding its lease, shared by every process using the cache.
+        While another process (or task) holds it, waits for its result with read_cache() instead of
+        sending the same request, until the lease is released or the wait times out.
+        """
+        deadline = time.monotonic() + cache_lease_wait_timeout
+        acquired = await self.cache.acquire_lease(endpoint, params)
+        while not acquired and time.monotonic() < deadline:
+            await asyncio.sleep(cache_lease_poll_interval)
+            acquired = await self.cache.acquire_lease(endpoint, params)
+        try:
+            # The previous owner of the lease may have just stored the result
+            cached_data = await read_cache()
+            if cached_data is not None:
+                self.metrics.track_api_call(endpoint, params, cache_hit=True)
+                return cached_data, True
+            return await fetch()
+        finally:
+            if acquired:
+                self.cache.release_lease(endpoint, params)
+
+    async def _request_data(self, endpoint, params, default_data, data_only, use_cache):
+        logger = self.get_logger()
+        self.metrics.track_api_call(endpoint, params, cache_hit=False)
         url = f"{await self.get_api_base_url()}{endpoint}"
         logger.debug(f"API Request: GET {url} {params if params else ''}")
+        started_at = time.time()
+        start_time = time.perf_counter_ns()
+        ttfb, status, body = None, None, b""
         try:
             async with self.session.get(url, params=params) as response:
+                # Returned once the status line and headers are received
+                ttfb, status = (time.perf_counter_ns() - start_time) / 1e9, response.status
+                body = await response.read()
                 if response.status == 200:
                     json_response = (await response.json())
-                    if data_only:
-                        data = json_response.get("data", default_data)
+                    self.metrics.track_api_latency(endpoint, (time.perf_counter_ns() - start_time) / 1e9)
+                    data = json_response.get("data", default_data) if data_only else json_response
+                    if use_cache:
                         self.cache.set(endpoint, params, data)
-                        return data, False
-                    else:
-                        self.cache.set(endpoint, params, json_response)
-                        return json_response, False
+                    return data, False
                 error_message = await response.text()
                 logger.error(f"API request failed with status {response.status}: {error_message}")
                 response.raise_for_status()  # Raise an exception for bad status codes
@@ -116,6 +172,9 @@ class API:
             if self.config_manager.get_debug():
                 logging.debug(traceback.format_exc())
             raise  # Re-raise the exception to be handled by the calling function
+        finally:
+            self.metrics.track_api_request("GET", endpoint, started_at, (time.perf_counter_ns() - start_time) / 1e9,
+                                           ttfb, len(body), status)
 
     @Metrics.track_async_fnc_exec
     async def _post_data(self, endpoint, data=None):
@@ -132,8 +191,13 @@ class API:
         data['is_production'] = int(self.config_manager.get_is_production())
         data_string = json.dumps(data)
         logger.debug("API Request: POST %s %s", url, data_string)
+        started_at = time.time()
+        start_time = time.perf_counter_ns()
+        ttfb, status, body = None, None, b""
         try:
             async with self.session.post(url, data=data_string, headers=headers) as response:
+                ttfb, status = (time.perf_counter_ns() - start_time) / 1e9, response.status
+                body = await response.read()
                 if response.status == 200:
                     response_data = await response.json()
                     return response_data
@@ -151,136 +215,93 @@ class API:
             if self.config_manager.get_debug():
                 logging.debug(traceback.format_exc())
             raise  # Re-raise the exception to be handled by the calling function
+        finally:
+            self.metrics.track_api_request("POST", endpoint, started_at, (time.perf_counter_ns() - start_time) / 1e9,
+                                           ttfb, len(body), status, send_retries.get())
 
-    @Metrics.track_sync_fnc_exec
-    def _group_by(self, data, param: str):
-        logger = self.get_logger()
-        try:
-            sorted_data_by_param = sorted(data, key=itemgetter(param))
-            grouped_data_by_param = [list(group) for _, group in groupby(sorted_data_by_param, key=itemgetter(param))]
-            return grouped_data_by_param
-        except KeyError as e:
-            logger.error(f"API KeyError: {e}")
-            if self.config_manager.get_debug():
-                logging.debug(traceback.format_exc())
+    @Metrics.track_async_fnc_exec
+    async def _fetch_rows(self, endpoint, params=None, partition=None):
+        """
+        Fetches the rows of a normalized endpoint, from the cache row store when params are already loaded.
+        Only the rows of partition are returned for partitioned endpoints, every partition is stored.
+        """
+        await self.ensure_initialized()
+        if not params:
+            params = {}
+        if not self.cache.supports_rows(endpoint, params):
+            return await self._fetch_data(endpoint, params=params)
+        snapshot = pinned_cache_snapshot.get()
+        if snapshot is None:
+            rows = await self.cache.get_rows(endpoint, params, partition)
+        else:
+            fetched_key = (endpoint, canonical_params(params), partition)
+            rows = snapshot.fetched.get(fetched_key)
+            if rows is None:
+                rows = await self.cache.get_rows(endpoint, params, partition, snapshot.generation)
+        if rows is not None:
+            self.metrics.track_api_call(endpoint, params, cache_hit=True)
+            return rows, True
+        rows, cached = await self._fetch_leased(endpoint, params,
+                                                lambda: self.cache.get_rows(endpoint, params, partition),
+                                                lambda: self._fetch_new_rows(endpoint, params))
+        rows = self.cache.filter_partition(endpoint, rows, partition)
+        if snapshot is not None:
+            # Written in a newer generation: kept for the rest of the search instead of being fetched again
+            snapshot.fetched[fetched_key] = rows
+        return rows, cached
+
+    async def _fetch_new_rows(self, endpoint, params):
+        rows, cached = await self._fetch_data(endpoint, params=params, use_cache=False)
+        self.cache.set_rows(endpoint, params, rows)
+        return rows, cached
 
-    @Metrics.track_sync_fnc_exec
-    def _group_by_and_set(self, data, group_param: str, endpoint: str):
-        grouped_data_by_param = self._group_by(data, group_param)
-        for data_grouped in grouped_data_by_param:
-            if len(data_grouped) > 0:
-                data_grouped_params = {group_param: data_grouped[0][group_param]}
-                self.cache.set(endpoint, data_grouped_params, data_grouped)
+    @Metrics.track_async_fnc_exec
+    async def pin_cache_snapshot(self):
+        """
+        Pins the current cache generation for the calling task and the tasks it creates:
+        their rows are read from this generation until release_cache_snapshot(). A search pins
+        one so every price it compares comes from the same cache generation, whatever is
+        written while it runs.
+        """
+        snapshot = CacheSnapshot(await self.cache.pin_snapshot())
+        return snapshot, pinned_cache_snapshot.set(snapshot)
 
     @Metrics.track_sync_fnc_exec
-    def _group_by_and_replace(self, data, group_param: str, endpoint: str, replace_primary_key=['id']):
-        grouped_data_by_param = self._group_by(data, group_param)
-        for data_grouped in grouped_data_by_param:
-            if len(data_grouped) > 0:
-                data_grouped_params = {group_param: data_grouped[0][group_param]}
-                self.cache.replace(endpoint, data_grouped_params, data_grouped, replace_primary_key)
+    def release_cache_snapshot(self, pinned_snapshot):
+        snapshot, token = pinned_snapshot
+        pinned_cache_snapshot.reset(token)
+        self.cache.release_snapshot(snapshot.generation)
 
     @Metrics.track_async_fnc_exec
     async def _fetch_commodities(self, params):
-        endpoint = "/commodities"
-        commodities, cached = (await self._fetch_data(endpoint, params=params))
-        if not cached:
-            for commodity in commodities:
-                commodity_params = {'id_commodity', commodity['id']}
-                self.cache.set(endpoint, commodity_params, commodity)
+        commodities, cached = (await self._fetch_rows("/commodities", params=params))
         return commodities
 
-    @Metrics.track_async_fnc_exec
-    async def _regroup_all_commodities_prices_from_cache(self):
-        endpoint = "/commodities_prices"
-        commodity_params = {}
-        commodities = self.cache.get(endpoint, params=commodity_params)
-        if commodities:
-            self._group_by_and_set(commodities, 'id_terminal', endpoint)
-            self._group_by_and_set(commodities, 'id_commodity', endpoint)
-
     @Metrics.track_async_fnc_exec
     async def _fetch_commodities_prices(self, params):
-        endpoint = "/commodities_prices"
-        commodities, cached = (await self._fetch_data(endpoint, params=params))
-        if not cached:
-            if not params or len(params) == 0:
-                self._group_by_and_set(commodities, 'id_terminal', endpoint)
-                self._group_by_and_set(commodities, 'id_commodity', endpoint)
-            else:
-                primary_key = ['id_commodity', 'id_terminal']
-                self._group_by_and_replace(commodities, 'id_terminal', endpoint, replace_primary_key=primary_key)
-                self._group_by_and_replace(commodities, 'id_commodity', endpoint, replace_primary_key=primary_key)
-            for commodity in commodities:
-                commodity_terminal_params = {'id_commodity': commodity['id_commodity'],
-                                             'id_terminal': commodity['id_terminal']}
-                self.cache.set(endpoint, commodity_terminal_params, [commodity])
+        # Prices of the selected game version only
+        selected_version = await self.config_manager.get_version_value()
+        commodities, cached = (await self._fetch_rows("/commodities_prices", params=params, partition=selected_version))
         return commodities
 
     @Metrics.track_async_fnc_exec
     async def _fetch_planets(self, params):
-        endpoint = "/planets"
-        planets, cached = (await self._fetch_data(endpoint, params=params))
-        if not cached:
-            if not params or len(params) == 0:
-                self._group_by_and_set(planets, 'id_star_system', endpoint)
-                self._group_by_and_set(planets, 'id_faction', endpoint)
-                self._group_by_and_set(planets, 'id_jurisdiction', endpoint)
-            else:
-                self._group_by_and_replace(planets, 'id_star_system', endpoint)
-                self._group_by_and_replace(planets, 'id_faction', endpoint)
-                self._group_by_and_replace(planets, 'id_jurisdiction', endpoint)
-            for planet in planets:
-                planet_params = {'id_planet': planet['id']}
-                self.cache.set(endpoint, planet_params, [planet])
+        planets, cached = (await self._fetch_rows("/planets", params=params))
         return planets
 
     @Metrics.track_async_fnc_exec
     async def _fetch_terminals(self, params):
-        endpoint = "/terminals"
-        terminals, cached = (await self._fetch_data(endpoint, params=params))
-        if not cached:
-            if not params or len(params) == 0:
-                self._group_by_and_set(terminals, 'id_star_system', endpoint)
-                self._group_by_and_set(terminals, 'id_planet', endpoint)
-            else:
-                self._group_by_and_replace(terminals, 'id_star_system', endpoint)
-                self._group_by_and_replace(terminals, 'id_planet', endpoint)
-            for terminal in terminals:
-                terminal_params = {'id_terminal': terminal['id']}
-                self.cache.set(endpoint, terminal_params, [terminal])
+        terminals, cached = (await self._fetch_rows("/terminals", params=params))
         return terminals
 
     @Metrics.track_async_fnc_exec
     async def _fetch_systems(self, params=None):
-        endpoint = "/star_systems"
-        systems, cached = (await self._fetch_data(endpoint, params))
-        if not cached:
-            for system in systems:
-                system_params = {'id_star_system': system['id']}
-                self.cache.set(endpoint, system_params, [system])
+        systems, cached = (await self._fetch_rows("/star_systems", params))
         return systems
 
     @Metrics.track_async_fnc_exec
     async def _fetch_commodities_routes(self, params):
-        endpoint = "/commodities_routes"
-        commodities_routes, cached = (await self._fetch_data(endpoint, params))
-        if not cached:
-            if not params or len(params) == 0:
-                self._group_by_and_set(commodities_routes, 'id_terminal_origin', endpoint)
-                self._group_by_and_set(commodities_routes, 'id_planet_origin', endpoint)
-                self._group_by_and_set(commodities_routes, 'id_orbit_origin', endpoint)
-                self._group_by_and_set(commodities_routes, 'id_commodity', endpoint)
-            else:
-                self._group_by_and_replace(commodities_routes, 'id_terminal_origin', endpoint)
-                self._group_by_and_replace(commodities_routes, 'id_planet_origin', endpoint)
-                self._group_by_and_replace(commodities_routes, 'id_orbit_origin', endpoint)
-                self._group_by_and_replace(commodities_routes, 'id_commodity', endpoint)
-            for commodity_route in commodities_routes:
-                commodity_route_params = {'id_commodity': commodity_route['id_commodity'],
-                                          'id_terminal_origin': commodity_route['id_terminal_origin'],
-                                          'id_terminal_destination': commodity_route['id_terminal_destination']}
-                self.cache.set(endpoint, commodity_route_params, [commodity_route])
+        commodities_routes, cached = (await self._fetch_rows("/commodities_routes", params))
         return commodities_routes
 
     @Metrics.track_async_fnc_exec
@@ -293,17 +314,11 @@ class API:
         commodities = await self._fetch_commodities({})
         return (await self._filter_std_commodities(commodities))
 
-    @Metrics.track_async_fnc_exec
-    async def _filter_std_commodities_prices(self, commodities):
-        selected_version = await self.config_manager.get_version_value()
-        return [commodity for commodity in commodities
-                if commodity.get("game_version", '0.0') == selected_version]
-
     @Metrics.track_async_fnc_exec
     async def fetch_commodities_by_id(self, id_commodity):
         params = {'id_commodity': id_commodity}
         commodities = await self._fetch_commodities_prices(params)
-        return (await self._filter_std_commodities_prices(commodities))
+        return commodities
 
     @Metrics.track_async_fnc_exec
     async def fetch_commodities_from_terminal(self, id_terminal, id_commodity=None):
@@ -311,18 +326,53 @@ class API:
         if id_commodity:
             params['id_commodity'] = id_commodity
         commodities = await self._fetch_commodities_prices(params)
-        return (await self._filter_std_commodities_prices(commodities))
+        return commodities
 
     @Metrics.track_async_fnc_exec
     async def fetch_all_commodities_prices(self):
         endpoint = "/commodities_prices"
-        all_terminals = await self.fetch_all_terminals()
-        commodities = []
-        for terminal in all_terminals:
-            commodities.extend(await self.fetch_commodities_from_terminal(terminal['id']))
-        self.cache.set(endpoint, params={}, data=commodities)
-        await self._regroup_all_commodities_prices_from_cache()
-        return (await self._filter_std_commodities_prices(commodities))
+        complete, terminal_ids = await self._warm_up(
+            endpoint, 'id_terminal', lambda id_terminal: self._fetch_commodities_prices({'id_terminal': id_terminal}))
+        if complete:
+            # Every terminal is loaded, queries by commodity can be answered from cache too
+            return await self._fetch_commodities_prices({})
+        # Not fetched again as a whole: the prices of the terminals loaded are returned
+        prices = []
+        for terminal_id in terminal_ids:
+            prices.extend(await self._fetch_commodities_prices({'id_terminal': terminal_id}))
+        return prices
+
+    @Metrics.track_async_fnc_exec
+    async def _warm_up(self, endpoint, param, fetch):
+        """
+        Loads endpoint terminal by terminal with fetch(id), checkpointed per terminal: each terminal is
+        stored with its own scope, so an interrupted warmup resumes with the terminals left. The endpoint
+        only counts as warm (its completion marker) once every terminal is loaded.
+        Returns whether the endpoint is warm, and the ids of the terminals loaded.
+        """
+        terminal_ids = [terminal['id'] for terminal in await self.fetch_all_terminals()]
+        checkpoints = await self.cache.get_warmup_checkpoints(endpoint, param, terminal_ids)
+        if checkpoints:
+            self.get_logger().info(f"Resuming warmup of {endpoint}: {len(checkpoints)}/{len(terminal_ids)} done")
+        for terminal_id in terminal_ids:
+            if terminal_id not in checkpoints:
+                await fetch(terminal_id)
+        if await self.cache.complete_warmup(endpoint, param, terminal_ids):
+            return True, terminal_ids
+        # Some terminals were fetched without being cached (failed requests)
+        checkpoints = await self.cache.get_warmup_checkpoints(endpoint, param, terminal_ids)
+        self.get_logger().warning(f"Warmup of {endpoint} incomplete: {len(checkpoints)}/{len(terminal_ids)} loaded")
+        return False, [terminal_id for terminal_id in terminal_ids if terminal_id in checkpoints]
+
+    @Metrics.track_async_fnc_exec
+    async def fetch_price_history(self, id_terminal=None, id_commodity=None, start=None, end=None):
+        """
+        Returns the recorded price changes of the selected game version between start and end
+        (epoch seconds, the whole retention period by default), oldest first.
+        """
+        await self.ensure_initialized()
+        selected_version = await self.config_manager.get_version_value()
+        return await self.cache.get_price_history(id_terminal, id_commodity, selected_version, start, end)
 
     @Metrics.track_sync_fnc_exec
     def _filter_std_planets(self, planets):
@@ -336,7 +386,7 @@ class API:
             params = {'id_star_system': system_id}
         if planet_id:
             planet_params = {'id_planet': planet_id}
-            planets = self.cache.get("/planets", planet_params)
+            planets = await self.cache.get_rows("/planets", planet_params)
             if planets:
                 return planets
         planets = await self._fetch_planets(params)
@@ -365,7 +415,7 @@ class API:
         params = {'id_planet': planet_id}
         if filtering_terminal:
             terminal_params = {'id_terminal': filtering_terminal}
-            terminals = self.cache.get("/terminals", terminal_params)
+            terminals = await self.cache.get_rows("/terminals", terminal_params)
             if terminals:
                 return terminals
         terminals = await self._fetch_terminals(params)
@@ -392,7 +442,7 @@ class API:
     @Metrics.track_async_fnc_exec
     async def fetch_system(self, system_id):
         system_params = {'id_star_system': system_id}
-        systems = self.cache.get("/star_systems", system_params)
+        systems = await self.cache.get_rows("/star_systems", system_params)
         if systems:
             return systems
         systems = await self._fetch_systems()
@@ -405,26 +455,36 @@ class API:
         game_versions, cached = await self._fetch_data(endpoint, data_only=False)
         return game_versions.get("data", {})
 
+    @Metrics.track_async_fnc_exec
+    async def refresh_endpoint(self, endpoint):
+        """Purges the cache of endpoint and loads it again when it is one of the preloaded endpoints."""
+        await self.cache.purge_endpoint(endpoint)
+        refresh_functions = {
+            "/game_versions": self.fetch_versions,
+            "/star_systems": self.fetch_all_systems,
+            "/planets": self.fetch_planets,
+            "/terminals": self.fetch_all_terminals,
+            "/commodities": self.fetch_all_commodities,
+            "/commodities_prices": self.fetch_all_commodities_prices,
+            "/commodities_routes": self.fetch_all_routes
+        }
+        if endpoint in refresh_functions:
+            await refresh_functions[endpoint]()
+
     @Metrics.track_async_fnc_exec
     async def perform_trade(self, data):
-        """Performs a trade operation (buy/sell)."""
+        """Queues a trade operation (buy/sell) in the outbox and returns its outbox key."""
         # TODO - Check if data is formed properly considering user_trades_add endpoint
-        return await self._post_data("/user_trades_add/", data)
+        return self.outbox.enqueue("/user_trades_add/", data)
 
     @Metrics.track_async_fnc_exec
     async def fetch_all_routes(self):
         endpoint = "/commodities_routes"
-        all_terminals = await self.fetch_all_terminals()
-        all_routes = []
-        for terminal_origin in all_terminals:
-            params = {
-                'id_terminal_origin': terminal_origin['id']
-            }
-            routes_from_origin = await self._fetch_commodities_routes(params)
-            for route in routes_from_origin:
-                params['id_terminal_destination'] = route['id_terminal_destination']
-                self.cache.set(endpoint, params, [route])
-            all_routes.extend(routes_from_origin)  # TODO - Store all routes in cache ?
+        complete, _ = await self._warm_up(
+            endpoint, 'id_terminal_origin',
+            lambda id_terminal: self._fetch_commodities_routes({'id_terminal_origin': id_terminal}))
+        if not complete:
+            self.get_logger().warning("Routes of the terminals left are fetched by origin terminal when searched")
 
     @Metrics.track_async_fnc_exec
     async def fetch_distance(self, id_terminal_origin, id_terminal_destination):
@@ -469,5 +529,5 @@ class API:
             }
             data['prices'].append(price)
 
-        logger.debug(f"Submitting commodities to terminal {id_commodity_terminal}")
-        return await self._post_data("/data_submit/", data)
+        logger.debug(f"Queuing commodities submission to terminal {id_commodity_terminal}")
+        return self.outbox.enqueue("/data_submit/", data)
@@ -0,0 +1,246 @@
+# async_cache_manager.py
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from atexit import register
+from concurrent.futures import ThreadPoolExecutor
+
+from cache_manager import CacheManager, canonical_params
+from global_variables import cache_maintenance_activated, cache_maintenance_interval
+from global_variables import cache_maintenance_idle_delay, cache_maintenance_check_interval
+from global_variables import metrics_tracing_activated
+from metrics import Metrics
+
+
+class AsyncCacheManager:
+    """
+    An asynchronous facade of CacheManager for coroutines of the Qt event loop.
+
+    Every backend operation (SQLite queries, JSON encoding and decoding,
+    compression) runs on a single dedicated I/O thread, which owns the cache
+    connections, and is returned as an awaitable: the event loop never waits
+    on the disk.
+
+    Writes are queued and the worker writes everything queued so far in a
+    single transaction, so a burst of set() calls costs one commit. Queued
+    values are answered by get() until they are written, and operations run
+    on the worker in submission order, so reads always see earlier writes.
+
+    Operations the callers don't wait for (writes, releases, purges...) are
+    submitted in the background: their failures on the I/O thread are logged
+    instead of being lost with their unawaited future.
+
+    Once started, a maintenance task compacts the database while the cache
+    is idle: at most once per maintenance interval, or at the next idle time
+    after entries were removed (obsolete, evicted, purged or cleared).
+
+    >>> cache = AsyncCacheManager(backend="local")
+    >>> cache.set('/foo', {'id': 1}, ['bar'])
+    >>> await cache.get('/foo', {'id': 1})
+    ['bar']
+    """
+    def __init__(self, backend="persistent", config_manager=None):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-io")
+        # Connections are created on the I/O thread, which is the only one using them
+        self.sync = self._executor.submit(CacheManager, backend, config_manager).result()
+        self._pending_writes = {}
+        self._pending_lock = threading.Lock()
+        self._write_future = None
+        self._last_activity = time.monotonic()
+        self._last_maintenance = time.monotonic()
+        self._maintenance_due = False
+        self._maintenance_worker = None
+        register(self._executor.shutdown)
+
+    def get_logger(self):
+        return logging.getLogger(__name__)
+
+    def _submit(self, fnc, *args):
+        self._last_activity = time.monotonic()
+        if metrics_tracing_activated:
+            # Spans of the I/O thread are recorded in the trace of the calling task
+            return asyncio.wrap_future(self._executor.submit(contextvars.copy_context().run, fnc, *args))
+        return asyncio.wrap_future(self._executor.submit(fnc, *args))
+
+    def _submit_background(self, fnc, *args):
+        """Submits an operation the caller may not wait for, and logs its failure."""
+        return self._background(self._submit(fnc, *args), fnc.__name__)
+
+    def _background(self, future, name):
+        def log_failure(done_future):
+            if not done_future.cancelled() and done_future.exception() is not None:
+                self.get_logger().error(f"Cache operation {name} failed", exc_info=done_future.exception())
+        future.add_done_callback(log_failure)
+        return future
+
+    @staticmethod
+    def _retrieved(future):
+        # The failure is logged once by the write itself, not by every caller which didn't wait for it
+        future.add_done_callback(lambda done_future: done_future.cancelled() or done_future.exception())
+        return future
+
+    @Metrics.track_sync_fnc_exec
+    def start_maintenance(self):
+        if cache_maintenance_activated and (self._maintenance_worker is None or self._maintenance_worker.done()):
+            self._maintenance_worker = asyncio.ensure_future(self._run_maintenance())
+
+    @Metrics.track_async_fnc_exec
+    async def stop_maintenance(self):
+        if self._maintenance_worker is not None:
+            self._maintenance_worker.cancel()
+            try:
+                await self._maintenance_worker
+            except asyncio.CancelledError:
+                pass
+            self._maintenance_worker = None
+
+    async def _run_maintenance(self):
+        while True:
+            await asyncio.sleep(cache_maintenance_check_interval)
+            if self._is_maintenance_due():
+                await self.maintain()
+
+    def _is_maintenance_due(self):
+        now = time.monotonic()
+        if now - self._last_activity < cache_maintenance_idle_delay:
+            return False
+        return self._maintenance_due or now - self._last_maintenance >= cache_maintenance_interval
+
+    @Metrics.track_async_fnc_exec
+    async def maintain(self):
+        """Runs the maintenance of the database now (incremental vacuum, ANALYZE, WAL checkpoint)."""
+        self._maintenance_due = False
+        self._last_maintenance = time.monotonic()
+        # Not counted as an activity, maintenance must not delay itself
+        return await asyncio.wrap_future(self._executor.submit(self.sync.maintain))
+
+    @Metrics.track_async_fnc_exec
+    async def get(self, endpoint, params):
+        with self._pending_lock:
+            pending_write = self._pending_writes.get((endpoint, canonical_params(params)))
+        if pending_write is not None:
+            return pending_write[1]
+        return await self._submit(self.sync.get, endpoint, params)
+
+    @Metrics.track_sync_fnc_exec
+    def set(self, endpoint, params, data=[]):
+        """Queues a write and returns an awaitable resolved once it is on disk."""
+        self._last_activity = time.monotonic()
+        with self._pending_lock:
+            self._pending_writes[(endpoint, canonical_params(params))] = (params, data)
+            if self._write_future is None:
+                self._write_future = self._background(self._executor.submit(self._write_pending), "set")
+            write_future = self._write_future
+        return self._retrieved(asyncio.wrap_future(write_future))
+
+    def _write_pending(self):
+        with self._pending_lock:
+            pending_writes = self._pending_writes
+            self._pending_writes = {}
+            self._write_future = None
+        with self.sync.batch():
+            for (endpoint, _), (params, data) in pending_writes.items():
+                self.sync.set(endpoint, params, data)
+
+    @Metrics.track_async_fnc_exec
+    async def flush(self):
+        """Waits until every queued write is on disk."""
+        await self._submit(lambda: None)
+
+    @Metrics.track_sync_fnc_exec
+    def supports_rows(self, endpoint, params):
+        # Only checks the params against the schema of the store, without any I/O
+        return self.sync.supports_rows(endpoint, params)
+
+    @Metrics.track_async_fnc_exec
+    async def get_rows(self, endpoint, params, partition=None, snapshot=None):
+        return await self._submit(self.sync.get_rows, endpoint, params, partition, snapshot)
+
+    @Metrics.track_async_fnc_exec
+    async def pin_snapshot(self):
+        return await self._submit(self.sync.pin_snapshot)
+
+    @Metrics.track_sync_fnc_exec
+    def release_snapshot(self, snapshot):
+        return self._submit_background(self.sync.release_snapshot, snapshot)
+
+    @Metrics.track_async_fnc_exec
+    async def acquire_lease(self, endpoint, params):
+        return await self._submit(self.sync.acquire_lease, endpoint, params)
+
+    @Metrics.track_sync_fnc_exec
+    def release_lease(self, endpoint, params):
+        # Runs after the writes queued so far: waiting processes find the result once the lease is released
+        return self._submit_background(self.sync.release_lease, endpoint, params)
+
+    @Metrics.track_sync_fnc_exec
+    def filter_partition(self, endpoint, rows, partition):
+        return self.sync.filter_partition(endpoint, rows, partition)
+
+    @Metrics.track_sync_fnc_exec
+    def set_rows(self, endpoint, params, rows):
+        return self._submit_background(self.sync.set_rows, endpoint, params, rows)
+
+    @Metrics.track_async_fnc_exec
+    async def get_price_history(self, id_terminal=None, id_commodity=None, game_version=None, start=None, end=None):
+        return await self._submit(self.sync.get_price_history, id_terminal, id_commodity, game_version, start, end)
+
+    @Metrics.track_async_fnc_exec
+    async def get_warmup_checkpoints(self, endpoint, param, values):
+        return await self._submit(self.sync.get_warmup_checkpoints, endpoint, param, values)
+
+    @Metrics.track_async_fnc_exec
+    async def complete_warmup(self, endpoint, param, values):
+        return await self._submit(self.sync.complete_warmup, endpoint, param, values)
+
+    @Metrics.track_async_fnc_exec
+    async def is_warm(self, endpoint):
+        return await self._submit(self.sync.is_warm, endpoint)
+
+    @Metrics.track_async_fnc_exec
+    async def endpoint_exists_in_cache(self, endpoint):
+        return await self._submit(self.sync.endpoint_exists_in_cache, endpoint)
+
+    @Metrics.track_sync_fnc_exec
+    def invalidate(self, endpoint, params):
+        with self._pending_lock:
+            self._pending_writes.pop((endpoint, canonical_params(params)), None)
+        return self._submit_background(self.sync.invalidate, endpoint, params)
+
+    @Metrics.track_sync_fnc_exec
+    def enforce_max_size(self):
+        self._maintenance_due = True
+        return self._submit_background(self.sync.enforce_max_size)
+
+    @Metrics.track_async_fnc_exec
+    async def get_stats(self):
+        return await self._submit(self.sync.get_stats)
+
+    @Metrics.track_sync_fnc_exec
+    def purge_endpoint(self, endpoint):
+        with self._pending_lock:
+            self._pending_writes = {key: write for key, write in self._pending_writes.items() if key[0] != endpoint}
+        self._maintenance_due = True
+        return self._submit_background(self.sync.purge_endpoint, endpoint)
+
+    @Metrics.track_async_fnc_exec
+    async def export_snapshot(self, path, endpoints=None):
+        return await self._submit(self.sync.export_snapshot, path, endpoints)
+
+    @Metrics.track_async_fnc_exec
+    async def import_snapshot(self, path, fresh=False):
+        return await self._submit(self.sync.import_snapshot, path, fresh)
+
+    @Metrics.track_sync_fnc_exec
+    def clean_obsolete(self):
+        self._maintenance_due = True
+        return self._submit_background(self.sync.clean_obsolete)
+
+    @Metrics.track_sync_fnc_exec
+    def clear(self):
+        with self._pending_lock:
+            self._pending_writes.clear()
+        self._maintenance_due = True
+        return self._submit_background(self.sync.clear)
@@ -341,6 +341,8 @@ class BestTradeRouteTab(QWidget):
             planets = await self.api.fetch_planets(system_id, planet_id)
         return planets
 
+    @Metrics.capture_profile
+    @Metrics.record_trace
     @Metrics.track_async_fnc_exec
     async def find_best_trade_routes_rework(self):
         await self.ensure_initialized()
@@ -359,7 +361,9 @@ class BestTradeRouteTab(QWidget):
         progress_qprogressbar(self.main_progress_bar, current_progress,
                               f"{translate_main_step} {current_progress}/{max_progress}: "
                               + await translate("main_progress_loading_departure_planets"))
+        pinned_snapshot = None
         try:
+            pinned_snapshot = await self.api.pin_cache_snapshot()
             # [Recover entry parameters]
             departure_system_id, departure_planet_id, destination_system_id, destination_planet_id = \
                 await self.get_selected_ids()
@@ -457,6 +461,8 @@ class BestTradeRouteTab(QWidget):
             await self.main_widget.set_gui_enabled(True)
             self.progress_bar.setVisible(False)
             self.main_progress_bar.setVisible(False)
+            if pinned_snapshot is not None:
+                self.api.release_cache_snapshot(pinned_snapshot)
 
     @Metrics.track_async_fnc_exec
     async def get_input_values(self):
@@ -0,0 +1,36 @@
+# cache_codecs.py
+import bz2
+import lzma
+import zlib
+
+# Codec stored with each value: id -> (name, compress, decompress)
+codecs = {
+    0: ("none", None, None),
+    1: ("zlib", zlib.compress, zlib.decompress),
+    2: ("lzma", lzma.compress, lzma.decompress),
+    3: ("bz2", bz2.compress, bz2.decompress)
+}
+
+
+def codec_id(name):
+    """Returns the id of the codec called name, 0 (no compression) if unknown."""
+    return next((codec for codec, (codec_name, _, _) in codecs.items() if codec_name == name), 0)
+
+
+def compress(value, codec, threshold):
+    """
+    Returns (stored value, codec) of value (bytes): compressed with codec when
+    it is at least threshold bytes long and compression makes it smaller.
+    """
+    if codec == 0 or len(value) < threshold:
+        return value, 0
+    compressed_value = codecs[codec][1](value)
+    if len(compressed_value) >= len(value):
+        return value, 0
+    return compressed_value, codec
+
+
+def decompress(stored_value, codec):
+    if codec == 0:
+        return stored_value
+    return codecs[codec][2](stored_value)
@@ -0,0 +1,51 @@
+# cache_maintenance.py
+import logging
+import sqlite3
+import time
+
+from global_variables import cache_pragma_profiles, cache_maintenance_vacuum_pages
+
+
+def apply_pragma_profile(con, profile):
+    """
+    Applies the PRAGMA settings of a profile of cache_pragma_profiles to a connection.
+
+    Incremental vacuum is enabled first: it is only effective on a new file,
+    before any table is created and before the file is switched to WAL.
+    """
+    pragmas = {"auto_vacuum": "INCREMENTAL", **cache_pragma_profiles.get(profile, {})}
+    for pragma, value in pragmas.items():
+        try:
+            con.execute(f"PRAGMA {pragma} = {value};")
+        except sqlite3.OperationalError:
+            continue  # TODO - Log error instead
+
+
+def maintain_database(con, vacuum_pages=cache_maintenance_vacuum_pages):
+    """
+    Compacts and tunes a database file, and returns the duration of the run.
+
+    Free pages left by removed entries are released with an incremental
+    vacuum, bounded to vacuum_pages per run so it never holds the database
+    for long. Files created before incremental vacuum was enabled are
+    converted once by a full VACUUM. Query planner statistics are refreshed
+    with a bounded ANALYZE, and the WAL file is checkpointed and truncated.
+    """
+    start_time = time.time()
+    try:
+        if con.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+            con.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            try:
+                con.execute("VACUUM;")
+            except sqlite3.OperationalError as e:
+                # Fails while another connection reads the file, tried again at the next maintenance
+                logging.getLogger(__name__).warning(f"Cache database could not be converted to incremental vacuum: {e}")
+        else:
+            con.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)});").fetchall()
+        con.execute("PRAGMA analysis_limit = 1000;")
+        con.execute("ANALYZE;")
+        con.commit()
+        con.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchall()
+    except sqlite3.OperationalError as e:
+        logging.getLogger(__name__).warning(f"Cache database maintenance failed: {e}")
+    return time.time() - start_time
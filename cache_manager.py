@@ -1,17 +1,58 @@
 # cache_manager.py
 from atexit import register
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+import contextvars
+import gzip
 import json
+import mmap
 import os
+import re
 import sqlite3
+import struct
 import time
 import hashlib
+import heapq
 import logging
+import zlib
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
 
-from datetime import datetime, timedelta
 from platformdirs import user_data_dir
-from global_variables import app_name, cache_db_file
+from global_variables import app_name, cache_db_file, cache_busy_timeout
 from global_variables import system_ttl, planet_ttl, terminal_ttl, default_ttl
+from global_variables import memory_cache_activated, memory_cache_max_entries, memory_cache_max_bytes
+from global_variables import memory_cache_row_endpoints
+from global_variables import price_history_activated
+from global_variables import cache_eviction_weights, cache_eviction_low_watermark, cache_eviction_check_ratio
+from global_variables import default_cache_max_size
+from global_variables import cache_compression_algorithm, cache_compression_threshold
+from global_variables import cache_snapshot_version, cache_pragma_profile
+from global_variables import cache_log_dir, cache_log_segment_size, cache_log_compaction_ratio
+from cache_codecs import codecs, codec_id, compress, decompress
+from cache_maintenance import apply_pragma_profile, maintain_database
 from metrics import Metrics
+from row_store import RowStore
+from fetch_leases import FetchLeases
+from price_history import PriceHistory
+
+
+def canonical_params(params):
+    """
+    Returns the canonical cache key of request params.
+
+    Params are encoded as compact JSON with sorted keys, so the same params
+    always give the same key whatever their insertion order, while values
+    keep their type. No params (None or {}) is the empty string.
+    >>> canonical_params({'id_terminal': 1, 'id_commodity': 2})
+    '{"id_commodity":2,"id_terminal":1}'
+    """
+    if params is None or params == {}:
+        return ""
+    return json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
 
 
 class DictCacheBackend:
@@ -21,101 +62,203 @@ class DictCacheBackend:
     Everything is stored in memory, so this cache is not suitable for large
     amounts of data, but it's useful for development purposes.
 
-    This cache backend acts as a wrapper around the built-in dict type.
+    Entries are stored by (endpoint, params) with an absolute expiry time.
     >>> cache = DictCacheBackend()
-    >>> cache['foo'] = 'bar'
-    >>> cache['foo']
-    bar
-
-    But it also supports time-to-live (TTL) for cache entries.
-
-    >>> cache = DictCacheBackend(ttl=3)
-    >>> cache['foo'] = 'bar'
-    >>> cache['foo']
+    >>> cache.set('/foo', 'params', 'bar', ttl=3)
+    >>> cache.get('/foo', 'params')
     bar
     >>> time.sleep(5)
-    >>> cache['foo']
+    >>> cache.get('/foo', 'params')
     None
 
-    Properties:
-        ttl (int): The time-to-live for cache entries in seconds.
-
-    Methods:
-        clear():
-            Clears all entries in the cache.
+    An index of params per endpoint answers contains_endpoint() without a
+    full scan, and a heap of expiry times lets clean_obsolete() only visit
+    the entries which actually expired.
     """
     def __init__(self):
         self.__cache = {}
+        self.__endpoints = {}
+        self.__expiry_heap = []
 
     def clear(self):
         self.__cache.clear()
+        self.__endpoints.clear()
+        self.__expiry_heap.clear()
 
-    def clean_obsolete(self, ttl: int):
-        obsolete_ts = time.time() - ttl
-        to_remove = []
-        for key in self.__cache:
-            value = self.__cache[key]
-            if value['timestamp'] < obsolete_ts:
-                to_remove.append(key)
-        for remove_key in to_remove:
-            del self.__cache[remove_key]
+    def clean_obsolete(self):
+        now = time.time()
+        while self.__expiry_heap and self.__expiry_heap[0][0] <= now:
+            expires_at, endpoint, params = heapq.heappop(self.__expiry_heap)
+            entry = self.__cache.get((endpoint, params))
+            # Entries rewritten since then have a newer expiry and stay in cache
+            if entry is not None and entry['expires_at'] == expires_at:
+                self.delete(endpoint, params)
 
-    def __getitem__(self, key):
-        return self.__cache.get(key, None)
+    def get(self, endpoint, params):
+        entry = self.__cache.get((endpoint, params))
+        if entry is None or entry['expires_at'] <= time.time():
+            return None
+        return entry['data']
 
-    def __setitem__(self, key, value):
-        self.__cache[key] = {
-            'data': value,
-            'timestamp': time.time()
-        }
+    def set(self, endpoint, params, value, ttl):
+        self.set_many([(endpoint, params, value, ttl)])
 
-    def __delitem__(self, key):
-        del self.__cache[key]
+    def set_many(self, items):
+        timestamp = time.time()
+        for endpoint, params, value, ttl in items:
+            expires_at = timestamp + ttl
+            self.__cache[(endpoint, params)] = {
+                'data': value,
+                'timestamp': timestamp,
+                'expires_at': expires_at
+            }
+            self.__endpoints.setdefault(endpoint, set()).add(params)
+            heapq.heappush(self.__expiry_heap, (expires_at, endpoint, params))
 
-    def __contains__(self, key):
-        return key in self.__cache
+    def delete(self, endpoint, params):
+        if self.__cache.pop((endpoint, params), None) is not None:
+            endpoint_params = self.__endpoints[endpoint]
+            endpoint_params.discard(params)
+            if not endpoint_params:
+                del self.__endpoints[endpoint]
+
+    def contains(self, endpoint, params):
+        return self.get(endpoint, params) is not None
 
     def contains_endpoint(self, endpoint):
-        for key in self.__cache:
-            key_endpoint = '_'.join(key.split('_')[:-1])
-            if key_endpoint == endpoint:
-                return True
-        return False
+        now = time.time()
+        return any(self.__cache[(endpoint, params)]['expires_at'] > now
+                   for params in self.__endpoints.get(endpoint, ()))
+
+    def touch(self, endpoint, params):
+        return
+
+    def evict(self, max_bytes):
+        # Nothing is stored on disk, entries only leave the cache when obsolete
+        return 0
+
+    def delete_endpoint(self, endpoint):
+        for params in list(self.__endpoints.get(endpoint, ())):
+            self.delete(endpoint, params)
+
+    def maintain(self):
+        return 0
+
+    def endpoint_stats(self):
+        """Returns {endpoint: {entries, bytes, oldest, newest, evictions}} of the valid entries."""
+        now = time.time()
+        stats = {}
+        for endpoint, endpoint_params in self.__endpoints.items():
+            entries = [self.__cache[(endpoint, params)] for params in endpoint_params]
+            entries = [entry for entry in entries if entry['expires_at'] > now]
+            if entries:
+                stats[endpoint] = {
+                    'entries': len(entries),
+                    'bytes': sum(len(json.dumps(entry['data'])) for entry in entries),
+                    'oldest': min(entry['timestamp'] for entry in entries),
+                    'newest': max(entry['timestamp'] for entry in entries),
+                    'evictions': 0
+                }
+        return stats
 
 
 class SQLiteCacheBackend:
     """
     A SQLite-based cache backend with time-to-live (TTL) support.
+
+    Each entry is stored once per (endpoint, params) with its absolute expiry
+    time (epoch seconds), so lookups, endpoint existence checks and expiry
+    are all single indexed queries.
+
+    Every entry also tracks its stored size, hit count and last access time,
+    so evict() can keep the cache within a size budget. Accesses are counted
+    in memory and written in batches to keep reads free of writes.
+
+    Values larger than compression_threshold bytes are compressed with the
+    compression algorithm (zlib, lzma or bz2) when it makes them smaller;
+    the codec used is stored per entry so every entry can be read back.
     """
+    schema_version = 5
+    access_flush_threshold = 512
+    # Codec stored per entry: id -> (name, compress, decompress)
+    codecs = codecs
 
-    def __init__(self, in_memory=False):
+    def __init__(self, in_memory=False, eviction_weights=cache_eviction_weights,
+                 compression=cache_compression_algorithm, compression_threshold=cache_compression_threshold,
+                 pragma_profile=cache_pragma_profile):
         if in_memory is True:
             self.db_path = ":memory:"
         else:
             db_dir = user_data_dir(app_name, ensure_exists=True)
             self.db_path = os.path.join(db_dir, cache_db_file)
 
-        self.con = sqlite3.connect(self.db_path)
+        self.eviction_weights = eviction_weights
+        self.compression_codec = codec_id(compression)
+        self.compression_threshold = compression_threshold
+        self._pending_accesses = {}
+        self.evictions = Counter()
+        # Used from the cache I/O thread only, but closed at exit from the main thread
+        self.con = sqlite3.connect(self.db_path, timeout=cache_busy_timeout, check_same_thread=False)
+        # Before the tables are created, the profile enables incremental vacuum
+        apply_pragma_profile(self.con, pragma_profile if in_memory is not True else "default")
         self.__create_table()
         register(self.con.close)
 
     def __create_table(self):
         cur = self.con.cursor()
         try:
+            version = cur.execute("PRAGMA user_version;").fetchone()[0]
+            if version < 2:
+                # Entries of older schemas are only a cache of the API: drop them and warm up again
+                cur.execute("DROP TABLE IF EXISTS cache;")
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS cache (
-                    key TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    params TEXT NOT NULL,
                     value TEXT,
-                    timestamp TEXT
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    hits INTEGER NOT NULL DEFAULT 0,
+                    last_access REAL NOT NULL DEFAULT 0,
+                    codec INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (endpoint, params)
                 )
             """)
+            if version == 2:
+                cur.execute("ALTER TABLE cache ADD COLUMN size INTEGER NOT NULL DEFAULT 0;")
+                cur.execute("ALTER TABLE cache ADD COLUMN hits INTEGER NOT NULL DEFAULT 0;")
+                cur.execute("ALTER TABLE cache ADD COLUMN last_access REAL NOT NULL DEFAULT 0;")
+                cur.execute("UPDATE cache SET size = LENGTH(value), last_access = created_at;")
+            if version in (2, 3):
+                cur.execute("ALTER TABLE cache ADD COLUMN codec INTEGER NOT NULL DEFAULT 0;")
+            if 2 <= version < 5:
+                self.__migrate_hashed_params(cur)
+            cur.execute("CREATE INDEX IF NOT EXISTS cache_endpoint ON cache (endpoint, expires_at);")
+            cur.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at);")
+            cur.execute(f"PRAGMA user_version = {self.schema_version};")
             self.con.commit()
         except sqlite3.OperationalError:
             return  # TODO - Log error instead
         finally:
             cur.close()
 
+    @staticmethod
+    def __migrate_hashed_params(cur):
+        """
+        Rewrites the md5 hashed params of older schemas as canonical params.
+
+        Hashes can't be reversed: only the entries requested without params
+        are kept under their new key, the others are dropped and fetched again.
+        """
+        for params in (None, {}):
+            hashed_params = hashlib.md5(str(params).encode('utf-8')).hexdigest()
+            cur.execute("UPDATE OR REPLACE cache SET params = ? WHERE params = ?;",
+                        [canonical_params(params), hashed_params])
+        cur.execute("DELETE FROM cache WHERE params != ?;", [canonical_params(None)])
+
     def clear(self):
+        self._pending_accesses.clear()
         cur = self.con.cursor()
         try:
             cur.execute("DELETE FROM cache;")
@@ -125,160 +268,880 @@ class SQLiteCacheBackend:
         finally:
             cur.close()
 
-    def clean_obsolete(self, ttl: int):
-        # Calculate the threshold timestamp
-        threshold_time = datetime.now() - timedelta(seconds=ttl)
-        threshold_time_iso = threshold_time.isoformat()
-
-        # Execute the DELETE statement
+    def clean_obsolete(self):
         cur = self.con.cursor()
         try:
-            cur.execute("""
-                DELETE FROM cache
-                WHERE timestamp < ?;
-            """, [threshold_time_iso])
+            cur.execute("DELETE FROM cache WHERE expires_at <= ?;", [time.time()])
             self.con.commit()
         except sqlite3.OperationalError:
             return  # TODO - Log error instead
         finally:
             cur.close()
 
-    def __getitem__(self, key):
+    def get(self, endpoint, params):
+        entry = self.get_entry(endpoint, params)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, endpoint, params):
+        """Returns (data, expires_at, encoded size) of a valid entry, or None."""
         cur = self.con.cursor()
         res = cur.execute("""
-            SELECT value, timestamp
+            SELECT value, expires_at, codec
                 FROM cache
-                WHERE key = ?;
-        """, [key]).fetchone()
+                WHERE endpoint = ? AND params = ? AND expires_at > ?;
+        """, [endpoint, params, time.time()]).fetchone()
         cur.close()
 
         if res is None:
             return None
+        self.touch(endpoint, params)
+        encoded_value = self._decode(res[0], res[2])
+        return json.loads(encoded_value), res[1], len(encoded_value)
+
+    def _encode(self, encoded_value):
+        """Returns (stored value, codec) of a JSON encoded value."""
+        if len(encoded_value) < self.compression_threshold:
+            return encoded_value, 0
+        compressed_value, codec = compress(encoded_value.encode('utf-8'), self.compression_codec,
+                                           self.compression_threshold)
+        return (compressed_value, codec) if codec else (encoded_value, 0)
 
-        return {
-            "data": json.loads(res[0]),
-            "timestamp": datetime.fromisoformat(res[1]).timestamp()
-        }
+    def _decode(self, stored_value, codec):
+        if codec == 0:
+            return stored_value
+        return decompress(stored_value, codec).decode('utf-8')
 
-    def __setitem__(self, key, value):
+    def touch(self, endpoint, params):
+        """Records an access to an entry, used by the eviction policy."""
+        hits, _ = self._pending_accesses.get((endpoint, params), (0, 0))
+        self._pending_accesses[(endpoint, params)] = (hits + 1, time.time())
+        if len(self._pending_accesses) >= self.access_flush_threshold:
+            self._flush_accesses()
+
+    def _flush_accesses(self):
+        if not self._pending_accesses:
+            return
+        accesses = self._pending_accesses
+        self._pending_accesses = {}
         cur = self.con.cursor()
         try:
-            cur.execute("""
-                INSERT INTO cache
-                VALUES (:key, :value, :ts)
-                ON CONFLICT(key) DO UPDATE SET value = :value, timestamp = :ts;
-            """, {
-                "key": key,
-                "value": json.dumps(value),
-                "ts": datetime.now().isoformat()
-            })
+            cur.executemany("""
+                UPDATE cache
+                SET hits = hits + ?, last_access = MAX(last_access, ?)
+                WHERE endpoint = ? AND params = ?;
+            """, [(hits, last_access, endpoint, params)
+                  for (endpoint, params), (hits, last_access) in accesses.items()])
             self.con.commit()
         except sqlite3.OperationalError:
+            self.con.rollback()
             return  # TODO - Log error instead
         finally:
             cur.close()
 
-    def __delitem__(self, key):
+    def set(self, endpoint, params, value, ttl):
+        return self.set_many([(endpoint, params, value, ttl)])
+
+    def set_many(self, items):
+        """Writes (endpoint, params, value, ttl) items and returns the JSON encoded size of each value."""
+        now = time.time()
+        rows = []
+        sizes = []
+        for endpoint, params, value, ttl in items:
+            encoded_value = json.dumps(value)
+            stored_value, codec = self._encode(encoded_value)
+            rows.append((endpoint, params, stored_value, now, now + ttl, len(stored_value), now, codec))
+            sizes.append(len(encoded_value))
         cur = self.con.cursor()
         try:
-            cur.execute("DELETE FROM cache WHERE key = ?;", [key])
+            # Single transaction for the whole batch : one commit instead of one per key
+            cur.executemany("""
+                INSERT INTO cache (endpoint, params, value, created_at, expires_at, size, last_access, codec)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(endpoint, params) DO UPDATE SET value = excluded.value,
+                    created_at = excluded.created_at, expires_at = excluded.expires_at,
+                    size = excluded.size, last_access = excluded.last_access, codec = excluded.codec;
+            """, rows)
+            self.con.commit()
+        except sqlite3.OperationalError:
+            self.con.rollback()
+            return None  # TODO - Log error instead
+        finally:
+            cur.close()
+        return sizes
+
+    def delete(self, endpoint, params):
+        cur = self.con.cursor()
+        try:
+            cur.execute("DELETE FROM cache WHERE endpoint = ? AND params = ?;", [endpoint, params])
             self.con.commit()
         except sqlite3.OperationalError:
             return  # TODO - Log error instead
         finally:
             cur.close()
 
-    def __contains__(self, key):
-        return self.__getitem__(key) is not None
+    def contains(self, endpoint, params):
+        cur = self.con.cursor()
+        res = cur.execute("""
+            SELECT 1
+            FROM cache
+            WHERE endpoint = ? AND params = ? AND expires_at > ?;
+        """, [endpoint, params, time.time()]).fetchone()
+        cur.close()
+        return res is not None
 
     def contains_endpoint(self, endpoint):
         cur = self.con.cursor()
         res = cur.execute("""
-            SELECT COUNT(1)
+            SELECT 1
             FROM cache
-            WHERE key LIKE ? || '\_%' ESCAPE '\\';
-        """, [endpoint]).fetchone()
+            WHERE endpoint = ? AND expires_at > ?
+            LIMIT 1;
+        """, [endpoint, time.time()]).fetchone()
         cur.close()
+        return res is not None
 
-        if res is None:
+    def total_size(self):
+        cur = self.con.cursor()
+        res = cur.execute("SELECT COALESCE(SUM(size), 0) FROM cache;").fetchone()
+        cur.close()
+        return res[0]
+
+    def evict(self, max_bytes):
+        """
+        Removes entries until the encoded size of the cache is below max_bytes
+        (minus a margin), and returns the number of removed entries.
+
+        Expired entries go first, then the entries with the lowest score:
+        (hits + 1) * endpoint weight / seconds since last access. Rarely used
+        entries of cheap endpoints are evicted before hot reference data.
+        """
+        total_size = self.total_size()
+        if total_size <= max_bytes:
+            return 0
+        self.clean_obsolete()
+        self._flush_accesses()
+        to_free = self.total_size() - max_bytes * cache_eviction_low_watermark
+        weight_case = " ".join("WHEN ? THEN ?" for _ in self.eviction_weights)
+        weight_params = [item for endpoint_weight in self.eviction_weights.items() for item in endpoint_weight]
+        cur = self.con.cursor()
+        try:
+            candidates = cur.execute(f"""
+                SELECT endpoint, params, size
+                FROM cache
+                ORDER BY (hits + 1) * (CASE endpoint {weight_case} ELSE 1 END) / (? - last_access + 60.0);
+            """, weight_params + [time.time()])
+            evicted = []
+            for endpoint, params, size in candidates:
+                if to_free <= 0:
+                    break
+                evicted.append((endpoint, params))
+                to_free -= size
+            cur.executemany("DELETE FROM cache WHERE endpoint = ? AND params = ?;", evicted)
+            self.con.commit()
+        except sqlite3.OperationalError:
+            self.con.rollback()
+            return 0  # TODO - Log error instead
+        finally:
+            cur.close()
+        self.evictions.update(endpoint for endpoint, _ in evicted)
+        return len(evicted)
+
+    def delete_endpoint(self, endpoint):
+        self._pending_accesses = {key: access for key, access in self._pending_accesses.items() if key[0] != endpoint}
+        cur = self.con.cursor()
+        try:
+            cur.execute("DELETE FROM cache WHERE endpoint = ?;", [endpoint])
+            self.con.commit()
+        except sqlite3.OperationalError:
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+
+    def maintain(self):
+        """Compacts the database file (shared with the row store), and returns the duration of the run."""
+        self._flush_accesses()
+        return maintain_database(self.con)
+
+    def endpoint_stats(self):
+        """Returns {endpoint: {entries, bytes, oldest, newest, evictions}} of the valid entries."""
+        cur = self.con.cursor()
+        rows = cur.execute("""
+            SELECT endpoint, COUNT(1), SUM(size), MIN(created_at), MAX(created_at)
+            FROM cache
+            WHERE expires_at > ?
+            GROUP BY endpoint;
+        """, [time.time()]).fetchall()
+        cur.close()
+        return {endpoint: {'entries': entries, 'bytes': size, 'oldest': oldest, 'newest': newest,
+                           'evictions': self.evictions[endpoint]}
+                for endpoint, entries, size, oldest, newest in rows}
+
+
+class LogCacheBackend:
+    """
+    A log-structured cache backend with time-to-live (TTL) support.
+
+    Each write appends a record (header, key and stored value) to the active
+    segment file, and an in-memory index maps every (endpoint, params) to the
+    segment and offset of its last record. Segments are read through mmap,
+    so a read is a slice of mapped pages: no query to parse nor plan, and no
+    read system call once the pages are in memory.
+
+    It only replaces the key-value cache (cache table of cache.db): the rows
+    of the normalized endpoints (prices, terminals, routes...) stay in the
+    RowStore of cache.db whatever the backend, so the log only holds the
+    responses of the other endpoints, like the game versions.
+
+    Deletions append a tombstone, and the index is rebuilt by replaying the
+    segments in order when the cache is opened. Each record carries a CRC32
+    checksum: a tail truncated by a crash while writing is dropped.
+
+    Replaced, deleted and expired records stay in their segment until
+    maintain() compacts the log: once dead records make up more than
+    compaction_ratio of it, the live entries are rewritten to a new segment
+    and the older segments are removed.
+
+    Values are compressed like in SQLiteCacheBackend, and accesses are
+    counted in memory for the eviction policy. Unlike cache.db, the log is
+    owned by a single process: it holds an exclusive lock on the directory
+    until close(), and opening a directory locked by another process raises
+    OSError.
+    """
+    # CRC32 of the rest of the record, then tombstone flag, codec, created_at, expires_at, key and value lengths
+    checksum = struct.Struct("<I")
+    header = struct.Struct("<BBddII")
+    segment_name = re.compile(r"segment-(\d{6})\.log")
+    lock_name = "lock"
+
+    def __init__(self, directory=None, eviction_weights=cache_eviction_weights,
+                 compression=cache_compression_algorithm, compression_threshold=cache_compression_threshold,
+                 segment_size=cache_log_segment_size, compaction_ratio=cache_log_compaction_ratio):
+        if directory is None:
+            directory = os.path.join(user_data_dir(app_name, ensure_exists=True), cache_log_dir)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.__lock_file = self.__lock()
+        self.eviction_weights = eviction_weights
+        self.compression_codec = codec_id(compression)
+        self.compression_threshold = compression_threshold
+        self.segment_size = segment_size
+        self.compaction_ratio = compaction_ratio
+        self.evictions = Counter()
+        # (endpoint, params) -> (segment, value offset, stored size, codec, created_at, expires_at, record size)
+        self.__index = {}
+        self.__endpoints = {}
+        self.__accesses = {}
+        self.__maps = {}
+        self.__segment_sizes = {}
+        self.__live_bytes = 0
+        self.__active = None
+        self.__file = None
+        self.__load()
+        register(self.close)
+
+    def get_logger(self):
+        return logging.getLogger(__name__)
+
+    def __lock(self):
+        """Takes the exclusive lock of the directory, so a single process appends to the log."""
+        lock_file = open(os.path.join(self.directory, self.lock_name), "a+b")
+        try:
+            lock_file.seek(0)
+            if os.name == "nt":
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise
+        return lock_file
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:06d}.log")
+
+    def __load(self):
+        segments = sorted(int(match.group(1)) for match in map(self.segment_name.fullmatch, os.listdir(self.directory))
+                          if match)
+        for segment in segments:
+            try:
+                self.__replay(segment)
+            except OSError as e:
+                self.get_logger().warning(f"Cache log segment {segment} skipped, unreadable: {e}")
+        self.__open_segment(segments[-1] if segments else 1)
+
+    def __replay(self, segment):
+        """Indexes the records of a segment, and truncates it after its last valid record."""
+        path = self._segment_path(segment)
+        with open(path, "rb") as segment_file:
+            content = segment_file.read()
+        offset = 0
+        now = time.time()
+        while offset + self.checksum.size + self.header.size <= len(content):
+            header_offset = offset + self.checksum.size
+            tombstone, codec, created_at, expires_at, key_size, value_size = \
+                self.header.unpack_from(content, header_offset)
+            end = header_offset + self.header.size + key_size + value_size
+            if end > len(content) or \
+                    self.checksum.unpack_from(content, offset)[0] != zlib.crc32(content[header_offset:end]):
+                break
+            key_offset = header_offset + self.header.size
+            endpoint, params = json.loads(content[key_offset:key_offset + key_size])
+            if tombstone or expires_at <= now:
+                self._forget(endpoint, params)
+            else:
+                self._put(endpoint, params, (segment, key_offset + key_size, value_size, codec,
+                                             created_at, expires_at, end - offset))
+            offset = end
+        if offset < len(content):
+            self.get_logger().warning(f"Cache log segment {segment}: {len(content) - offset} bytes of torn or "
+                                      f"corrupt records dropped")
+            os.truncate(path, offset)
+        self.__segment_sizes[segment] = offset
+
+    def __open_segment(self, segment):
+        if self.__file is not None:
+            self.__file.close()
+        self.__active = segment
+        self.__file = open(self._segment_path(segment), "ab")
+        self.__segment_sizes.setdefault(segment, 0)
+
+    def _put(self, endpoint, params, entry):
+        self._forget(endpoint, params)
+        self.__index[(endpoint, params)] = entry
+        self.__endpoints.setdefault(endpoint, set()).add(params)
+        self.__live_bytes += entry[6]
+
+    def _forget(self, endpoint, params):
+        entry = self.__index.pop((endpoint, params), None)
+        if entry is None:
             return False
-        count = res[0]
-        return count > 0
+        self.__live_bytes -= entry[6]
+        self.__accesses.pop((endpoint, params), None)
+        endpoint_params = self.__endpoints[endpoint]
+        endpoint_params.discard(params)
+        if not endpoint_params:
+            del self.__endpoints[endpoint]
+        return True
+
+    def _append(self, records):
+        """
+        Appends [(endpoint, params, stored value, codec, created_at, expires_at), ...] records in a single
+        write, stored values of None being tombstones, and indexes them.
+        """
+        if self.__segment_sizes[self.__active] >= self.segment_size:
+            self.__open_segment(self.__active + 1)
+        offset = self.__segment_sizes[self.__active]
+        chunks = []
+        for endpoint, params, stored_value, codec, created_at, expires_at in records:
+            key = json.dumps([endpoint, params]).encode('utf-8')
+            value = stored_value or b""
+            body = self.header.pack(stored_value is None, codec, created_at, expires_at, len(key), len(value))
+            body += key + value
+            record = self.checksum.pack(zlib.crc32(body)) + body
+            chunks.append(record)
+            if stored_value is None:
+                self._forget(endpoint, params)
+            else:
+                self._put(endpoint, params, (self.__active, offset + len(record) - len(value), len(value), codec,
+                                             created_at, expires_at, len(record)))
+            offset += len(record)
+        self.__file.write(b"".join(chunks))
+        self.__file.flush()
+        self.__segment_sizes[self.__active] = offset
+
+    def _read(self, entry):
+        segment, offset, size = entry[:3]
+        segment_map = self.__maps.get(segment)
+        if segment_map is None or len(segment_map) < offset + size:
+            # The active segment grew since it was mapped
+            if segment_map is not None:
+                segment_map.close()
+            with open(self._segment_path(segment), "rb") as segment_file:
+                segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.__maps[segment] = segment_map
+        return segment_map[offset:offset + size]
+
+    def _encode(self, encoded_value):
+        """Returns (stored value, codec) of a JSON encoded value."""
+        return compress(encoded_value.encode('utf-8'), self.compression_codec, self.compression_threshold)
+
+    @staticmethod
+    def _decode(stored_value, codec):
+        return decompress(stored_value, codec)
+
+    def _unmap(self):
+        for segment_map in self.__maps.values():
+            segment_map.close()
+        self.__maps.clear()
+
+    def close(self):
+        self._unmap()
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        if self.__lock_file is not None:
+            self.__lock_file.close()  # Releases the lock
+            self.__lock_file = None
+
+    def _remove_segments(self, segments):
+        self._unmap()
+        for segment in segments:
+            self.__segment_sizes.pop(segment, None)
+            try:
+                os.remove(self._segment_path(segment))
+            except OSError as e:
+                self.get_logger().warning(f"Cache log segment {segment} could not be removed: {e}")
+
+    def clear(self):
+        self.__file.close()
+        self.__file = None
+        self._remove_segments(list(self.__segment_sizes))
+        self.__index.clear()
+        self.__endpoints.clear()
+        self.__accesses.clear()
+        self.__live_bytes = 0
+        self.__open_segment(1)
+
+    def clean_obsolete(self):
+        # Expired records are skipped by the replay as well, they don't need a tombstone
+        now = time.time()
+        for key in [key for key, entry in self.__index.items() if entry[5] <= now]:
+            self._forget(*key)
+
+    def get(self, endpoint, params):
+        entry = self.get_entry(endpoint, params)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, endpoint, params):
+        """Returns (data, expires_at, encoded size) of a valid entry, or None."""
+        entry = self.__index.get((endpoint, params))
+        if entry is None or entry[5] <= time.time():
+            return None
+        try:
+            stored_value = self._read(entry)
+        except OSError as e:
+            self.get_logger().warning(f"Cache log entry {endpoint} {params} unreadable: {e}")
+            return None
+        self.touch(endpoint, params)
+        encoded_value = self._decode(stored_value, entry[3])
+        return json.loads(encoded_value), entry[5], len(encoded_value)
+
+    def set(self, endpoint, params, value, ttl):
+        return self.set_many([(endpoint, params, value, ttl)])
+
+    def set_many(self, items):
+        """Appends (endpoint, params, value, ttl) items and returns the JSON encoded size of each value."""
+        now = time.time()
+        records = []
+        sizes = []
+        for endpoint, params, value, ttl in items:
+            encoded_value = json.dumps(value)
+            records.append((endpoint, params, *self._encode(encoded_value), now, now + ttl))
+            sizes.append(len(encoded_value))
+        try:
+            self._append(records)
+        except OSError as e:
+            self.get_logger().warning(f"Cache log write failed: {e}")
+            return None
+        return sizes
+
+    def _delete_many(self, keys):
+        keys = [key for key in keys if key in self.__index]
+        if keys:
+            self._append([(endpoint, params, None, 0, 0, 0) for endpoint, params in keys])
+        return len(keys)
+
+    def delete(self, endpoint, params):
+        self._delete_many([(endpoint, params)])
+
+    def contains(self, endpoint, params):
+        entry = self.__index.get((endpoint, params))
+        return entry is not None and entry[5] > time.time()
+
+    def contains_endpoint(self, endpoint):
+        now = time.time()
+        return any(self.__index[(endpoint, params)][5] > now for params in self.__endpoints.get(endpoint, ()))
+
+    def touch(self, endpoint, params):
+        """Records an access to an entry, used by the eviction policy."""
+        hits, _ = self.__accesses.get((endpoint, params), (0, 0))
+        self.__accesses[(endpoint, params)] = (hits + 1, time.time())
+
+    def total_size(self):
+        return sum(entry[2] for entry in self.__index.values())
+
+    def evict(self, max_bytes):
+        """
+        Removes entries until the stored size of the cache is below max_bytes
+        (minus a margin), and returns the number of removed entries, with the
+        same policy as SQLiteCacheBackend: expired entries first, then the
+        entries with the lowest (hits + 1) * endpoint weight / seconds since last access.
+        """
+        if self.total_size() <= max_bytes:
+            return 0
+        self.clean_obsolete()
+        to_free = self.total_size() - max_bytes * cache_eviction_low_watermark
+        now = time.time()
+
+        def score(item):
+            (endpoint, params), entry = item
+            hits, last_access = self.__accesses.get((endpoint, params), (0, entry[4]))
+            return (hits + 1) * self.eviction_weights.get(endpoint, 1) / (now - last_access + 60.0)
+
+        evicted = []
+        for key, entry in sorted(self.__index.items(), key=score):
+            if to_free <= 0:
+                break
+            evicted.append(key)
+            to_free -= entry[2]
+        try:
+            self._delete_many(evicted)
+        except OSError as e:
+            self.get_logger().warning(f"Cache log eviction failed: {e}")
+            return 0
+        self.evictions.update(endpoint for endpoint, _ in evicted)
+        return len(evicted)
+
+    def delete_endpoint(self, endpoint):
+        try:
+            self._delete_many([(endpoint, params) for params in self.__endpoints.get(endpoint, ())])
+        except OSError as e:
+            self.get_logger().warning(f"Cache log purge of {endpoint} failed: {e}")
+
+    def maintain(self):
+        """Compacts the log once dead records make up more than compaction_ratio of it, and returns the duration."""
+        start_time = time.time()
+        self.clean_obsolete()
+        total_bytes = sum(self.__segment_sizes.values())
+        if total_bytes and total_bytes - self.__live_bytes > total_bytes * self.compaction_ratio:
+            try:
+                self.compact()
+            except OSError as e:
+                self.get_logger().warning(f"Cache log compaction failed: {e}")
+        return time.time() - start_time
+
+    def compact(self):
+        """
+        Rewrites the live entries to a new segment and removes the older ones.
+        The new segment is complete on disk before any older one is removed,
+        and its records replace the older ones when replayed after a crash.
+        """
+        segments = list(self.__segment_sizes)
+        live_entries = [(key, entry, self._read(entry)) for key, entry in self.__index.items()]
+        self.__open_segment(self.__active + 1)
+        self._append([(endpoint, params, stored_value, entry[3], entry[4], entry[5])
+                      for (endpoint, params), entry, stored_value in live_entries])
+        os.fsync(self.__file.fileno())
+        self._remove_segments(segments)
+
+    def endpoint_stats(self):
+        """Returns {endpoint: {entries, bytes, oldest, newest, evictions}} of the valid entries."""
+        now = time.time()
+        stats = {}
+        for endpoint, endpoint_params in self.__endpoints.items():
+            entries = [self.__index[(endpoint, params)] for params in endpoint_params]
+            entries = [entry for entry in entries if entry[5] > now]
+            if entries:
+                stats[endpoint] = {
+                    'entries': len(entries),
+                    'bytes': sum(entry[2] for entry in entries),
+                    'oldest': min(entry[4] for entry in entries),
+                    'newest': max(entry[4] for entry in entries),
+                    'evictions': self.evictions[endpoint]
+                }
+        return stats
+
+
+class LRUMemory:
+    """
+    Values kept in memory with their expiry time, within a budget of entries
+    and of bytes: the least recently used ones are evicted first.
+    """
+    def __init__(self, max_entries=memory_cache_max_entries, max_bytes=memory_cache_max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.__entries = OrderedDict()
+        self.__size = 0
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def get(self, key):
+        """Returns the value of key and marks it as recently used, or None when missing or expired."""
+        entry = self.__entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            self.drop(key)
+            return None
+        self.__entries.move_to_end(key)
+        return entry[0]
+
+    def store(self, key, value, expires_at, size):
+        self.drop(key)
+        if size > self.max_bytes:
+            return
+        self.__entries[key] = (value, expires_at, size)
+        self.__size += size
+        while len(self.__entries) > self.max_entries or self.__size > self.max_bytes:
+            _, (_, _, evicted_size) = self.__entries.popitem(last=False)
+            self.__size -= evicted_size
+
+    def drop(self, key):
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.__size -= entry[2]
+
+    def drop_where(self, predicate):
+        """Drops the entries whose key matches predicate."""
+        for key in [key for key in self.__entries if predicate(key)]:
+            self.drop(key)
+
+    def clear(self):
+        self.__entries.clear()
+        self.__size = 0
+
+    def clean_obsolete(self):
+        now = time.time()
+        for key in [key for key, entry in self.__entries.items() if entry[1] <= now]:
+            self.drop(key)
+
+
+class LRUCacheTier:
+    """
+    An in-process memory tier placed in front of another cache backend.
+
+    Decoded values read from the backend are kept in memory, within a budget
+    of entries and of encoded bytes, and the least recently used ones are
+    evicted first. Repeated reads of hot entries (game versions, systems...)
+    then skip both the disk and the JSON decoding.
+
+    Writes go through to the backend and refresh the values already held in
+    memory, without allocating new ones, so a warmup burst does not evict
+    the hot entries. Each entry keeps the expiry time of the backend, so the
+    memory tier never outlives the TTL of the underlying entry.
+
+    Values are shared with the callers: they must not be modified in place.
+    """
+    def __init__(self, backend, max_entries=memory_cache_max_entries, max_bytes=memory_cache_max_bytes):
+        self.backend = backend
+        self.memory = LRUMemory(max_entries, max_bytes)
+
+    def clear(self):
+        self.memory.clear()
+        self.backend.clear()
+
+    def clean_obsolete(self):
+        self.memory.clean_obsolete()
+        self.backend.clean_obsolete()
+
+    def get(self, endpoint, params):
+        key = (endpoint, params)
+        data = self.memory.get(key)
+        if data is not None:
+            self.backend.touch(endpoint, params)
+            return data
+        entry = self.backend.get_entry(endpoint, params)
+        if entry is None:
+            return None
+        self.memory.store(key, *entry)
+        return entry[0]
+
+    def set(self, endpoint, params, value, ttl):
+        return self.set_many([(endpoint, params, value, ttl)])
+
+    def set_many(self, items):
+        items = list(items)
+        sizes = self.backend.set_many(items)
+        now = time.time()
+        for index, (endpoint, params, value, ttl) in enumerate(items):
+            key = (endpoint, params)
+            if key in self.memory:
+                if sizes is None:
+                    self.memory.drop(key)
+                else:
+                    self.memory.store(key, value, now + ttl, sizes[index])
+        return sizes
+
+    def delete(self, endpoint, params):
+        self.memory.drop((endpoint, params))
+        self.backend.delete(endpoint, params)
+
+    def contains(self, endpoint, params):
+        return self.get(endpoint, params) is not None
+
+    def contains_endpoint(self, endpoint):
+        return self.backend.contains_endpoint(endpoint)
+
+    def touch(self, endpoint, params):
+        self.backend.touch(endpoint, params)
+
+    def evict(self, max_bytes):
+        return self.backend.evict(max_bytes)
+
+    def delete_endpoint(self, endpoint):
+        self.memory.drop_where(lambda key: key[0] == endpoint)
+        self.backend.delete_endpoint(endpoint)
+
+    def endpoint_stats(self):
+        return self.backend.endpoint_stats()
+
+    def maintain(self):
+        return self.backend.maintain()
 
 
 class CacheManager:
     def __init__(self, backend="persistent", config_manager=None):
+        # Rows of memory_cache_row_endpoints read from the store: (endpoint, params, partition) -> (rows, generation)
+        self.rows_memory = None
         if backend == "persistent":
             self.cache = SQLiteCacheBackend()
+            if memory_cache_activated:
+                self.cache = LRUCacheTier(self.cache)
+                self.rows_memory = LRUMemory()
+            self.store = RowStore()
+            self.leases = FetchLeases()
+        elif backend == "log":
+            try:
+                self.cache = LogCacheBackend()
+            except OSError as e:
+                # Locked by another running instance, which owns the log
+                self.get_logger().warning(f"Cache log unavailable, cache.db used instead: {e}")
+                self.cache = SQLiteCacheBackend()
+            if memory_cache_activated:
+                self.cache = LRUCacheTier(self.cache)
+                self.rows_memory = LRUMemory()
+            self.store = RowStore()
+            self.leases = FetchLeases()
         elif backend == "local":
             self.cache = DictCacheBackend()
+            self.store = RowStore(in_memory=True)
+            self.leases = FetchLeases(in_memory=True)
         else:
             raise ValueError("Invalid cache backend: {}".format(backend))
+        self.history = PriceHistory(in_memory=backend == "local")
+        self.backend = backend
         self.config_manager = config_manager
+        # Writes of the batch open in the current context (task or thread), None outside of a batch
+        self._pending_writes = contextvars.ContextVar(f"cache_pending_writes_{id(self)}", default=None)
+        self._written_bytes = 0
+        self.hits = Counter()
+        self.misses = Counter()
+
+    @contextmanager
+    def batch(self):
+        """
+        Buffers every set() done inside the context and writes them in a single
+        transaction when the outermost batch exits.
+
+        The batch belongs to the task (or thread) which opened it: writes of
+        other coroutines running while it is open, during an await, are not
+        part of it and are written right away.
+
+        >>> with cache.batch():
+        ...     cache.set('/foo', {'id': 1}, ['bar'])
+        ...     cache.set('/foo', {'id': 2}, ['baz'])
+        """
+        if self._pending_writes.get() is not None:
+            yield self  # Nested in the batch of the current context
+            return
+        token = self._pending_writes.set({})
+        try:
+            yield self
+        finally:
+            pending_writes = self._pending_writes.get()
+            self._pending_writes.reset(token)
+            self._flush_pending_writes(pending_writes)
+
+    def _flush_pending_writes(self, pending_writes):
+        if pending_writes:
+            sizes = self.cache.set_many([(endpoint, params, data, ttl)
+                                         for (endpoint, params), (data, ttl) in pending_writes.items()])
+            self._track_written_bytes(sizes)
+
+    def _get_max_size(self):
+        if self.config_manager:
+            return self.config_manager.get_cache_max_size() * 1024 * 1024
+        return default_cache_max_size * 1024 * 1024
+
+    def _track_written_bytes(self, sizes):
+        if not sizes:
+            return
+        self._written_bytes += sum(sizes)
+        # Only check the size budget once a significant amount of data was written
+        if self._written_bytes >= self._get_max_size() * cache_eviction_check_ratio:
+            self.enforce_max_size()
 
     @Metrics.track_sync_fnc_exec
-    def _get(self, key: str, ttl: int):
-        data = None
+    def enforce_max_size(self):
+        """
+        Keeps the cache entries and the rows of the store within the size budget, and returns
+        the number of evicted entries and scopes. When the rows exceed the budget on their own,
+        the oldest scopes are evicted down to the low watermark; the entries get the rest.
+        """
+        self._written_bytes = 0
+        max_size = self._get_max_size()
+        store_size = self.store.total_size()
+        evicted_scopes = 0
+        if store_size > max_size:
+            evicted_scopes = self.store.evict(store_size - max_size * cache_eviction_low_watermark)
+            self._drop_memory_rows()
+            store_size = self.store.total_size()
+        evicted = self.cache.evict(max(max_size - store_size, 0))
+        if evicted or evicted_scopes:
+            self.get_logger().debug(f"Cache size limit reached, {evicted} entries and {evicted_scopes} scopes evicted")
+        return evicted + evicted_scopes
+
+    @Metrics.track_sync_fnc_exec
+    def _get(self, key):
         logger = self.get_logger()
-        if key in self.cache:
-            entry = self.cache[key]
-            if ((time.time() - entry['timestamp']) < ttl):
-                data = entry['data']
-                logger.debug(f"Cache hit for {key}")
-            else:
-                del self.cache[key]
-                logger.debug(f"Cache obsolete hit for {key}")
+        pending_writes = self._pending_writes.get()
+        if pending_writes and key in pending_writes:
+            logger.debug(f"Cache hit for {key} (pending write)")
+            self.hits[key[0]] += 1
+            return pending_writes[key][0]
+        # Expired entries are misses, they are removed by clean_obsolete
+        data = self.cache.get(*key)
+        if data is not None:
+            logger.debug(f"Cache hit for {key}")
+            self.hits[key[0]] += 1
         else:
             logger.debug(f"Cache miss for {key}")
+            self.misses[key[0]] += 1
         return data
 
     @Metrics.track_sync_fnc_exec
     def get(self, endpoint, params):
         key = self._get_key(endpoint, params)
-        ttl = self._get_ttl_from_endpoint(endpoint)
-        return self._get(key, ttl)
+        return self._get(key)
 
     @Metrics.track_sync_fnc_exec
     def _get_key(self, endpoint, params):
-        hashed_params = hashlib.md5(str(params).encode('utf-8')).hexdigest()
-        return f"{endpoint}_{hashed_params}"
+        return (endpoint, canonical_params(params))
 
     @Metrics.track_sync_fnc_exec
     def endpoint_exists_in_cache(self, endpoint):
-        return self.cache.contains_endpoint(endpoint)
+        return self.store.contains_endpoint(endpoint) or self.cache.contains_endpoint(endpoint)
 
     @Metrics.track_sync_fnc_exec
-    def _set(self, key, data):
-        self.cache[key] = data
+    def _set(self, key, data, ttl: int):
+        pending_writes = self._pending_writes.get()
+        if pending_writes is not None:
+            pending_writes[key] = (data, ttl)
+        else:
+            self._track_written_bytes(self.cache.set(*key, data, ttl))
 
     @Metrics.track_sync_fnc_exec
     def set(self, endpoint, params, data=[]):
         key = self._get_key(endpoint, params)
-        return self._set(key, data)
+        return self._set(key, data, self._get_ttl_from_endpoint(endpoint))
 
     @Metrics.track_sync_fnc_exec
-    def _replace(self, key: str, new_data, ttl: int, primary_key=['id']):
-        old_data = self.get(key, ttl)
-        if not old_data:
-            return
-        if isinstance(old_data, list):
-            new_list = []
-            list_modified = False
-            for old_value in old_data:
-                for new_value in new_data:
-                    existing_value = True
-                    for key in primary_key:
-                        if old_value[key] != new_value[key]:
-                            existing_value = False
-                    if existing_value:
-                        new_list.append(new_value)
-                        list_modified = True
-                    else:
-                        new_list.append(old_value)
-            if list_modified:
-                self.cache[key] = new_list  # TODO - Make sure timestamp is not modified !
-        if isinstance(old_data, dict):
-            return  # TODO - Replace with dictionary ?
+    def set_many(self, endpoint, items):
+        """Sets every (params, data) pair of items for the given endpoint in a single transaction."""
+        with self.batch():
+            for params, data in items:
+                self.set(endpoint, params, data)
 
     @Metrics.track_sync_fnc_exec
     def _get_ttl_from_endpoint(self, endpoint):
@@ -300,28 +1163,229 @@ class CacheManager:
         return ttl
 
     @Metrics.track_sync_fnc_exec
-    def replace(self, endpoint, params, new_data, primary_key=['id']):
-        key = self._get_key(endpoint, params)
-        return self._replace(key, new_data=new_data, ttl=self._get_ttl_from_endpoint(endpoint), primary_key=primary_key)
+    def supports_rows(self, endpoint, params):
+        return self.store.supports(endpoint, params)
+
+    @Metrics.track_sync_fnc_exec
+    def get_rows(self, endpoint, params, partition=None, snapshot=None):
+        """Returns the normalized rows of endpoint matching params (in a pinned snapshot if any), or None if not cached."""
+        if self.rows_memory is not None and endpoint in memory_cache_row_endpoints:
+            rows = self._get_memory_rows(endpoint, params, partition, snapshot)
+        else:
+            rows = self.store.get_rows(endpoint, params, partition, snapshot)
+        self.get_logger().debug(f"Rows {'hit' if rows is not None else 'miss'} for {endpoint} {params}")
+        (self.hits if rows is not None else self.misses)[endpoint] += 1
+        return rows
+
+    def _get_memory_rows(self, endpoint, params, partition, snapshot):
+        """
+        Returns the rows of the memory tier, read from the store and kept in memory if missing.
+
+        Rows are kept with the generation of the store shared by every process when they were
+        read, and only served while it is still the generation of the store (and of the snapshot
+        if any): a write of any process, or an older snapshot, reads the store again. Like the
+        values of LRUCacheTier, rows are shared with the callers and must not be modified in place.
+        """
+        key = (endpoint, canonical_params(params), partition)
+        generation = self.store.current_generation()
+        if snapshot is not None and snapshot != generation:
+            return self.store.get_rows(endpoint, params, partition, snapshot)
+        entry = self.rows_memory.get(key)
+        if entry is not None and entry[1] == generation:
+            return entry[0]
+        entry = self.store.get_rows_entry(endpoint, params, partition, snapshot)
+        if entry is None:
+            return None
+        rows, expires_at, size = entry
+        self.rows_memory.store(key, (rows, generation), expires_at, size)
+        return rows
+
+    def _drop_memory_rows(self, endpoint=None):
+        """Drops the rows of endpoint (of every endpoint by default) from the memory tier."""
+        if self.rows_memory is not None:
+            self.rows_memory.drop_where(lambda key: endpoint is None or key[0] == endpoint)
+
+    @Metrics.track_sync_fnc_exec
+    def pin_snapshot(self):
+        return self.store.pin_snapshot()
+
+    @Metrics.track_sync_fnc_exec
+    def release_snapshot(self, snapshot):
+        self.store.release_snapshot(snapshot)
+
+    @Metrics.track_sync_fnc_exec
+    def acquire_lease(self, endpoint, params):
+        """Acquires the fetch lease of endpoint and params, shared with the other processes using the cache."""
+        return self.leases.acquire(f"{endpoint}?{canonical_params(params)}")
+
+    @Metrics.track_sync_fnc_exec
+    def release_lease(self, endpoint, params):
+        self.leases.release(f"{endpoint}?{canonical_params(params)}")
+
+    @Metrics.track_sync_fnc_exec
+    def filter_partition(self, endpoint, rows, partition):
+        return self.store.filter_partition(endpoint, rows, partition)
+
+    @Metrics.track_sync_fnc_exec
+    def set_rows(self, endpoint, params, rows):
+        self._drop_memory_rows(endpoint)
+        self._track_written_bytes([self.store.set_rows(endpoint, params, rows, self._get_ttl_from_endpoint(endpoint))])
+        if price_history_activated and endpoint == self.history.endpoint:
+            self.history.record(rows)
+
+    @Metrics.track_sync_fnc_exec
+    def get_price_history(self, id_terminal=None, id_commodity=None, game_version=None, start=None, end=None):
+        return self.history.get_history(id_terminal, id_commodity, game_version, start, end)
+
+    @Metrics.track_sync_fnc_exec
+    def get_warmup_checkpoints(self, endpoint, param, values):
+        """Returns {value: expires_at} of the values of param already loaded by a warmup of endpoint."""
+        return self.store.loaded_checkpoints(endpoint, param, values)
+
+    @Metrics.track_sync_fnc_exec
+    def complete_warmup(self, endpoint, param, values):
+        """Records the completion marker of endpoint when every value of param is loaded, and returns whether it is."""
+        return self.store.complete(endpoint, param, values)
+
+    @Metrics.track_sync_fnc_exec
+    def is_warm(self, endpoint):
+        """Returns whether every row of endpoint is loaded (a complete warmup, or a single request of the endpoint)."""
+        return self.store.is_loaded(endpoint, {})
 
     @Metrics.track_sync_fnc_exec
     def _invalidate(self, key):
-        if key in self.cache:
-            del self.cache[key]
+        pending_writes = self._pending_writes.get()
+        if pending_writes:
+            pending_writes.pop(key, None)
+        self.cache.delete(*key)
 
     @Metrics.track_sync_fnc_exec
     def invalidate(self, endpoint, params):
         key = self._get_key(endpoint, params)
         self._invalidate(key)
+        self._drop_memory_rows(endpoint)
+        self.store.invalidate(endpoint, params)
+
+    @Metrics.track_sync_fnc_exec
+    def purge_endpoint(self, endpoint):
+        """Removes every cached entry and row of endpoint."""
+        pending_writes = self._pending_writes.get()
+        for key in [key for key in pending_writes or () if key[0] == endpoint]:
+            del pending_writes[key]
+        self.cache.delete_endpoint(endpoint)
+        self._drop_memory_rows(endpoint)
+        self.store.delete_endpoint(endpoint)
+
+    @Metrics.track_sync_fnc_exec
+    def get_stats(self):
+        """
+        Returns the statistics of each cached endpoint: valid entries (rows
+        for the normalized endpoints), stored bytes, age of the oldest and
+        newest entries in seconds, hits and misses since start, and entries
+        (scopes for the normalized endpoints) evicted by the size budget since start.
+        """
+        now = time.time()
+        stats = {}
+
+        def endpoint_stats(endpoint):
+            return stats.setdefault(endpoint, {'entries': 0, 'bytes': 0, 'oldest': now, 'newest': 0, 'evictions': 0})
+
+        for endpoint, cache_stats in self.cache.endpoint_stats().items():
+            endpoint_stats(endpoint).update(cache_stats)
+        for endpoint, store_stats in self.store.endpoint_stats().items():
+            # Rows only keep their expiry time, all rows of an endpoint share the same TTL
+            ttl = self._get_ttl_from_endpoint(endpoint)
+            merged_stats = endpoint_stats(endpoint)
+            merged_stats['entries'] += store_stats['entries']
+            merged_stats['bytes'] += store_stats['bytes']
+            merged_stats['oldest'] = min(merged_stats['oldest'], store_stats['first_expiry'] - ttl)
+            merged_stats['newest'] = max(merged_stats['newest'], store_stats['last_expiry'] - ttl)
+        for endpoint, evictions in self.store.evictions.items():
+            endpoint_stats(endpoint)['evictions'] += evictions
+        for endpoint in self.hits.keys() | self.misses.keys():
+            endpoint_stats(endpoint)
+        for endpoint, endpoint_stat in stats.items():
+            oldest, newest = endpoint_stat.pop('oldest'), endpoint_stat.pop('newest')
+            endpoint_stat['oldest_age'] = now - oldest if endpoint_stat['entries'] else None
+            endpoint_stat['newest_age'] = now - newest if endpoint_stat['entries'] else None
+            endpoint_stat['hits'] = self.hits[endpoint]
+            endpoint_stat['misses'] = self.misses[endpoint]
+        return stats
+
+    @Metrics.track_sync_fnc_exec
+    def export_snapshot(self, path, endpoints=None):
+        """
+        Writes the valid rows of the normalized endpoints (all of them by
+        default) to a gzipped JSON snapshot file, and returns the number of
+        exported rows.
+        """
+        snapshot = {"format": "uex-trader-cache", "version": cache_snapshot_version,
+                    "created_at": time.time(), "endpoints": {}}
+        exported = 0
+        for endpoint in endpoints or self.store.entities:
+            scopes, rows = self.store.export_rows(endpoint)
+            if scopes:
+                snapshot["endpoints"][endpoint] = {"scopes": scopes, "rows": rows}
+                exported += len(rows)
+        with gzip.open(path, "wt", encoding="utf-8") as snapshot_file:
+            json.dump(snapshot, snapshot_file, separators=(",", ":"))
+        return exported
+
+    @Metrics.track_sync_fnc_exec
+    def import_snapshot(self, path, fresh=False):
+        """
+        Loads the rows of a snapshot file, and returns the number of imported rows.
+
+        Rows keep the expiry they had in the snapshot and the expired ones are
+        skipped, unless fresh is set: the rows are then considered as fetched
+        now, which is used for the seed of slow changing reference data.
+        """
+        with gzip.open(path, "rt", encoding="utf-8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        if snapshot.get("format") != "uex-trader-cache" or snapshot.get("version") != cache_snapshot_version:
+            raise ValueError("Unsupported cache snapshot file")
+        now = time.time()
+        imported = 0
+        for endpoint, content in snapshot["endpoints"].items():
+            if not self.store.supports(endpoint, {}):
+                continue
+            if fresh:
+                ttl = self._get_ttl_from_endpoint(endpoint)
+                scopes = [[scope, now + ttl] for scope, _ in content["scopes"]]
+            else:
+                scopes = [[scope, expires_at] for scope, expires_at in content["scopes"] if expires_at > now]
+            if scopes:
+                self._drop_memory_rows(endpoint)
+                self.store.import_rows(endpoint, scopes, content["rows"])
+                imported += len(content["rows"])
+        return imported
+
+    @Metrics.track_sync_fnc_exec
+    def maintain(self):
+        duration = self.cache.maintain()
+        if self.backend == "log":
+            # cache.db only holds the row store, not compacted by the log
+            duration += self.store.maintain()
+        self.get_logger().debug(f"Cache maintenance done in {duration:.3f}s")
+        return duration
 
     @Metrics.track_sync_fnc_exec
     def clean_obsolete(self):
-        max_ttl = max(system_ttl, planet_ttl, terminal_ttl, default_ttl, int(self.config_manager.get_ttl()))
-        self.cache.clean_obsolete(max_ttl)
+        self.cache.clean_obsolete()
+        if self.rows_memory is not None:
+            self.rows_memory.clean_obsolete()
+        self.store.clean_obsolete()
+        self.history.clean_obsolete()
+        self.enforce_max_size()
 
     @Metrics.track_sync_fnc_exec
     def clear(self):
+        pending_writes = self._pending_writes.get()
+        if pending_writes:
+            pending_writes.clear()
         self.cache.clear()
+        self._drop_memory_rows()
+        self.store.clear()
 
     def get_logger(self):
         return logging.getLogger(__name__)
@@ -8,7 +8,7 @@ from logger_setup import setup_logger
 from api import API
 from translation_manager import TranslationManager
 from platformdirs import user_config_dir
-from global_variables import app_name, config_ini_file, default_ttl
+from global_variables import app_name, config_ini_file, default_ttl, default_cache_max_size
 from metrics import Metrics
 
 logger = logging.getLogger(__name__)
@@ -206,6 +206,20 @@ class ConfigManager:
         except ValueError:
             raise ValueError("TTL must be a valid integer string")
 
+    @Metrics.track_sync_fnc_exec
+    def get_cache_max_size(self):
+        return self.config.getint("SETTINGS", "cache_max_size", fallback=default_cache_max_size)
+
+    @Metrics.track_sync_fnc_exec
+    def set_cache_max_size(self, cache_max_size):
+        if not isinstance(cache_max_size, str) or not cache_max_size.isdigit() or int(cache_max_size) <= 0:
+            raise ValueError("Cache size must be a positive integer (MB)")
+        if "SETTINGS" not in self.config:
+            self.config["SETTINGS"] = {}
+        self.config["SETTINGS"]["cache_max_size"] = cache_max_size
+        self.save_config()
+        self.api.cache.enforce_max_size()
+
     @Metrics.track_sync_fnc_exec
     def clear_cache(self):
         self.api.cache.clear()
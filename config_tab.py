@@ -8,13 +8,16 @@ from PyQt5.QtWidgets import (
     QPushButton,
     QComboBox,
     QCheckBox,
-    QMessageBox
+    QMessageBox,
+    QTableWidget,
+    QTableWidgetItem,
+    QFileDialog
 )
 from PyQt5.QtCore import Qt
 from config_manager import ConfigManager
 from translation_manager import TranslationManager
 import asyncio
-from tools import translate
+from tools import translate, create_async_callback, format_duration, format_size
 from api import API
 from metrics import Metrics
 
@@ -149,16 +152,51 @@ class ConfigTab(QWidget):
         self.cache_ttl_input = QLineEdit(self.config_manager.get_ttl())
         self.cache_ttl_input.editingFinished.connect(lambda: asyncio.create_task(self.update_cache_ttl()))
 
+        self.cache_max_size_hbox = QHBoxLayout()
+        self.cache_max_size_label = QLabel(await translate("config_cache_max_size") + ":")
+        self.cache_max_size_input = QLineEdit(str(self.config_manager.get_cache_max_size()))
+        self.cache_max_size_input.editingFinished.connect(lambda: asyncio.create_task(self.update_cache_max_size()))
+
         self.clear_cache_button = QPushButton(await translate("clear_cache"), self)
         # self.clear_cache_button.setFixedSize(30, 30)  # Adjust size as needed
         self.clear_cache_button.pressed.connect(self.clear_cache)
         self.clear_cache_button.released.connect(self.clear_cache)
 
+        self.cache_stats_label = QLabel(await translate("config_cache_stats") + ":")
+        self.cache_stats_table = QTableWidget()
+        self.cache_stats_table.setColumnCount(8)
+        self.cache_stats_table.setHorizontalHeaderLabels([await translate("cache_stats_endpoint"),
+                                                          await translate("cache_stats_entries"),
+                                                          await translate("cache_stats_size"),
+                                                          await translate("cache_stats_hit_rate"),
+                                                          await translate("cache_stats_evictions"),
+                                                          await translate("cache_stats_age"),
+                                                          "", ""])
+        self.cache_stats_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.update_cache_stats_button = QPushButton(await translate("cache_stats_update"), self)
+        self.update_cache_stats_button.clicked.connect(create_async_callback(self.update_cache_stats))
+
+        self.cache_snapshot_hbox = QHBoxLayout()
+        self.export_cache_snapshot_button = QPushButton(await translate("cache_export_snapshot"), self)
+        self.export_cache_snapshot_button.clicked.connect(create_async_callback(self.export_cache_snapshot))
+        self.import_cache_snapshot_button = QPushButton(await translate("cache_import_snapshot"), self)
+        self.import_cache_snapshot_button.clicked.connect(create_async_callback(self.import_cache_snapshot))
+
         self.cache_ttl_hbox.addWidget(self.cache_ttl_label)
         self.cache_ttl_hbox.addWidget(self.cache_ttl_input)
         self.cache_ttl_vboxlayout.addWidget(self.cache_options_label)
         self.cache_ttl_vboxlayout.addLayout(self.cache_ttl_hbox)
+        self.cache_max_size_hbox.addWidget(self.cache_max_size_label)
+        self.cache_max_size_hbox.addWidget(self.cache_max_size_input)
+        self.cache_ttl_vboxlayout.addLayout(self.cache_max_size_hbox)
         self.cache_ttl_vboxlayout.addWidget(self.clear_cache_button)
+        self.cache_ttl_vboxlayout.addWidget(self.cache_stats_label)
+        self.cache_ttl_vboxlayout.addWidget(self.cache_stats_table)
+        self.cache_ttl_vboxlayout.addWidget(self.update_cache_stats_button)
+        self.cache_snapshot_hbox.addWidget(self.export_cache_snapshot_button)
+        self.cache_snapshot_hbox.addWidget(self.import_cache_snapshot_button)
+        self.cache_ttl_vboxlayout.addLayout(self.cache_snapshot_hbox)
+        await self.update_cache_stats()
 
     @Metrics.track_async_fnc_exec
     async def populate_main_layout(self):
@@ -230,6 +268,77 @@ class ConfigTab(QWidget):
     @Metrics.track_sync_fnc_exec
     def clear_cache(self):
         self.config_manager.clear_cache()
+        asyncio.ensure_future(self.update_cache_stats())
+
+    @Metrics.track_async_fnc_exec
+    async def update_cache_stats(self):
+        stats = await self.api.cache.get_stats()
+        purge_label = await translate("cache_purge")
+        refresh_label = await translate("cache_refresh_now")
+        self.cache_stats_table.setRowCount(len(stats))
+        for i, (endpoint, endpoint_stats) in enumerate(sorted(stats.items(), key=lambda item: -item[1]["bytes"])):
+            lookups = endpoint_stats["hits"] + endpoint_stats["misses"]
+            self.cache_stats_table.setItem(i, 0, QTableWidgetItem(endpoint))
+            self.cache_stats_table.setItem(i, 1, QTableWidgetItem(str(endpoint_stats["entries"])))
+            self.cache_stats_table.setItem(i, 2, QTableWidgetItem(format_size(endpoint_stats["bytes"])))
+            self.cache_stats_table.setItem(i, 3, QTableWidgetItem(
+                f"{endpoint_stats['hits'] / lookups * 100:.2f}% ({endpoint_stats['hits']}/{lookups})" if lookups else "-"))
+            self.cache_stats_table.setItem(i, 4, QTableWidgetItem(str(endpoint_stats["evictions"])))
+            self.cache_stats_table.setItem(i, 5, QTableWidgetItem(
+                f"{format_duration(endpoint_stats['newest_age'])} - {format_duration(endpoint_stats['oldest_age'])}"
+                if endpoint_stats["entries"] else "-"))
+            purge_button = QPushButton(purge_label, self)
+            purge_button.clicked.connect(create_async_callback(self.purge_cache_endpoint, endpoint))
+            self.cache_stats_table.setCellWidget(i, 6, purge_button)
+            refresh_button = QPushButton(refresh_label, self)
+            refresh_button.clicked.connect(create_async_callback(self.refresh_cache_endpoint, endpoint))
+            self.cache_stats_table.setCellWidget(i, 7, refresh_button)
+
+    @Metrics.track_async_fnc_exec
+    async def purge_cache_endpoint(self, endpoint):
+        await self.api.cache.purge_endpoint(endpoint)
+        await self.update_cache_stats()
+
+    @Metrics.track_async_fnc_exec
+    async def refresh_cache_endpoint(self, endpoint):
+        self.set_gui_enabled(False)
+        try:
+            await self.api.refresh_endpoint(endpoint)
+        except Exception as e:
+            self.main_widget.show_messagebox(await translate("error_error"), f"{await translate('error_generic')}: {e}",
+                                             QMessageBox.Icon.Critical)
+        finally:
+            self.set_gui_enabled(True)
+        await self.update_cache_stats()
+
+    @Metrics.track_async_fnc_exec
+    async def export_cache_snapshot(self):
+        path, _ = QFileDialog.getSaveFileName(self, await translate("cache_export_snapshot"), "uex_trader_cache.json.gz",
+                                              await translate("cache_snapshot_files") + " (*.json.gz)")
+        if not path:
+            return
+        try:
+            await self.api.cache.export_snapshot(path)
+        except OSError as e:
+            self.main_widget.show_messagebox(await translate("error_error"), str(e), QMessageBox.Icon.Critical)
+            return
+        self.main_widget.show_messagebox(await translate("success_success"),
+                                         await translate("success_cache_snapshot_exported"))
+
+    @Metrics.track_async_fnc_exec
+    async def import_cache_snapshot(self):
+        path, _ = QFileDialog.getOpenFileName(self, await translate("cache_import_snapshot"), "",
+                                              await translate("cache_snapshot_files") + " (*.json.gz)")
+        if not path:
+            return
+        try:
+            await self.api.cache.import_snapshot(path)
+        except (OSError, ValueError) as e:
+            self.main_widget.show_messagebox(await translate("error_error"), str(e), QMessageBox.Icon.Critical)
+            return
+        await self.update_cache_stats()
+        self.main_widget.show_messagebox(await translate("success_success"),
+                                         await translate("success_cache_snapshot_imported"))
 
     @Metrics.track_sync_fnc_exec
     def update_debug_mode(self, new_debug_mode=None):
@@ -254,6 +363,16 @@ class ConfigTab(QWidget):
             self.cache_ttl_input.setText(self.config_manager.get_ttl())
             self.cache_ttl_input.blockSignals(False)
 
+    @Metrics.track_async_fnc_exec
+    async def update_cache_max_size(self):
+        try:
+            self.config_manager.set_cache_max_size(self.cache_max_size_input.text())
+        except ValueError as e:
+            self.main_widget.show_messagebox(await translate("error_input_error"), str(e), QMessageBox.Icon.Warning)
+            self.cache_max_size_input.blockSignals(True)
+            self.cache_max_size_input.setText(str(self.config_manager.get_cache_max_size()))
+            self.cache_max_size_input.blockSignals(False)
+
     @Metrics.track_sync_fnc_exec
     def set_gui_enabled(self, enabled):
         for lineedit in self.findChildren(QLineEdit):
@@ -0,0 +1,94 @@
+# fetch_leases.py
+import os
+import sqlite3
+import time
+import uuid
+from atexit import register
+
+from platformdirs import user_data_dir
+from global_variables import app_name, cache_db_file, cache_busy_timeout, cache_lease_ttl
+
+
+class FetchLeases:
+    """
+    A table of fetch leases in cache.db, shared by every process using the cache.
+
+    Before fetching a missing key from the API, a process acquires its lease:
+    only one owner holds the lease of a key at a time, so several running
+    instances refresh it once, the others waiting for the result to reach the
+    cache. Each instance is an owner of its own, leases held by other tasks of
+    the same instance are not acquired either.
+
+    Leases expire after ttl seconds, so a process which crashed while fetching
+    never blocks the others for long. The leases still held by an instance
+    are released at exit.
+    """
+    def __init__(self, in_memory=False, ttl=cache_lease_ttl):
+        if in_memory is True:
+            self.db_path = ":memory:"
+        else:
+            db_dir = user_data_dir(app_name, ensure_exists=True)
+            self.db_path = os.path.join(db_dir, cache_db_file)
+        self.ttl = ttl
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        # Used from the cache I/O thread only, but closed at exit from the main thread
+        self.con = sqlite3.connect(self.db_path, timeout=cache_busy_timeout, check_same_thread=False)
+        self.__create_table()
+        register(self.con.close)
+        register(self.release_all)
+
+    def __create_table(self):
+        cur = self.con.cursor()
+        try:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS fetch_leases (
+                    key TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            self.con.commit()
+        except sqlite3.OperationalError:
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+
+    def acquire(self, key):
+        """Acquires the lease of key, unless another owner holds it, and returns whether it was acquired."""
+        now = time.time()
+        cur = self.con.cursor()
+        try:
+            # Taken over only once expired, in a single statement so two processes can't both acquire it
+            cur.execute("""
+                INSERT INTO fetch_leases VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE fetch_leases.expires_at <= ?;
+            """, [key, self.owner, now + self.ttl, now])
+            acquired = cur.rowcount == 1
+            self.con.commit()
+            return acquired
+        except sqlite3.OperationalError:
+            self.con.rollback()
+            return True  # TODO - Log error instead, fetched without the lease
+        finally:
+            cur.close()
+
+    def release(self, key):
+        cur = self.con.cursor()
+        try:
+            cur.execute("DELETE FROM fetch_leases WHERE key = ? AND owner = ?;", [key, self.owner])
+            self.con.commit()
+        except sqlite3.OperationalError:
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+
+    def release_all(self):
+        cur = self.con.cursor()
+        try:
+            cur.execute("DELETE FROM fetch_leases WHERE owner = ? OR expires_at <= ?;", [self.owner, time.time()])
+            self.con.commit()
+        except sqlite3.OperationalError:
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
@@ -1,7 +1,12 @@
 # global_variables.py
+import os
+import sys
+
 app_name = "UEX-Trader"
 cache_db_file = "cache.db"
 metrics_db_file = "metrics.db"
+outbox_db_file = "outbox.db"
+price_history_db_file = "price_history.db"
 config_ini_file = "config.ini"
 
 # hard-coded activable features
@@ -11,7 +16,12 @@ best_trade_route_tab_activated = True
 submit_tab_activated = False
 metrics_tab_activated = False  # DEBUG - Used for developers (TODO - use get_debug from config ??)
 metrics_collect_activated = False  # DEBUG - Used for developers (TODO - use get_debug from config ??)
+metrics_tracing_activated = False  # DEBUG - Record the spans of each search, exported as Chrome traces
+metrics_profiling_activated = False  # DEBUG - Profile the next search on request (Metrics tab) with cProfile
+metrics_profile_startup = False  # DEBUG - Profile the startup (metrics_profiling_activated)
 persistent_cache_activated = True
+memory_cache_activated = True  # In-memory LRU tier in front of the persistent cache
+price_history_activated = True  # Record the changes of the fetched prices
 distance_related_features = False
 
 # Startup Features
@@ -28,3 +38,102 @@ system_ttl = 2419200  # Kept one month
 planet_ttl = 604800  # Kept one week
 terminal_ttl = 86400  # Kept one day
 default_ttl = 1800  # 30min
+
+# In-memory cache tier budget
+memory_cache_max_entries = 4096
+memory_cache_max_bytes = 64 * 1024 * 1024  # 64MB of encoded values
+# Endpoints whose normalized rows are served from the memory tier as well (hot reference data)
+memory_cache_row_endpoints = ["/commodities", "/star_systems", "/planets", "/terminals"]
+
+# Persistent cache size budget and eviction
+default_cache_max_size = 256  # MB of encoded values
+cache_eviction_low_watermark = 0.9  # Evict down to 90% of the budget
+cache_eviction_check_ratio = 0.05  # Check the budget each time 5% of it was written
+# Weight of each endpoint in the eviction score (higher is kept longer, default 1)
+cache_eviction_weights = {
+    "/game_versions": 100,
+    "/star_systems": 100,
+    "/planets": 100,
+    "/terminals": 100,
+    "/commodities": 10,
+    "/commodities_routes": 5
+}
+
+# Compression of large persistent cache values ("zlib", "lzma", "bz2" or "none")
+cache_compression_algorithm = "zlib"
+cache_compression_threshold = 4096  # bytes of JSON
+
+# SQLite tuning of cache.db: PRAGMA profile applied to each connection
+cache_pragma_profile = "read_heavy"
+cache_pragma_profiles = {
+    "default": {},
+    "read_heavy": {
+        "journal_mode": "WAL",  # Readers never wait for the writer
+        "synchronous": "NORMAL",  # Durable enough for a cache, no fsync on each commit
+        "cache_size": -32768,  # 32MB of page cache per connection
+        "mmap_size": 256 * 1024 * 1024,  # Reads served from memory-mapped pages
+        "temp_store": "MEMORY"
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -8192  # 8MB
+    }
+}
+
+# Buffered writes of the collected metrics (metrics_collect_activated)
+metrics_buffer_size = 100000  # samples kept in memory until written, the oldest are dropped beyond
+metrics_flush_interval = 5  # seconds between two writes
+metrics_flush_threshold = 5000  # samples triggering a write before the interval
+metrics_raw_retention_days = 7  # days the samples are kept in fnc_exec and api_calls, beyond their rollups
+metrics_rollup_retention_days = {  # days kept per rollup resolution in seconds, None to keep them all
+    60: 2,
+    3600: 90,
+    86400: None
+}
+metrics_prune_interval = 3600  # seconds between two removals of the obsolete samples and rollups
+metrics_traces_kept = 10  # traces of the last searches kept in memory (metrics_tracing_activated)
+metrics_profiles_dir = "profiles"  # pstats files and their summaries, in the user data dir (metrics_profiling_activated)
+metrics_profile_top = 30  # functions listed in the summary of a profile, by self time
+
+# Format of the persistent key-value cache: "sqlite" (cache.db) or "log" (append-only segment files read through mmap)
+# The rows of the normalized endpoints (prices, terminals, routes...) are stored in cache.db with both formats
+# The log is locked by the first running instance, the others use cache.db
+persistent_cache_format = "sqlite"
+cache_log_dir = "cache_log"
+cache_log_segment_size = 64 * 1024 * 1024  # bytes written before a new segment is started
+cache_log_compaction_ratio = 0.5  # Compact the log once half of its bytes are dead records
+
+# History of the fetched prices
+price_history_retention_days = 90
+
+# Sharing of cache.db between several running instances
+cache_busy_timeout = 10  # seconds a connection waits for the lock held by another process
+cache_lease_ttl = 60  # seconds before the fetch lease of a crashed process expires
+cache_lease_poll_interval = 0.25  # seconds between cache checks while another process fetches
+cache_lease_wait_timeout = 30  # seconds waited for another process before fetching anyway
+cache_pin_ttl = 3600  # seconds before the pinned snapshot of a crashed process expires
+
+# Idle-time maintenance of cache.db (incremental vacuum, ANALYZE, WAL checkpoint)
+cache_maintenance_activated = True
+cache_maintenance_interval = 3600  # Run at most once per hour, unless entries were removed
+cache_maintenance_idle_delay = 30  # seconds without cache access before running
+cache_maintenance_check_interval = 60  # seconds
+cache_maintenance_vacuum_pages = 4096  # free pages released by each run
+
+# Cache snapshots (export/import) and seed of reference data bundled with releases
+cache_snapshot_version = 1
+cache_seed_activated = True
+# Resources shipped with the application: _internal/resources of the sources, or resources of the PyInstaller bundle
+resources_dir = os.path.join(getattr(sys, "_MEIPASS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "_internal")),
+                             "resources")
+cache_seed_file = os.path.join(resources_dir, "cache_seed.json.gz")
+cache_seed_endpoints = ["/star_systems", "/planets", "/terminals", "/commodities_routes"]
+
+# Outbox (queued POST requests)
+outbox_max_concurrency = 4
+outbox_max_attempts = 8
+outbox_retry_base_delay = 2  # seconds, doubled on each failed attempt
+outbox_retry_max_delay = 300  # 5min
+# Entries being sent are claimed by one instance sharing outbox.db, longer than the request timeout
+outbox_claim_ttl = 600  # 10min
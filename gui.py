@@ -12,12 +12,15 @@ from config_manager import ConfigManager
 from translation_manager import TranslationManager
 from api import API
 import asyncio
+import logging
+import os
 from tools import translate
 from global_variables import trade_tab_activated, trade_route_tab_activated
 from global_variables import best_trade_route_tab_activated, submit_tab_activated, metrics_tab_activated
 from global_variables import load_systems_activated, load_planets_activated, load_terminals_activated
 from global_variables import load_commodities_prices_activated, load_commodities_routes_activated
 from global_variables import remove_obsolete_keys_activated, distance_related_features, cleanup_cache_activated
+from global_variables import cache_seed_activated, cache_seed_file
 from metrics_widget import MetricsTab
 from metrics import Metrics
 
@@ -51,6 +54,9 @@ class UexcorpTrader(QWidget):
         self.api = None
         self.show_qmessagebox = show_qmessagebox
 
+    def get_logger(self):
+        return logging.getLogger(__name__)
+
     @Metrics.track_sync_fnc_exec
     def _update_splash(self, value, message):
         def update():
@@ -59,6 +65,7 @@ class UexcorpTrader(QWidget):
                 QApplication.processEvents()
         self.loop.call_soon_threadsafe(update)
 
+    @Metrics.capture_profile
     @Metrics.track_async_fnc_exec
     async def initialize(self):
         async with self._lock:
@@ -86,60 +93,72 @@ class UexcorpTrader(QWidget):
 
     @Metrics.track_async_fnc_exec
     async def _load_cache(self):
-        self._splash_remove_obsolete_keys()
+        await self._splash_remove_obsolete_keys()
+        await self._splash_import_cache_seed()
         await self._splash_load_systems()
         await self._splash_load_planets()
         await self._splash_load_terminals()
         await self._splash_load_commodities_prices()
         await self._splash_load_distances()
-        self._splash_cleanup_cache()
+        await self._splash_cleanup_cache()
 
-    @Metrics.track_sync_fnc_exec
-    def _splash_remove_obsolete_keys(self):
+    @Metrics.track_async_fnc_exec
+    async def _splash_remove_obsolete_keys(self):
         if remove_obsolete_keys_activated:
             self._update_splash(3, "Removing obsolete cache keys")
-            self.api.cache.clean_obsolete()
+            await self.api.cache.clean_obsolete()
+
+    @Metrics.track_async_fnc_exec
+    async def _splash_import_cache_seed(self):
+        # First launch: reference data comes from the seed, only the rest is fetched from the API
+        if cache_seed_activated and os.path.exists(cache_seed_file):
+            if not await self.api.cache.endpoint_exists_in_cache("/star_systems"):
+                self._update_splash(5, "Initializing API Cache - Importing bundled data...")
+                try:
+                    await self.api.cache.import_snapshot(cache_seed_file, fresh=True)
+                except (OSError, ValueError) as e:
+                    self.get_logger().warning(f"Cache seed could not be imported: {e}")
 
     @Metrics.track_async_fnc_exec
     async def _splash_load_systems(self):
         if load_systems_activated:
             self._update_splash(10, "Initializing API Cache - Systems...")
-            if not self.api.cache.endpoint_exists_in_cache("/star_systems"):
+            if not await self.api.cache.is_warm("/star_systems"):
                 await self.api.fetch_all_systems()
 
     @Metrics.track_async_fnc_exec
     async def _splash_load_planets(self):
         if load_planets_activated:
             self._update_splash(11, "Initializing API Cache - Planets...")
-            if not self.api.cache.endpoint_exists_in_cache("/planets"):
+            if not await self.api.cache.is_warm("/planets"):
                 await self.api.fetch_planets()
 
     @Metrics.track_async_fnc_exec
     async def _splash_load_terminals(self):
         if load_terminals_activated:
             self._update_splash(13, "Initializing API Cache - Terminals...")
-            if not self.api.cache.endpoint_exists_in_cache("/terminals"):
+            if not await self.api.cache.is_warm("/terminals"):
                 await self.api.fetch_all_terminals()
 
     @Metrics.track_async_fnc_exec
     async def _splash_load_commodities_prices(self):
         if load_commodities_prices_activated:
             self._update_splash(15, "Initializing API Cache - Commodities...")
-            if not self.api.cache.endpoint_exists_in_cache("/commodities_prices"):
+            if not await self.api.cache.is_warm("/commodities_prices"):
                 await self.api.fetch_all_commodities_prices()
 
     @Metrics.track_async_fnc_exec
     async def _splash_load_distances(self):
         if load_commodities_routes_activated and distance_related_features:
             self._update_splash(55, "Initializing API Cache - Distances (Once per week)...")
-            if not self.api.cache.endpoint_exists_in_cache("/commodities_routes"):
+            if not await self.api.cache.is_warm("/commodities_routes"):
                 await self.api.fetch_all_routes()
 
     @Metrics.track_async_fnc_exec
-    def _splash_cleanup_cache(self):
+    async def _splash_cleanup_cache(self):
         if cleanup_cache_activated:
             self._update_splash(96, "Initializing API Cache - Cleanup Cache...")
-            self.api.cache.clean_obsolete()
+            await self.api.cache.clean_obsolete()
 
     async def ensure_initialized(self):
         if not self._initialized.is_set():
@@ -1,15 +1,92 @@
 # metrics.py
+import logging
+import math
 import time
 import sqlite3
+import threading
+from atexit import register
+from collections import Counter, deque
 from functools import wraps
+from itertools import groupby
 from platformdirs import user_data_dir
 from global_variables import app_name, metrics_db_file
 import os
 import asyncio
 from global_variables import metrics_collect_activated
+from global_variables import metrics_buffer_size, metrics_flush_interval, metrics_flush_threshold
+from global_variables import metrics_raw_retention_days, metrics_rollup_retention_days, metrics_prune_interval
+from global_variables import metrics_tracing_activated, metrics_traces_kept
+from global_variables import metrics_profiling_activated, metrics_profile_startup
+from global_variables import metrics_profiles_dir, metrics_profile_top
+from tracing import Trace, Span, CpuTimedCoroutine, current_span
+from profiling import ProfileCapture
+
+
+def latency_bucket(seconds):
+    """Returns the histogram bucket of a duration: buckets grow by a factor 2^(1/4) (19%) from 1 microsecond."""
+    microseconds = seconds * 1e6
+    return 0 if microseconds <= 1 else math.ceil(math.log2(microseconds) * Metrics.buckets_per_octave)
+
+
+def bucket_latency(bucket):
+    """Returns the upper bound of a histogram bucket, in seconds."""
+    return 2 ** (bucket / Metrics.buckets_per_octave) / 1e6
+
+
+def histogram_percentiles(buckets, percentiles):
+    """Returns the value (bucket upper bound) of each percentile of a [(bucket, count), ...] histogram sorted by bucket."""
+    total = sum(count for _, count in buckets)
+    values = []
+    for percentile in percentiles:
+        rank = max(1, math.ceil(total * percentile / 100))
+        cumulated = 0
+        for bucket, count in buckets:
+            cumulated += count
+            if cumulated >= rank:
+                values.append(bucket_latency(bucket))
+                break
+    return values
 
 
 class Metrics:
+    """
+    Collects the execution time of the decorated functions and the API calls.
+
+    Samples are not written by the measured calls: they are appended to an
+    in-memory ring buffer, and a background writer thread inserts them in a
+    single transaction every metrics_flush_interval seconds, or as soon as
+    metrics_flush_threshold samples are waiting. What is left is written at
+    exit. When the buffer is full, the oldest samples are dropped (counted in
+    dropped_samples) rather than slowing down the measured code.
+
+    Execution times of functions and latencies of API requests are also
+    compacted on each write into log-bucketed histograms (count per bucket),
+    whose size doesn't depend on the number of samples: percentiles are read
+    from them with an error below the 19% width of a bucket.
+
+    Each API request (GET or POST) is also recorded with its start time,
+    duration, time to first byte, response size, HTTP status and retries.
+
+    Each write also adds the samples to per minute, hour and day rollups
+    (count, total, min and max per function or endpoint and period), which
+    the aggregates are read from. The writer thread removes the samples older
+    than metrics_raw_retention_days and the rollups past their retention
+    (metrics_rollup_retention_days), so metrics.db stays bounded.
+
+    With metrics_tracing_activated, each call of a function decorated with
+    record_trace() is recorded as a trace: the calls of decorated functions
+    it makes, in its task and the tasks it creates, are recorded as nested
+    spans with their wall and CPU times. The last traces are kept in traces,
+    and export_trace() writes one as a Chrome trace file.
+
+    With metrics_profiling_activated, request_profile() arms a capture: the
+    next call of a function decorated with capture_profile() runs under
+    cProfile, saved in metrics_profiles_dir with a summary of its top self
+    time functions. metrics_profile_startup arms it from the start.
+    """
+    buckets_per_octave = 4
+    rollup_resolutions = (60, 3600, 86400)
+    percentiles = (50, 90, 99, 99.9)
     _instance = None
     _lock = asyncio.Lock()
     _initialized = asyncio.Event()
@@ -33,8 +110,23 @@ class Metrics:
         if not hasattr(self, 'singleton'):  # Ensure __init__ is only called once
             # Initialize SQLite database
             db_dir = user_data_dir(app_name, ensure_exists=True)
-            db_path = os.path.join(db_dir, metrics_db_file)
-            self.conn = sqlite3.connect(db_path, isolation_level=None)  # Use autocommit mode
+            self.db_path = os.path.join(db_dir, metrics_db_file)
+            # Use autocommit mode, read from the main thread while the writer thread inserts with its own connection
+            self.conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+            self._fnc_samples = deque(maxlen=metrics_buffer_size)
+            self._api_samples = deque(maxlen=metrics_buffer_size)
+            self._latency_samples = deque(maxlen=metrics_buffer_size)
+            self._request_samples = deque(maxlen=metrics_buffer_size)
+            self.traces = deque(maxlen=metrics_traces_kept)
+            self.profile_requested = metrics_profile_startup
+            self.last_profile = None
+            self.dropped_samples = 0
+            self._flush_lock = threading.Lock()
+            self._flush_requested = threading.Event()
+            self._stopped = threading.Event()
+            self._writer = None
+            self._writer_conn = None
+            self._pruned_at = 0
             self.c = self.conn.cursor()
             try:
                 self.c.execute('PRAGMA journal_mode=WAL')  # Enable WAL mode
@@ -47,10 +139,197 @@ class Metrics:
                                 (endpoint TEXT, params TEXT,
                                  cache_hit INTEGER,
                                  timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+                self.c.execute('''CREATE TABLE IF NOT EXISTS fnc_exec_histogram
+                                (module_name TEXT, function_name TEXT, bucket INTEGER, count INTEGER,
+                                 PRIMARY KEY (module_name, function_name, bucket)) WITHOUT ROWID''')
+                self.c.execute('''CREATE TABLE IF NOT EXISTS api_calls_histogram
+                                (endpoint TEXT, bucket INTEGER, count INTEGER,
+                                 PRIMARY KEY (endpoint, bucket)) WITHOUT ROWID''')
+                self.c.execute('''CREATE TABLE IF NOT EXISTS api_requests
+                                (method TEXT, endpoint TEXT, started_at REAL, duration REAL, ttfb REAL,
+                                 response_bytes INTEGER, status INTEGER, retries INTEGER,
+                                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+                self._create_rollup_tables()
                 self.conn.commit()
                 self.singleton = True
             except sqlite3.OperationalError:
                 return
+            if metrics_collect_activated:
+                self._writer = threading.Thread(target=self._run_writer, name="metrics-writer", daemon=True)
+                self._writer.start()
+                register(self.close)
+
+    def _create_rollup_tables(self):
+        created = self.c.execute("SELECT 1 FROM sqlite_master WHERE name = 'fnc_exec_rollup'").fetchone() is None
+        self.c.execute('''CREATE TABLE IF NOT EXISTS fnc_exec_rollup
+                        (resolution INTEGER, period INTEGER, module_name TEXT, function_name TEXT,
+                         count INTEGER, total_time REAL, min_time REAL, max_time REAL,
+                         PRIMARY KEY (resolution, period, module_name, function_name)) WITHOUT ROWID''')
+        self.c.execute('''CREATE TABLE IF NOT EXISTS api_calls_rollup
+                        (resolution INTEGER, period INTEGER, endpoint TEXT, count INTEGER, cache_hits INTEGER,
+                         PRIMARY KEY (resolution, period, endpoint)) WITHOUT ROWID''')
+        self.c.execute('''CREATE TABLE IF NOT EXISTS api_requests_rollup
+                        (resolution INTEGER, period INTEGER, method TEXT, endpoint TEXT,
+                         count INTEGER, errors INTEGER, responses INTEGER, retries INTEGER,
+                         response_bytes INTEGER, total_time REAL, total_ttfb REAL,
+                         PRIMARY KEY (resolution, period, method, endpoint)) WITHOUT ROWID''')
+        if not created:
+            return
+        # Samples collected before the rollups existed
+        resolutions = ", ".join(f"({resolution})" for resolution in self.rollup_resolutions)
+        period = "CAST(strftime('%s', timestamp) AS INTEGER) / column1 * column1"
+        self.c.execute(f'''INSERT INTO fnc_exec_rollup
+                        SELECT column1, {period}, module_name, function_name, COUNT(1),
+                               SUM(execution_time), MIN(execution_time), MAX(execution_time)
+                        FROM fnc_exec, (VALUES {resolutions})
+                        GROUP BY 1, 2, 3, 4''')
+        self.c.execute(f'''INSERT INTO api_calls_rollup
+                        SELECT column1, {period}, endpoint, COUNT(1), SUM(cache_hit)
+                        FROM api_calls, (VALUES {resolutions})
+                        GROUP BY 1, 2, 3''')
+
+    def _record(self, samples, sample):
+        if len(samples) == samples.maxlen:
+            self.dropped_samples += 1
+        samples.append(sample)
+        if len(samples) >= metrics_flush_threshold:
+            self._flush_requested.set()
+
+    def record_fnc_exec(self, module_name, function_name, execution_time):
+        self._record(self._fnc_samples, (module_name, function_name, execution_time, time.time()))
+
+    def _run_writer(self):
+        while not self._stopped.is_set():
+            self._flush_requested.wait(metrics_flush_interval)
+            self._flush_requested.clear()
+            self.flush()
+            if time.time() - self._pruned_at >= metrics_prune_interval:
+                self.prune_obsolete()
+
+    @staticmethod
+    def _drain(samples):
+        drained = []
+        for _ in range(len(samples)):
+            drained.append(samples.popleft())
+        return drained
+
+    def flush(self):
+        """Writes the buffered samples and their histograms in a single transaction."""
+        with self._flush_lock:
+            fnc_samples = self._drain(self._fnc_samples)
+            api_samples = self._drain(self._api_samples)
+            latency_samples = self._drain(self._latency_samples)
+            request_samples = self._drain(self._request_samples)
+            if not fnc_samples and not api_samples and not latency_samples and not request_samples:
+                return
+            self._open_writer_conn()
+            try:
+                self._writer_conn.execute("BEGIN")
+                self._write_samples(fnc_samples, api_samples, latency_samples)
+                self._write_requests(request_samples)
+                self._writer_conn.execute("COMMIT")
+            except sqlite3.OperationalError:
+                if self._writer_conn.in_transaction:
+                    self._writer_conn.execute("ROLLBACK")
+                return  # TODO - Log error instead
+
+    def _open_writer_conn(self):
+        if self._writer_conn is None:
+            self._writer_conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+
+    def prune_obsolete(self):
+        """Removes the samples and rollups past their retention."""
+        now = time.time()
+        with self._flush_lock:
+            self._open_writer_conn()
+            try:
+                self._writer_conn.execute("BEGIN")
+                raw_limit = now - metrics_raw_retention_days * 86400
+                for table in ("fnc_exec", "api_calls", "api_requests"):
+                    self._writer_conn.execute(f"DELETE FROM {table} WHERE timestamp < datetime(?, 'unixepoch')",
+                                              (raw_limit,))
+                for resolution, retention_days in metrics_rollup_retention_days.items():
+                    if retention_days is None:
+                        continue
+                    for table in ("fnc_exec_rollup", "api_calls_rollup", "api_requests_rollup"):
+                        self._writer_conn.execute(f"DELETE FROM {table} WHERE period < ? AND resolution = ?",
+                                                  (now - retention_days * 86400, resolution))
+                self._writer_conn.execute("COMMIT")
+            except sqlite3.OperationalError:
+                if self._writer_conn.in_transaction:
+                    self._writer_conn.execute("ROLLBACK")
+                return  # TODO - Log error instead
+            self._pruned_at = now
+
+    @staticmethod
+    def _rollups(samples, key, value):
+        """Returns {(resolution, period, *key): (count, total, min, max)} of the samples, key and value being indexes."""
+        rollups = {}
+        for sample in samples:
+            sample_value = sample[value]
+            for resolution in Metrics.rollup_resolutions:
+                rollup_key = (resolution, int(sample[-1]) // resolution * resolution, *(sample[i] for i in key))
+                count, total, low, high = rollups.get(rollup_key, (0, 0, sample_value, sample_value))
+                rollups[rollup_key] = (count + 1, total + sample_value, min(low, sample_value), max(high, sample_value))
+        return rollups
+
+    def _write_rollups(self, fnc_samples, api_samples):
+        self._writer_conn.executemany("""INSERT INTO fnc_exec_rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                                      ON CONFLICT DO UPDATE SET count = count + excluded.count,
+                                      total_time = total_time + excluded.total_time,
+                                      min_time = min(min_time, excluded.min_time),
+                                      max_time = max(max_time, excluded.max_time)""",
+                                      [(*key, *values) for key, values in self._rollups(fnc_samples, (0, 1), 2).items()])
+        self._writer_conn.executemany("""INSERT INTO api_calls_rollup VALUES (?, ?, ?, ?, ?)
+                                      ON CONFLICT DO UPDATE SET count = count + excluded.count,
+                                      cache_hits = cache_hits + excluded.cache_hits""",
+                                      [(*key, count, cache_hits) for key, (count, cache_hits, _, _)
+                                       in self._rollups(api_samples, (0,), 2).items()])
+
+    @staticmethod
+    def _request_rollups(request_samples):
+        """Returns {(resolution, period, method, endpoint): [count, errors, responses, retries, bytes, time, ttfb]}."""
+        rollups = {}
+        for method, endpoint, started_at, duration, ttfb, response_bytes, status, retries in request_samples:
+            values = (1, status is None or status >= 400, ttfb is not None, retries, response_bytes, duration, ttfb or 0)
+            for resolution in Metrics.rollup_resolutions:
+                rollup = rollups.setdefault((resolution, int(started_at) // resolution * resolution, method, endpoint),
+                                            [0, 0, 0, 0, 0, 0, 0])
+                for i, value in enumerate(values):
+                    rollup[i] += value
+        return rollups
+
+    def _write_requests(self, request_samples):
+        self._writer_conn.executemany("""INSERT INTO api_requests
+                                      (method, endpoint, started_at, duration, ttfb, response_bytes, status, retries,
+                                       timestamp)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime(?, 'unixepoch'))""",
+                                      [(*sample, sample[2]) for sample in request_samples])
+        self._writer_conn.executemany("""INSERT INTO api_requests_rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                      ON CONFLICT DO UPDATE SET count = count + excluded.count,
+                                      errors = errors + excluded.errors,
+                                      responses = responses + excluded.responses,
+                                      retries = retries + excluded.retries,
+                                      response_bytes = response_bytes + excluded.response_bytes,
+                                      total_time = total_time + excluded.total_time,
+                                      total_ttfb = total_ttfb + excluded.total_ttfb""",
+                                      [(*key, *values) for key, values in self._request_rollups(request_samples).items()])
+
+    def _write_samples(self, fnc_samples, api_samples, latency_samples):
+        self._writer_conn.executemany("""INSERT INTO fnc_exec (module_name, function_name, execution_time, timestamp)
+                                      VALUES (?, ?, ?, datetime(?, 'unixepoch'))""", fnc_samples)
+        self._writer_conn.executemany("""INSERT INTO api_calls (endpoint, params, cache_hit, timestamp)
+                                      VALUES (?, ?, ?, datetime(?, 'unixepoch'))""", api_samples)
+        fnc_histogram = Counter((module_name, function_name, latency_bucket(execution_time))
+                                for module_name, function_name, execution_time, _ in fnc_samples)
+        self._writer_conn.executemany("""INSERT INTO fnc_exec_histogram VALUES (?, ?, ?, ?)
+                                      ON CONFLICT DO UPDATE SET count = count + excluded.count""",
+                                      [(*key, count) for key, count in fnc_histogram.items()])
+        self._write_rollups(fnc_samples, api_samples)
+        api_histogram = Counter((endpoint, latency_bucket(latency)) for endpoint, latency in latency_samples)
+        self._writer_conn.executemany("""INSERT INTO api_calls_histogram VALUES (?, ?, ?)
+                                      ON CONFLICT DO UPDATE SET count = count + excluded.count""",
+                                      [(*key, count) for key, count in api_histogram.items()])
 
     async def initialize(self):
         async with self._lock:
@@ -59,78 +338,225 @@ class Metrics:
 
     @staticmethod
     def track_sync_fnc_exec(func):
+        """Records the execution time and span of func, or returns func itself when neither collected nor traced."""
+        if not metrics_collect_activated and not metrics_tracing_activated:
+            return func
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            instance = Metrics._instance or Metrics()
-            start_time = time.time()
-            result = func(*args, **kwargs)
+            opened_span = Span.open(func) if metrics_tracing_activated else None
+            start_time = time.perf_counter_ns()
+            start_cpu = time.thread_time_ns()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                end_time = time.perf_counter_ns()
+                if opened_span is not None:
+                    Metrics._close_span(opened_span, start_time, end_time, time.thread_time_ns() - start_cpu)
             if metrics_collect_activated:
-                end_time = time.time()
-                execution_time = end_time - start_time
-                try:
-                    instance.c.execute("INSERT INTO fnc_exec (module_name, function_name, execution_time) VALUES (?, ?, ?)",
-                                       (func.__module__, func.__name__, execution_time))
-                except sqlite3.OperationalError:
-                    return result  # TODO - Log error instead
+                execution_time = (end_time - start_time) / 1e9
+                (Metrics._instance or Metrics()).record_fnc_exec(func.__module__, func.__name__, execution_time)
             return result
         return wrapper
 
     @staticmethod
     def track_async_fnc_exec(func):
+        """Records the execution time and span of coroutine func, or returns func itself when neither collected nor traced."""
+        if not metrics_collect_activated and not metrics_tracing_activated:
+            return func
+
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            instance = await Metrics.get_instance()
-            start_time = time.time()
-            result = await func(*args, **kwargs)
-            if metrics_collect_activated:
-                end_time = time.time()
-                execution_time = end_time - start_time
+            opened_span = Span.open(func) if metrics_tracing_activated else None
+            start_time = time.perf_counter_ns()
+            if opened_span is None:
+                result = await func(*args, **kwargs)
+            else:
+                coro = CpuTimedCoroutine(func(*args, **kwargs))
                 try:
-                    instance.c.execute("INSERT INTO fnc_exec (module_name, function_name, execution_time) VALUES (?, ?, ?)",
-                                       (func.__module__, func.__name__, execution_time))
-                except sqlite3.OperationalError:
-                    return result  # TODO - Log error instead
+                    result = await coro
+                finally:
+                    Metrics._close_span(opened_span, start_time, time.perf_counter_ns(), coro.cpu)
+            if metrics_collect_activated:
+                execution_time = (time.perf_counter_ns() - start_time) / 1e9
+                (Metrics._instance or Metrics()).record_fnc_exec(func.__module__, func.__name__, execution_time)
             return result
         return wrapper
 
+    @staticmethod
+    def _close_span(opened_span, start_time, end_time, cpu_time):
+        span, token = opened_span
+        span.close(start_time, end_time, cpu_time)
+        current_span.reset(token)
+
+    @staticmethod
+    def record_trace(func):
+        """Records each call of the coroutine func as a trace of the spans it runs, or returns func itself when not traced."""
+        if not metrics_tracing_activated:
+            return func
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            trace = Trace(func.__qualname__)
+            root_span = Span(trace, func.__module__, func.__qualname__)
+            token = current_span.set(root_span)
+            start_time = time.perf_counter_ns()
+            coro = CpuTimedCoroutine(func(*args, **kwargs))
+            try:
+                return await coro
+            finally:
+                root_span.close(start_time, time.perf_counter_ns(), coro.cpu)
+                current_span.reset(token)
+                (Metrics._instance or Metrics()).traces.append(trace)
+        return wrapper
+
+    def export_trace(self, path, trace=None):
+        """Writes a trace (the last one by default) as a Chrome trace file, and returns whether there was one."""
+        trace = trace or (self.traces[-1] if self.traces else None)
+        if trace is None:
+            return False
+        trace.export(path)
+        return True
+
+    @staticmethod
+    def capture_profile(func):
+        """Profiles the next call of the coroutine func once requested, or returns func itself when not profiled."""
+        if not metrics_profiling_activated:
+            return func
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            metrics = Metrics._instance or Metrics()
+            if not metrics.profile_requested:
+                return await func(*args, **kwargs)
+            metrics.profile_requested = False  # Only this call, not the decorated calls it makes
+            profile = ProfileCapture(func.__qualname__)
+            try:
+                with profile:
+                    return await func(*args, **kwargs)
+            finally:
+                metrics.save_profile(profile)
+        return wrapper
+
+    def request_profile(self):
+        """Profiles the next call of a function decorated with capture_profile()."""
+        self.profile_requested = True
+
+    def save_profile(self, profile):
+        profile.save(os.path.join(user_data_dir(app_name, ensure_exists=True), metrics_profiles_dir),
+                     metrics_profile_top)
+        self.last_profile = profile
+        logging.getLogger(__name__).info(f"Profile of {profile.name} saved in {profile.stats_path}")
+
     @track_sync_fnc_exec
     def track_api_call(self, endpoint: str, params: dict, cache_hit: bool):
         if metrics_collect_activated:
-            try:
-                self.c.execute("INSERT INTO api_calls (endpoint, params, cache_hit) VALUES (?, ?, ?)",
-                               (endpoint, str(params), 1 if cache_hit else 0))
-            except sqlite3.OperationalError:
-                return  # TODO - Log error instead
+            self._record(self._api_samples, (endpoint, str(params), 1 if cache_hit else 0, time.time()))
+
+    def track_api_latency(self, endpoint: str, latency: float):
+        """Records the duration in seconds of an API request, from its start until its response is read."""
+        if metrics_collect_activated:
+            self._record(self._latency_samples, (endpoint, latency))
+
+    def track_api_request(self, method, endpoint, started_at, duration, ttfb, response_bytes, status, retries=0):
+        """
+        Records an API request started at started_at (epoch seconds), with its duration and time to first byte
+        in seconds (None without response), the size of its response body, its HTTP status (None without
+        response) and the failed attempts which preceded it.
+        """
+        if metrics_collect_activated:
+            self._record(self._request_samples,
+                         (method, endpoint, started_at, duration, ttfb, response_bytes, status, retries))
+
+    def _fetch_percentiles(self, table, key_columns):
+        self.flush()
+        keys = ", ".join(key_columns)
+        rows = self.c.execute(f"SELECT {keys}, bucket, count FROM {table} ORDER BY {keys}, bucket").fetchall()
+        size = len(key_columns)
+        return {key: histogram_percentiles([row[size:] for row in key_rows], self.percentiles)
+                for key, key_rows in groupby(rows, key=lambda row: row[:size])}
+
+    @track_sync_fnc_exec
+    def fetch_fnc_percentiles(self):
+        """Returns {(module_name, function_name): [p50, p90, p99, p999]} of the execution times in seconds."""
+        return self._fetch_percentiles("fnc_exec_histogram", ["module_name", "function_name"])
+
+    @track_sync_fnc_exec
+    def fetch_api_percentiles(self):
+        """Returns {(endpoint,): [p50, p90, p99, p999]} of the API request latencies in seconds."""
+        return self._fetch_percentiles("api_calls_histogram", ["endpoint"])
 
     @track_sync_fnc_exec
     def fetch_fnc_exec(self):
-        self.c.execute('''SELECT module_name, function_name, COUNT(1) as nb_exec,
-                          AVG(execution_time) as mean_exec_time,
-                          MAX(execution_time) as max_exec_time,
-                          MIN(execution_time) as min_exec_time,
-                          SUM(execution_time) as total_time
-                          FROM fnc_exec
+        self.flush()
+        self.c.execute('''SELECT module_name, function_name, SUM(count) as nb_exec,
+                          SUM(total_time) / SUM(count) as mean_exec_time,
+                          MAX(max_time) as max_exec_time,
+                          MIN(min_time) as min_exec_time,
+                          SUM(total_time) as total_time
+                          FROM fnc_exec_rollup
+                          WHERE resolution = ?
                           GROUP BY module_name, function_name
-                          ORDER BY total_time DESC''')
+                          ORDER BY total_time DESC''', (self.rollup_resolutions[-1],))
         return self.c.fetchall()
 
     @track_sync_fnc_exec
     def fetch_api_calls(self):
-        self.c.execute('''SELECT endpoint, COUNT(1) as nb_calls,
-                          SUM(cache_hit) as cache_hit
-                          FROM api_calls
+        self.flush()
+        self.c.execute('''SELECT endpoint, SUM(count) as nb_calls,
+                          SUM(cache_hits) as cache_hit
+                          FROM api_calls_rollup
+                          WHERE resolution = ?
                           GROUP BY endpoint
-                          ORDER BY nb_calls DESC''')
+                          ORDER BY nb_calls DESC''', (self.rollup_resolutions[-1],))
+        return self.c.fetchall()
+
+    @track_sync_fnc_exec
+    def fetch_api_requests(self):
+        """
+        Returns (method, endpoint, nb_requests, errors, retries, response_bytes, mean_time, mean_ttfb) per
+        endpoint, errors being the requests without response or answered with a 4xx or 5xx status.
+        """
+        self.flush()
+        self.c.execute('''SELECT method, endpoint, SUM(count) as nb_requests,
+                          SUM(errors) as errors, SUM(retries) as retries,
+                          SUM(response_bytes) as response_bytes,
+                          SUM(total_time) / SUM(count) as mean_time,
+                          SUM(total_ttfb) / NULLIF(SUM(responses), 0) as mean_ttfb
+                          FROM api_requests_rollup
+                          WHERE resolution = ?
+                          GROUP BY method, endpoint
+                          ORDER BY SUM(total_time) DESC''', (self.rollup_resolutions[-1],))
         return self.c.fetchall()
 
     @track_sync_fnc_exec
     def remove_all_metrics(self):
+        with self._flush_lock:
+            self._fnc_samples.clear()
+            self._api_samples.clear()
+            self._latency_samples.clear()
+            self._request_samples.clear()
         try:
             self.c.execute('DELETE FROM api_calls')
             self.c.execute('DELETE FROM fnc_exec')
+            self.c.execute('DELETE FROM api_calls_histogram')
+            self.c.execute('DELETE FROM fnc_exec_histogram')
+            self.c.execute('DELETE FROM api_calls_rollup')
+            self.c.execute('DELETE FROM fnc_exec_rollup')
+            self.c.execute('DELETE FROM api_requests')
+            self.c.execute('DELETE FROM api_requests_rollup')
             self.conn.commit()
         except sqlite3.OperationalError:
             return  # TODO - Log error instead
 
     def close(self):
+        """Stops the writer thread, and writes the samples left."""
+        self._stopped.set()
+        self._flush_requested.set()
+        if self._writer is not None and self._writer is not threading.current_thread():
+            self._writer.join()
+        self.flush()
+        if self._writer_conn is not None:
+            self._writer_conn.close()
+            self._writer_conn = None
         self.conn.close()
@@ -1,6 +1,8 @@
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QTableWidget, QTableWidgetItem, QPushButton
+from PyQt5.QtWidgets import QFileDialog, QMessageBox
 from metrics import Metrics
 from tools import create_async_callback
+from global_variables import metrics_tracing_activated, metrics_profiling_activated
 import asyncio
 
 
@@ -31,19 +33,29 @@ class MetricsTab(QWidget):
         self.setLayout(layout)
 
         self.fnc_exec_table = QTableWidget()
-        self.fnc_exec_table.setColumnCount(7)
+        self.fnc_exec_table.setColumnCount(11)
         self.fnc_exec_table.setHorizontalHeaderLabels(["Module", "Function", "Exec Count",
                                                        "Mean Time (ms)", "Max Time (ms)",
-                                                       "Min Time (ms)", "Total Time (ms)"])
+                                                       "Min Time (ms)", "Total Time (ms)",
+                                                       "p50 (ms)", "p90 (ms)", "p99 (ms)", "p99.9 (ms)"])
         layout.addWidget(QLabel("Function Execution Metrics"))
         layout.addWidget(self.fnc_exec_table)
 
         self.api_calls_table = QTableWidget()
-        self.api_calls_table.setColumnCount(3)
-        self.api_calls_table.setHorizontalHeaderLabels(["Endpoint", "Call Count", "Cache Hit Ratio"])
+        self.api_calls_table.setColumnCount(7)
+        self.api_calls_table.setHorizontalHeaderLabels(["Endpoint", "Call Count", "Cache Hit Ratio",
+                                                        "p50 (ms)", "p90 (ms)", "p99 (ms)", "p99.9 (ms)"])
         layout.addWidget(QLabel("API Call Metrics"))
         layout.addWidget(self.api_calls_table)
 
+        self.api_requests_table = QTableWidget()
+        self.api_requests_table.setColumnCount(10)
+        self.api_requests_table.setHorizontalHeaderLabels(["Method", "Endpoint", "Request Count", "Errors",
+                                                           "Error Ratio", "Retries", "Downloaded (KB)",
+                                                           "Mean Size (KB)", "Mean Time (ms)", "Mean TTFB (ms)"])
+        layout.addWidget(QLabel("API Request Metrics"))
+        layout.addWidget(self.api_requests_table)
+
         self.refresh_button = QPushButton("Refresh Metrics")
         self.refresh_button.clicked.connect(create_async_callback(self.refresh_metrics))
         layout.addWidget(self.refresh_button)
@@ -52,6 +64,16 @@ class MetricsTab(QWidget):
         self.clear_metrics_button.clicked.connect(create_async_callback(self.erase_metrics))
         layout.addWidget(self.clear_metrics_button)
 
+        if metrics_tracing_activated:
+            self.export_trace_button = QPushButton("Export Last Search Trace")
+            self.export_trace_button.clicked.connect(create_async_callback(self.export_trace))
+            layout.addWidget(self.export_trace_button)
+
+        if metrics_profiling_activated:
+            self.profile_button = QPushButton("Profile Next Search")
+            self.profile_button.clicked.connect(create_async_callback(self.request_profile))
+            layout.addWidget(self.profile_button)
+
     async def refresh_metrics(self):
         self.clear_metrics()
         await self.load_metrics()
@@ -61,13 +83,31 @@ class MetricsTab(QWidget):
         self.clear_metrics()
         self.metrics.remove_all_metrics()
 
+    async def export_trace(self):
+        await self.ensure_initialized()
+        path, _ = QFileDialog.getSaveFileName(self, "Export Last Search Trace", "trace.json",
+                                              "Chrome Trace (*.json)")
+        if path and not self.metrics.export_trace(path):
+            QMessageBox.information(self, "Export Last Search Trace", "No search was traced yet.")
+
+    async def request_profile(self):
+        await self.ensure_initialized()
+        last_profile = self.metrics.last_profile
+        self.metrics.request_profile()
+        message = "The next search will be profiled."
+        if last_profile is not None:
+            message += f"\n\nLast profile ({last_profile.name}):\n{last_profile.stats_path}\n{last_profile.summary_path}"
+        QMessageBox.information(self, "Profile Next Search", message)
+
     def clear_metrics(self):
         self.fnc_exec_table.clear()
         self.api_calls_table.clear()
+        self.api_requests_table.clear()
 
     async def load_metrics(self):
         await self.ensure_initialized()
         fnc_exec = self.metrics.fetch_fnc_exec()
+        fnc_percentiles = self.metrics.fetch_fnc_percentiles()
         self.fnc_exec_table.setRowCount(len(fnc_exec))
         for i, (module_name, function_name,
                 nb_exec, mean_exec_time,
@@ -80,13 +120,36 @@ class MetricsTab(QWidget):
             self.fnc_exec_table.setItem(i, 4, QTableWidgetItem(f"{round(max_exec_time * 1000, 0)}ms"))
             self.fnc_exec_table.setItem(i, 5, QTableWidgetItem(f"{round(min_exec_time * 1000, 0)}ms"))
             self.fnc_exec_table.setItem(i, 6, QTableWidgetItem(f"{round(total_time * 1000, 0)}ms"))
+            self.set_percentiles(self.fnc_exec_table, i, 7, fnc_percentiles.get((module_name, function_name)))
 
         api_calls = self.metrics.fetch_api_calls()
+        api_percentiles = self.metrics.fetch_api_percentiles()
         self.api_calls_table.setRowCount(len(api_calls))
         for i, (endpoint, nb_calls, cache_hit) in enumerate(api_calls):
             self.api_calls_table.setItem(i, 0, QTableWidgetItem(endpoint))
             self.api_calls_table.setItem(i, 1, QTableWidgetItem(str(nb_calls)))
             self.api_calls_table.setItem(i, 2, QTableWidgetItem(f"{(cache_hit / nb_calls) * 100:.2f}%"))
+            self.set_percentiles(self.api_calls_table, i, 3, api_percentiles.get((endpoint,)))
+
+        api_requests = self.metrics.fetch_api_requests()
+        self.api_requests_table.setRowCount(len(api_requests))
+        for i, (method, endpoint, nb_requests, errors, retries,
+                response_bytes, mean_time, mean_ttfb) in enumerate(api_requests):
+            self.api_requests_table.setItem(i, 0, QTableWidgetItem(method))
+            self.api_requests_table.setItem(i, 1, QTableWidgetItem(endpoint))
+            self.api_requests_table.setItem(i, 2, QTableWidgetItem(str(nb_requests)))
+            self.api_requests_table.setItem(i, 3, QTableWidgetItem(str(errors)))
+            self.api_requests_table.setItem(i, 4, QTableWidgetItem(f"{(errors / nb_requests) * 100:.2f}%"))
+            self.api_requests_table.setItem(i, 5, QTableWidgetItem(str(retries)))
+            self.api_requests_table.setItem(i, 6, QTableWidgetItem(f"{response_bytes / 1024:.1f}"))
+            self.api_requests_table.setItem(i, 7, QTableWidgetItem(f"{response_bytes / nb_requests / 1024:.1f}"))
+            self.api_requests_table.setItem(i, 8, QTableWidgetItem(f"{mean_time * 1000:.2f}ms"))
+            if mean_ttfb is not None:
+                self.api_requests_table.setItem(i, 9, QTableWidgetItem(f"{mean_ttfb * 1000:.2f}ms"))
+
+    def set_percentiles(self, table, row, column, percentiles):
+        for offset, percentile in enumerate(percentiles or []):
+            table.setItem(row, column + offset, QTableWidgetItem(f"{percentile * 1000:.2f}ms"))
 
     def set_gui_enabled(self, enabled):
         return
@@ -0,0 +1,346 @@
+# outbox.py
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from atexit import register
+
+import aiohttp
+from platformdirs import user_data_dir
+from global_variables import app_name, outbox_db_file, cache_busy_timeout
+from global_variables import outbox_max_concurrency, outbox_max_attempts, outbox_claim_ttl
+from global_variables import outbox_retry_base_delay, outbox_retry_max_delay
+from metrics import Metrics
+
+# Failed attempts before the request being sent by the outbox, in the task sending it
+send_retries = contextvars.ContextVar("send_retries", default=0)
+
+
+class Outbox:
+    """
+    A durable SQLite-backed queue for POST requests sent to the API.
+
+    Entries are stored instantly by enqueue() and sent later by a background
+    worker running on the event loop, with a bounded number of concurrent
+    requests.
+
+    The API records a request as soon as it receives it, and has no way to
+    recognize a request sent twice. An entry is therefore only retried
+    automatically, with an exponential backoff, when it could not reach the
+    server at all (connection refused, DNS failure...). Any other error,
+    including timeouts and lost responses, or the maximum number of
+    attempts, keeps the entry with the "failed" status until the user
+    retries or discards it.
+
+    outbox.db is shared by every instance using the same profile: an entry
+    is claimed by one instance before being sent, so it is sent once. A
+    claim whose instance stopped before the end of the request expires as
+    failed, since the request may have reached the API.
+
+    Listeners registered with add_listener() are called once per entry when
+    it is either sent or failed, with (key, endpoint, response, error).
+    """
+    STATUS_PENDING = "pending"
+    STATUS_SENDING = "sending"
+    STATUS_FAILED = "failed"
+
+    def __init__(self, sender, in_memory=False, max_concurrency=outbox_max_concurrency,
+                 max_attempts=outbox_max_attempts, claim_ttl=outbox_claim_ttl):
+        if in_memory is True:
+            self.db_path = ":memory:"
+        else:
+            db_dir = user_data_dir(app_name, ensure_exists=True)
+            self.db_path = os.path.join(db_dir, outbox_db_file)
+        self.sender = sender
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.claim_ttl = claim_ttl
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        self.con = sqlite3.connect(self.db_path, timeout=cache_busy_timeout)
+        self.__create_table()
+        register(self.con.close)
+        self._listeners = []
+        self._in_flight = {}
+        self._worker = None
+        self._wakeup = None
+
+    def __create_table(self):
+        cur = self.con.cursor()
+        try:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    key TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_error TEXT,
+                    owner TEXT,
+                    lease_until REAL
+                )
+            """)
+            # Files created before entries were claimed
+            columns = [row[1] for row in cur.execute("PRAGMA table_info(outbox);").fetchall()]
+            for column, column_type in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    cur.execute(f"ALTER TABLE outbox ADD COLUMN {column} {column_type};")
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS outbox_due
+                ON outbox (status, next_attempt_at)
+            """)
+            self.con.commit()
+        except sqlite3.OperationalError as e:
+            self.get_logger().error(f"Outbox table creation failed: {e}")
+        finally:
+            cur.close()
+
+    def get_logger(self):
+        return logging.getLogger(__name__)
+
+    def _update(self, query, params):
+        """Runs a write query in its own transaction, and returns the number of changed rows (None if it failed)."""
+        cur = self.con.cursor()
+        try:
+            cur.execute(query, params)
+            self.con.commit()
+            return cur.rowcount
+        except sqlite3.OperationalError as e:
+            self.con.rollback()
+            self.get_logger().error(f"Outbox update failed: {e}")
+            return None
+        finally:
+            cur.close()
+
+    def _select(self, query, params):
+        """Runs a read query and returns its rows, none if it failed."""
+        cur = self.con.cursor()
+        try:
+            return cur.execute(query, params).fetchall()
+        except sqlite3.OperationalError as e:
+            self.get_logger().error(f"Outbox read failed: {e}")
+            return []
+        finally:
+            cur.close()
+
+    @Metrics.track_sync_fnc_exec
+    def add_listener(self, listener):
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    @Metrics.track_sync_fnc_exec
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    @Metrics.track_sync_fnc_exec
+    def enqueue(self, endpoint, data=None):
+        """Stores a request to send, and returns its key. Raises sqlite3.OperationalError when it can't be stored."""
+        key = uuid.uuid4().hex
+        now = time.time()
+        cur = self.con.cursor()
+        try:
+            cur.execute("""
+                INSERT INTO outbox (key, endpoint, payload, status, attempts, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, 0, ?, ?)
+            """, [key, endpoint, json.dumps(data if data else {}), self.STATUS_PENDING, now, now])
+            self.con.commit()
+        except sqlite3.OperationalError:
+            self.con.rollback()
+            raise
+        finally:
+            cur.close()
+        self.get_logger().debug(f"Outbox: queued {endpoint} as {key}")
+        self._wake()
+        return key
+
+    @Metrics.track_sync_fnc_exec
+    def pending_count(self):
+        """Returns the number of entries waiting to be sent or being sent, by any instance."""
+        rows = self._select("SELECT COUNT(1) FROM outbox WHERE status IN (?, ?);",
+                            [self.STATUS_PENDING, self.STATUS_SENDING])
+        return rows[0][0] if rows else 0
+
+    @Metrics.track_sync_fnc_exec
+    def failed_entries(self):
+        rows = self._select("""
+            SELECT key, endpoint, payload, attempts, last_error
+            FROM outbox
+            WHERE status = ?
+            ORDER BY created_at;
+        """, [self.STATUS_FAILED])
+        return [{"key": key, "endpoint": endpoint, "data": json.loads(payload),
+                 "attempts": attempts, "error": last_error}
+                for key, endpoint, payload, attempts, last_error in rows]
+
+    @Metrics.track_sync_fnc_exec
+    def retry_failed(self, keys=None):
+        """Sends the failed entries again, or only the ones of the given keys."""
+        self._update(f"""
+            UPDATE outbox
+            SET status = ?, attempts = 0, next_attempt_at = ?
+            WHERE status = ?{self._keys_condition(keys)};
+        """, [self.STATUS_PENDING, time.time(), self.STATUS_FAILED, *(keys or [])])
+        self._wake()
+
+    @Metrics.track_sync_fnc_exec
+    def discard_failed(self, keys=None):
+        """Deletes the failed entries, or only the ones of the given keys."""
+        self._update(f"""
+            DELETE FROM outbox
+            WHERE status = ?{self._keys_condition(keys)};
+        """, [self.STATUS_FAILED, *(keys or [])])
+
+    @staticmethod
+    def _keys_condition(keys):
+        if keys is None:
+            return ""
+        return f" AND key IN ({', '.join('?' * len(keys))})" if keys else " AND 0"
+
+    @Metrics.track_sync_fnc_exec
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.ensure_future(self._run())
+
+    @Metrics.track_async_fnc_exec
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight.values(), return_exceptions=True)
+
+    @Metrics.track_async_fnc_exec
+    async def flush(self):
+        """Sends every due entry now and waits until none is left in flight."""
+        while True:
+            self._dispatch_due()
+            if not self._in_flight:
+                return
+            await asyncio.gather(*self._in_flight.values(), return_exceptions=True)
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            self._dispatch_due()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_delay())
+            except asyncio.TimeoutError:
+                pass
+
+    @Metrics.track_sync_fnc_exec
+    def _dispatch_due(self):
+        self._expire_claims()
+        free_slots = self.max_concurrency - len(self._in_flight)
+        if free_slots <= 0:
+            return
+        for key, endpoint, payload, attempts in self._fetch_due(free_slots):
+            if not self._claim(key):
+                continue  # Claimed by another instance in the meantime
+            task = asyncio.ensure_future(self._send(key, endpoint, json.loads(payload), attempts))
+            self._in_flight[key] = task
+
+    def _fetch_due(self, limit):
+        rows = self._select("""
+            SELECT key, endpoint, payload, attempts
+            FROM outbox
+            WHERE status = ? AND next_attempt_at <= ?
+            ORDER BY next_attempt_at
+            LIMIT ?;
+        """, [self.STATUS_PENDING, time.time(), limit + len(self._in_flight)])
+        return [row for row in rows if row[0] not in self._in_flight][:limit]
+
+    def _claim(self, key):
+        """Claims a pending entry for this instance, and returns whether it was still pending."""
+        return self._update("""
+            UPDATE outbox
+            SET status = ?, owner = ?, lease_until = ?
+            WHERE key = ? AND status = ?;
+        """, [self.STATUS_SENDING, self.owner, time.time() + self.claim_ttl, key, self.STATUS_PENDING]) == 1
+
+    def _expire_claims(self):
+        """Marks as failed the entries whose claim expired: the request may have reached the API before it stopped."""
+        self._update("""
+            UPDATE outbox
+            SET status = ?, owner = NULL, last_error = ?
+            WHERE status = ? AND lease_until <= ?;
+        """, [self.STATUS_FAILED, "Interrupted while being sent", self.STATUS_SENDING, time.time()])
+
+    def _next_delay(self):
+        rows = self._select("""
+            SELECT MIN(CASE status WHEN ? THEN next_attempt_at ELSE lease_until END)
+            FROM outbox
+            WHERE status IN (?, ?);
+        """, [self.STATUS_PENDING, self.STATUS_PENDING, self.STATUS_SENDING])
+        if not rows or rows[0][0] is None:
+            return None
+        return max(0.0, rows[0][0] - time.time())
+
+    async def _send(self, key, endpoint, data, attempts):
+        logger = self.get_logger()
+        send_retries.set(attempts)
+        try:
+            response = await self.sender(endpoint, data)
+        except asyncio.CancelledError:
+            # Stopped while sending: the claim expires as failed, the request may have been received
+            raise
+        except Exception as e:
+            attempts += 1
+            if not self._is_unsent_error(e) or attempts >= self.max_attempts:
+                logger.error(f"Outbox: {endpoint} ({key}) failed after {attempts} attempt(s): {e}")
+                self._mark_failed(key, attempts, e)
+                self._notify(key, endpoint, None, e)
+            else:
+                delay = min(outbox_retry_max_delay, outbox_retry_base_delay * 2 ** (attempts - 1))
+                logger.warning(f"Outbox: {endpoint} ({key}) attempt {attempts} failed, retrying in {delay}s: {e}")
+                self._reschedule(key, attempts, delay, e)
+        else:
+            logger.debug(f"Outbox: {endpoint} ({key}) sent")
+            self._remove(key)
+            self._notify(key, endpoint, response, None)
+        finally:
+            self._in_flight.pop(key, None)
+            self._wake()
+
+    @staticmethod
+    def _is_unsent_error(error):
+        """Returns whether error means the request could not reach the API, so it is safe to send again."""
+        return isinstance(error, aiohttp.ClientConnectorError)
+
+    def _reschedule(self, key, attempts, delay, error):
+        self._update("""
+            UPDATE outbox
+            SET status = ?, owner = NULL, attempts = ?, next_attempt_at = ?, last_error = ?
+            WHERE key = ? AND owner = ?;
+        """, [self.STATUS_PENDING, attempts, time.time() + delay, str(error), key, self.owner])
+
+    def _mark_failed(self, key, attempts, error):
+        self._update("""
+            UPDATE outbox
+            SET status = ?, owner = NULL, attempts = ?, last_error = ?
+            WHERE key = ? AND owner = ?;
+        """, [self.STATUS_FAILED, attempts, str(error), key, self.owner])
+
+    def _remove(self, key):
+        self._update("DELETE FROM outbox WHERE key = ? AND owner = ?;", [key, self.owner])
+
+    def _notify(self, key, endpoint, response, error):
+        for listener in list(self._listeners):
+            try:
+                listener(key, endpoint, response, error)
+            except Exception as e:
+                self.get_logger().error(f"Outbox listener failed: {e}")
@@ -0,0 +1,203 @@
+# price_history.py
+import os
+import sqlite3
+import time
+from atexit import register
+
+from platformdirs import user_data_dir
+from global_variables import app_name, price_history_db_file, price_history_retention_days, cache_busy_timeout
+
+
+class PriceHistory:
+    """
+    An append-only history of the commodity prices fetched from the API.
+
+    Refreshing prices replaces them in the cache, the history keeps every
+    value they had: a sample is only appended when the (price_buy,
+    price_sell, scu_buy, scu_sell) tuple of a commodity at a terminal
+    changed since its last sample, so the file grows with the price churn
+    and not with the number of refreshes.
+
+    Samples are partitioned by day: the day (since epoch) leads the primary
+    key, and each sample only stores its timestamp as the seconds elapsed
+    since the start of its day, a small integer instead of a full epoch.
+    Range queries scan the days of the range in key order, by terminal or
+    through the (day, id_commodity) index, and whole days past the retention
+    period are dropped by clean_obsolete().
+
+    >>> history = PriceHistory(in_memory=True)
+    >>> history.record([{'id_terminal': 1, 'id_commodity': 2, 'game_version': '4.0', 'price_sell': 5}])
+    1
+    >>> history.get_history(id_commodity=2)
+    [{'id_terminal': 1, 'id_commodity': 2, 'game_version': '4.0', 'timestamp': ..., 'price_sell': 5, ...}]
+    """
+    endpoint = "/commodities_prices"
+    values = ["price_buy", "price_sell", "scu_buy", "scu_sell"]
+    day_seconds = 86400
+
+    def __init__(self, in_memory=False, retention_days=price_history_retention_days):
+        if in_memory is True:
+            self.db_path = ":memory:"
+        else:
+            db_dir = user_data_dir(app_name, ensure_exists=True)
+            self.db_path = os.path.join(db_dir, price_history_db_file)
+        self.retention_days = retention_days
+        # Used from the cache I/O thread only, but closed at exit from the main thread
+        self.con = sqlite3.connect(self.db_path, timeout=cache_busy_timeout, check_same_thread=False)
+        self.__create_tables()
+        register(self.con.close)
+        self._latest = self.__load_latest()
+
+    def __create_tables(self):
+        cur = self.con.cursor()
+        try:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS price_history (
+                    day INTEGER NOT NULL,
+                    id_terminal INTEGER NOT NULL,
+                    id_commodity INTEGER NOT NULL,
+                    game_version TEXT NOT NULL,
+                    seconds INTEGER NOT NULL,
+                    price_buy REAL,
+                    price_sell REAL,
+                    scu_buy INTEGER,
+                    scu_sell INTEGER,
+                    PRIMARY KEY (day, id_terminal, id_commodity, game_version, seconds)
+                ) WITHOUT ROWID
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS price_history_commodity ON price_history (day, id_commodity);")
+            # Last sample of each price, compared with the fetched prices without scanning the history
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS price_history_latest (
+                    id_terminal INTEGER NOT NULL,
+                    id_commodity INTEGER NOT NULL,
+                    game_version TEXT NOT NULL,
+                    price_buy REAL,
+                    price_sell REAL,
+                    scu_buy INTEGER,
+                    scu_sell INTEGER,
+                    day INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (id_terminal, id_commodity, game_version)
+                ) WITHOUT ROWID
+            """)
+            columns = [row[1] for row in cur.execute("PRAGMA table_info(price_history_latest);").fetchall()]
+            if "day" not in columns:
+                # Day of the last sample, unknown for older files: sampled again after the next clean
+                cur.execute("ALTER TABLE price_history_latest ADD COLUMN day INTEGER NOT NULL DEFAULT 0;")
+            self.con.commit()
+        except sqlite3.OperationalError:
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+
+    def __load_latest(self):
+        cur = self.con.cursor()
+        try:
+            rows = cur.execute(f"""
+                SELECT id_terminal, id_commodity, game_version, {", ".join(self.values)}
+                FROM price_history_latest;
+            """).fetchall()
+        except sqlite3.OperationalError:
+            return {}  # TODO - Log error instead
+        finally:
+            cur.close()
+        return {tuple(row[:3]): tuple(row[3:]) for row in rows}
+
+    @staticmethod
+    def _key(price):
+        return price.get("id_terminal"), price.get("id_commodity"), str(price.get("game_version") or "")
+
+    def _first_day(self):
+        """Returns the first day of the retention period."""
+        return int(time.time()) // self.day_seconds - self.retention_days
+
+    def record(self, prices):
+        """
+        Appends a sample for each price which changed since its last sample, and returns their number.
+        Prices last modified before the retention period are not sampled, clean_obsolete() would drop them.
+        """
+        now = int(time.time())
+        first_day = self._first_day()
+        samples = []
+        for price in prices:
+            key = self._key(price)
+            if key[0] is None or key[1] is None:
+                continue
+            values = tuple(price.get(value) for value in self.values)
+            if self._latest.get(key) == values:
+                continue
+            timestamp = int(price.get("date_modified") or price.get("date_added") or now)
+            day, seconds = divmod(timestamp, self.day_seconds)
+            if day < first_day:
+                continue
+            samples.append((key, day, seconds, values))
+        if not samples:
+            return 0
+        cur = self.con.cursor()
+        try:
+            cur.executemany("INSERT OR REPLACE INTO price_history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);",
+                            [(day, *key, seconds, *values) for key, day, seconds, values in samples])
+            cur.executemany("INSERT OR REPLACE INTO price_history_latest VALUES (?, ?, ?, ?, ?, ?, ?, ?);",
+                            [(*key, *values, day) for key, day, _, values in samples])
+            self.con.commit()
+        except sqlite3.OperationalError:
+            self.con.rollback()
+            return 0  # TODO - Log error instead
+        finally:
+            cur.close()
+        self._latest.update((key, values) for key, _, _, values in samples)
+        return len(samples)
+
+    def get_history(self, id_terminal=None, id_commodity=None, game_version=None, start=None, end=None):
+        """
+        Returns the samples recorded between start and end (epoch seconds, the last
+        retention days by default), oldest first, optionally of a terminal, a commodity
+        and a game version only.
+        """
+        end = time.time() if end is None else end
+        start = end - self.retention_days * self.day_seconds if start is None else start
+        conditions = {"id_terminal": id_terminal, "id_commodity": id_commodity,
+                      "game_version": None if game_version is None else str(game_version)}
+        conditions = {column: value for column, value in conditions.items() if value is not None}
+        where = "".join(f" AND {column} = ?" for column in conditions)
+        cur = self.con.cursor()
+        rows = cur.execute(f"""
+            SELECT id_terminal, id_commodity, game_version, day * {self.day_seconds} + seconds AS timestamp,
+                   {", ".join(self.values)}
+            FROM price_history
+            WHERE day BETWEEN ? AND ? AND timestamp BETWEEN ? AND ?{where}
+            ORDER BY timestamp, id_terminal, id_commodity;
+        """, [int(start) // self.day_seconds, int(end) // self.day_seconds, start, end,
+              *conditions.values()]).fetchall()
+        cur.close()
+        columns = ["id_terminal", "id_commodity", "game_version", "timestamp"] + self.values
+        return [dict(zip(columns, row)) for row in rows]
+
+    def clean_obsolete(self):
+        """
+        Drops the days past the retention period, with the last samples they hold: a price
+        which didn't change since then is not sampled again until it changes.
+        """
+        first_day = self._first_day()
+        cur = self.con.cursor()
+        try:
+            cur.execute("DELETE FROM price_history WHERE day < ?;", [first_day])
+            cur.execute("DELETE FROM price_history_latest WHERE day < ?;", [first_day])
+            self.con.commit()
+        except sqlite3.OperationalError:
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+        self._latest = self.__load_latest()
+
+    def clear(self):
+        cur = self.con.cursor()
+        try:
+            cur.execute("DELETE FROM price_history;")
+            cur.execute("DELETE FROM price_history_latest;")
+            self.con.commit()
+        except sqlite3.OperationalError:
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+        self._latest.clear()
@@ -0,0 +1,683 @@
+# row_store.py
+import json
+import os
+import sqlite3
+import time
+import uuid
+from atexit import register
+from collections import Counter
+
+from platformdirs import user_data_dir
+from global_variables import app_name, cache_db_file, cache_pragma_profile, cache_busy_timeout, cache_pin_ttl
+from global_variables import cache_compression_algorithm, cache_compression_threshold
+from cache_codecs import codec_id, compress, decompress
+from cache_maintenance import apply_pragma_profile, maintain_database
+
+
+class RowStore:
+    """
+    A normalized SQLite store for the rows returned by the main API endpoints.
+
+    Each row (price, terminal, planet, system, route...) is stored once in the
+    table of its endpoint, with the columns used for lookups indexed, instead
+    of being copied in one cache entry per grouping.
+
+    Rows are written by scope: the params of the request which returned them.
+    Storing a scope replaces the rows it covers and records the scope as
+    loaded until its TTL expires. get_rows() answers from the store only when
+    the requested params are covered by a loaded scope (the same params, one
+    of them, or the whole endpoint), so a partial load is never mistaken for
+    a complete one.
+
+    Rows of partitioned endpoints are stored in the partition of their
+    partition column (the game version of prices), part of their primary
+    key: a scope is loaded for every partition at once, and get_rows() only
+    reads the rows of the requested partition.
+
+    Every write creates a new generation: replaced rows and scopes are
+    retired at this generation instead of being deleted while a snapshot is
+    pinned. A reader which pinned a snapshot with pin_snapshot() keeps
+    reading the rows and scopes of its generation, whatever is written
+    alongside, until release_snapshot(). Retired rows are garbage collected
+    once no pinned snapshot can see them anymore.
+
+    The generation counter and the pinned snapshots are stored in cache.db
+    as well, so several processes sharing the file never write the same
+    generation nor delete rows a snapshot of another process still reads.
+
+    Rows count in the size budget of the cache: evict() retires the oldest
+    scopes with their rows, and rows larger than compression_threshold bytes
+    are compressed like the entries of SQLiteCacheBackend.
+    """
+    # endpoint -> table, primary key columns, indexed lookup columns, request params aliases, partition column
+    entities = {
+        "/commodities": {
+            "table": "commodities",
+            "primary_key": ["id"],
+            "indexes": [],
+            "aliases": {"id_commodity": "id"}
+        },
+        "/star_systems": {
+            "table": "star_systems",
+            "primary_key": ["id"],
+            "indexes": [],
+            "aliases": {"id_star_system": "id"}
+        },
+        "/planets": {
+            "table": "planets",
+            "primary_key": ["id"],
+            "indexes": [["id_star_system"]],
+            "aliases": {"id_planet": "id"}
+        },
+        "/terminals": {
+            "table": "terminals",
+            "primary_key": ["id"],
+            "indexes": [["id_star_system"], ["id_planet"]],
+            "aliases": {"id_terminal": "id"}
+        },
+        "/commodities_prices": {
+            "table": "commodities_prices",
+            "primary_key": ["id_commodity", "id_terminal"],
+            "indexes": [["id_terminal"]],
+            "aliases": {},
+            "partition": "game_version"
+        },
+        "/commodities_routes": {
+            "table": "commodities_routes",
+            "primary_key": ["id_commodity", "id_terminal_origin", "id_terminal_destination"],
+            "indexes": [["id_terminal_origin", "id_terminal_destination"]],
+            "aliases": {}
+        }
+    }
+
+    def __init__(self, in_memory=False, pragma_profile=cache_pragma_profile,
+                 compression=cache_compression_algorithm, compression_threshold=cache_compression_threshold):
+        if in_memory is True:
+            self.db_path = ":memory:"
+        else:
+            db_dir = user_data_dir(app_name, ensure_exists=True)
+            self.db_path = os.path.join(db_dir, cache_db_file)
+
+        self.compression_codec = codec_id(compression)
+        self.compression_threshold = compression_threshold
+        self.evictions = Counter()
+        # Used from the cache I/O thread only, but closed at exit from the main thread
+        self.con = sqlite3.connect(self.db_path, timeout=cache_busy_timeout, check_same_thread=False)
+        apply_pragma_profile(self.con, pragma_profile if in_memory is not True else "default")
+        self.__create_tables()
+        register(self.con.close)
+        self.generation = 0
+        self.current_generation()
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        self._pins = Counter()
+
+    def __create_tables(self):
+        cur = self.con.cursor()
+        try:
+            self.__drop_outdated_table(cur, "row_scopes", ["endpoint", "scope"])
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS row_scopes (
+                    endpoint TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    generation INTEGER NOT NULL,
+                    retired INTEGER,
+                    PRIMARY KEY (endpoint, scope, generation)
+                )
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS row_scopes_retired ON row_scopes (retired) WHERE retired IS NOT NULL;")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS row_pins (
+                    owner TEXT NOT NULL,
+                    generation INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (owner, generation)
+                )
+            """)
+            for endpoint, entity in self.entities.items():
+                table = entity["table"]
+                partition = [entity["partition"]] if "partition" in entity else []
+                if self.__drop_outdated_table(cur, table, self._columns(entity) + ["data", "codec"]):
+                    cur.execute("DELETE FROM row_scopes WHERE endpoint = ?;", [endpoint])
+                columns = ", ".join([f"{column} TEXT" for column in partition]
+                                    + [f"{column} INTEGER" for column in self._columns(entity)[len(partition):]])
+                primary_key = ", ".join(self._key_columns(entity))
+                cur.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        {columns},
+                        data TEXT NOT NULL,
+                        codec INTEGER NOT NULL DEFAULT 0,
+                        expires_at REAL NOT NULL,
+                        generation INTEGER NOT NULL,
+                        retired INTEGER,
+                        PRIMARY KEY ({primary_key}, generation)
+                    )
+                """)
+                for index in entity["indexes"]:
+                    cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_{'_'.join(index)} ON {table} ({', '.join(index)});")
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at);")
+                # Only the few retired rows are indexed, for collect_retired()
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_retired ON {table} (retired) WHERE retired IS NOT NULL;")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS row_generation (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    generation INTEGER NOT NULL
+                )
+            """)
+            if cur.execute("SELECT 1 FROM row_generation;").fetchone() is None:
+                cur.execute("INSERT INTO row_generation VALUES (0, ?);", [self.__load_generation(cur)])
+            self.con.commit()
+        except sqlite3.OperationalError:
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+
+    @staticmethod
+    def __drop_outdated_table(cur, table, columns):
+        """Drops table when it was created with other columns, and returns whether it was dropped."""
+        existing_columns = [row[1] for row in cur.execute(f"PRAGMA table_info({table});").fetchall()]
+        if existing_columns and existing_columns != columns + ["expires_at", "generation", "retired"]:
+            cur.execute(f"DROP TABLE {table};")
+            return True
+        return False
+
+    def __load_generation(self, cur):
+        # Files created before the generation counter was stored
+        generations = [cur.execute(f"SELECT MAX(generation) FROM {table};").fetchone()[0]
+                       for table in ["row_scopes"] + [entity["table"] for entity in self.entities.values()]]
+        return max((generation for generation in generations if generation is not None), default=0)
+
+    @staticmethod
+    def _key_columns(entity):
+        # The partition follows the primary key, so scopes of every partition use the key and indexes as well
+        return entity["primary_key"] + ([entity["partition"]] if "partition" in entity else [])
+
+    @staticmethod
+    def _visible(snapshot):
+        """Returns the condition (and its params) selecting the rows visible in snapshot, or the current ones."""
+        if snapshot is None:
+            return "retired IS NULL", []
+        return "generation <= ? AND (retired IS NULL OR retired > ?)", [snapshot, snapshot]
+
+    def current_generation(self):
+        """Returns the last generation written by any process sharing the store."""
+        cur = self.con.cursor()
+        try:
+            res = cur.execute("SELECT generation FROM row_generation;").fetchone()
+        except sqlite3.OperationalError:
+            return self.generation  # TODO - Log error instead
+        finally:
+            cur.close()
+        self.generation = res[0] if res else 0
+        return self.generation
+
+    def _next_generation(self, cur):
+        """Takes the next generation, and the write lock of the store until the transaction ends."""
+        return cur.execute("UPDATE row_generation SET generation = generation + 1 RETURNING generation;").fetchone()[0]
+
+    def pin_snapshot(self):
+        """Pins the current generation, readable with get_rows() until it is released."""
+        generation = self.current_generation()
+        self._pins[generation] += 1
+        if self._pins[generation] == 1:
+            self.__share_pin("INSERT OR REPLACE INTO row_pins VALUES (?, ?, ?);",
+                             [self.owner, generation, time.time() + cache_pin_ttl])
+        return generation
+
+    def release_snapshot(self, snapshot):
+        self._pins[snapshot] -= 1
+        if self._pins[snapshot] <= 0:
+            del self._pins[snapshot]
+            self.__share_pin("DELETE FROM row_pins WHERE owner = ? AND generation = ?;", [self.owner, snapshot])
+            self.collect_retired()
+
+    def __share_pin(self, query, params):
+        cur = self.con.cursor()
+        try:
+            cur.execute(query, params)
+            self.con.commit()
+        except sqlite3.OperationalError:
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+
+    def _pinned(self, cur):
+        """Returns the oldest snapshot pinned by any process sharing the store, or None."""
+        return cur.execute("SELECT MIN(generation) FROM row_pins WHERE expires_at > ?;", [time.time()]).fetchone()[0]
+
+    def collect_retired(self):
+        """Deletes the retired rows and scopes no pinned snapshot can see anymore."""
+        cur = self.con.cursor()
+        try:
+            oldest_snapshot = self._pinned(cur)
+            if oldest_snapshot is None:
+                oldest_snapshot = self.current_generation()
+            cur.execute("DELETE FROM row_pins WHERE expires_at <= ?;", [time.time()])
+            for table in ["row_scopes"] + [entity["table"] for entity in self.entities.values()]:
+                cur.execute(f"DELETE FROM {table} WHERE retired <= ?;", [oldest_snapshot])
+            self.con.commit()
+        except sqlite3.OperationalError:
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+
+    def _retire(self, cur, table, where, params, generation):
+        """Retires the current rows of table matching where, deleted right away when no snapshot is pinned."""
+        if self._pins or self._pinned(cur) is not None:
+            cur.executemany(f"UPDATE {table} SET retired = ? WHERE retired IS NULL AND {where};",
+                            [[generation, *row_params] for row_params in params])
+        else:
+            cur.executemany(f"DELETE FROM {table} WHERE retired IS NULL AND {where};", params)
+
+    def _write(self, cur, endpoint, conditions, rows, scopes):
+        """
+        Writes rows and [[scope, expires_at], ...] as a new generation, retiring the rows covered
+        by conditions (if any), the current rows of the same keys and the current same scopes.
+        Returns the new generation and the stored size of rows.
+        """
+        entity = self.entities[endpoint]
+        table = entity["table"]
+        columns = self._columns(entity)
+        key_columns = self._key_columns(entity)
+        generation = self._next_generation(cur)
+        expires_at = max(scope_expires_at for _, scope_expires_at in scopes)
+        if conditions is not None:
+            # Rows which are no longer returned for this scope are retired with the previous ones
+            self._retire(cur, table, " AND ".join(f"{column} = ?" for column in conditions) or "1",
+                         [list(conditions.values())], generation)
+        self._retire(cur, table, " AND ".join(f"{column} = ?" for column in key_columns),
+                     [[row.get(column) for column in key_columns] for row in rows], generation)
+        stored_rows = [[row.get(column) for column in columns] + [*self._encode(row), expires_at, generation]
+                       for row in rows]
+        cur.executemany(f"""
+            INSERT OR REPLACE INTO {table} ({", ".join(columns)}, data, codec, expires_at, generation)
+            VALUES ({", ".join("?" for _ in columns)}, ?, ?, ?, ?);
+        """, stored_rows)
+        self._retire(cur, "row_scopes", "endpoint = ? AND scope = ?", [[endpoint, scope] for scope, _ in scopes],
+                     generation)
+        cur.executemany("INSERT OR REPLACE INTO row_scopes VALUES (?, ?, ?, ?, NULL);",
+                        [[endpoint, scope, scope_expires_at, generation] for scope, scope_expires_at in scopes])
+        return generation, sum(len(stored_row[len(columns)]) for stored_row in stored_rows)
+
+    def _encode(self, row):
+        """Returns (stored data, codec) of a row."""
+        encoded_row = json.dumps(row)
+        if len(encoded_row) < self.compression_threshold:
+            return encoded_row, 0
+        compressed_row, codec = compress(encoded_row.encode('utf-8'), self.compression_codec,
+                                         self.compression_threshold)
+        return (compressed_row, codec) if codec else (encoded_row, 0)
+
+    @staticmethod
+    def _decode(stored_row, codec):
+        return json.loads(decompress(stored_row, codec))
+
+    @staticmethod
+    def _columns(entity):
+        columns = [entity["partition"]] if "partition" in entity else []
+        columns.extend(entity["primary_key"])
+        for index in entity["indexes"]:
+            columns.extend(column for column in index if column not in columns)
+        return columns
+
+    def _resolve(self, endpoint, params):
+        """Returns the {column: value} conditions of params, or None if the store can't answer them."""
+        entity = self.entities.get(endpoint)
+        if entity is None or (params and not isinstance(params, dict)):
+            return None
+        # The partition is not a request param, every partition is fetched at once
+        columns = [column for column in self._columns(entity) if column != entity.get("partition")]
+        conditions = {}
+        for param, value in (params or {}).items():
+            column = entity["aliases"].get(param, param)
+            if column not in columns:
+                return None
+            conditions[column] = value
+        return conditions
+
+    @staticmethod
+    def _scope(conditions):
+        return "&".join(f"{column}={conditions[column]}" for column in sorted(conditions))
+
+    def supports(self, endpoint, params):
+        return self._resolve(endpoint, params) is not None
+
+    def filter_partition(self, endpoint, rows, partition):
+        """Returns the rows of partition, for rows fetched with every partition."""
+        entity = self.entities.get(endpoint)
+        if entity is None or "partition" not in entity:
+            return rows
+        return [row for row in rows if row.get(entity["partition"]) == partition]
+
+    def _loaded_until(self, endpoint, conditions, snapshot=None):
+        """Returns when the last scope covering conditions expires, or None when they are not loaded."""
+        scopes = {"", self._scope(conditions)}
+        scopes.update(self._scope({column: value}) for column, value in conditions.items())
+        visible, visible_params = self._visible(snapshot)
+        cur = self.con.cursor()
+        res = cur.execute(f"""
+            SELECT MAX(expires_at)
+            FROM row_scopes
+            WHERE endpoint = ? AND scope IN ({", ".join("?" for _ in scopes)}) AND expires_at > ? AND {visible};
+        """, [endpoint, *scopes, time.time(), *visible_params]).fetchone()
+        cur.close()
+        return res[0] if res else None
+
+    def get_rows(self, endpoint, params, partition=None, snapshot=None):
+        """
+        Returns the rows matching params (in partition for partitioned endpoints), or None when they were not loaded.
+        Rows are read from the pinned snapshot when one is given, or else from the current generation.
+        """
+        entry = self.get_rows_entry(endpoint, params, partition, snapshot)
+        return entry[0] if entry is not None else None
+
+    def get_rows_entry(self, endpoint, params, partition=None, snapshot=None):
+        """
+        Returns (rows, expires_at, size) like get_rows(), with the time at which the answer expires
+        (the first of its rows or its scope) and the encoded size of the rows, or None.
+        """
+        conditions = self._resolve(endpoint, params)
+        if conditions is None:
+            return None
+        expires_at = self._loaded_until(endpoint, conditions, snapshot)
+        if expires_at is None:
+            return None
+        entity = self.entities[endpoint]
+        if "partition" in entity:
+            conditions = {entity["partition"]: partition, **conditions}
+        where = "".join(f" AND {column} = ?" for column in conditions)
+        visible, visible_params = self._visible(snapshot)
+        cur = self.con.cursor()
+        rows = cur.execute(f"""
+            SELECT data, codec, expires_at
+            FROM {entity["table"]}
+            WHERE expires_at > ? AND {visible}{where}
+            ORDER BY {", ".join(entity["primary_key"])};
+        """, [time.time(), *visible_params, *conditions.values()]).fetchall()
+        cur.close()
+        expires_at = min([expires_at] + [row_expires_at for _, _, row_expires_at in rows])
+        return [self._decode(data, codec) for data, codec, _ in rows], expires_at, sum(len(row[0]) for row in rows)
+
+    def set_rows(self, endpoint, params, rows, ttl):
+        """Replaces the rows covered by params with rows, records params as loaded, and returns the stored size."""
+        conditions = self._resolve(endpoint, params)
+        if conditions is None:
+            return 0
+        cur = self.con.cursor()
+        try:
+            generation, size = self._write(cur, endpoint, conditions, rows,
+                                           [[self._scope(conditions), time.time() + ttl]])
+            self.con.commit()
+            self.generation = generation
+        except sqlite3.OperationalError:
+            self.con.rollback()
+            return 0  # TODO - Log error instead
+        finally:
+            cur.close()
+        return size
+
+    def mark_loaded(self, endpoint, params, ttl):
+        """Records params as loaded, when its rows were stored through narrower scopes."""
+        conditions = self._resolve(endpoint, params)
+        if conditions is None:
+            return
+        self._mark_scope(endpoint, self._scope(conditions), time.time() + ttl)
+
+    def is_loaded(self, endpoint, params):
+        conditions = self._resolve(endpoint, params)
+        return conditions is not None and self._loaded_until(endpoint, conditions) is not None
+
+    def loaded_checkpoints(self, endpoint, param, values):
+        """Returns {value: expires_at} of the values of param whose own scope (param = value) is loaded."""
+        scopes = {}
+        for value in values:
+            conditions = self._resolve(endpoint, {param: value})
+            if conditions is not None:
+                scopes[self._scope(conditions)] = value
+        cur = self.con.cursor()
+        rows = cur.execute(f"""
+            SELECT scope, expires_at
+            FROM row_scopes
+            WHERE endpoint = ? AND scope IN ({", ".join("?" for _ in scopes)}) AND expires_at > ? AND retired IS NULL;
+        """, [endpoint, *scopes, time.time()]).fetchall()
+        cur.close()
+        return {scopes[scope]: expires_at for scope, expires_at in rows}
+
+    def complete(self, endpoint, param, values):
+        """
+        Records the whole endpoint as loaded (its completion marker) once the scope of every value of
+        param is loaded, until the first of them expires, and returns whether the endpoint is complete.
+        """
+        values = set(values)
+        checkpoints = self.loaded_checkpoints(endpoint, param, values)
+        if not values or len(checkpoints) < len(values):
+            return False
+        self._mark_scope(endpoint, self._scope({}), min(checkpoints.values()))
+        return True
+
+    def _mark_scope(self, endpoint, scope, expires_at):
+        cur = self.con.cursor()
+        try:
+            generation, _ = self._write(cur, endpoint, None, [], [[scope, expires_at]])
+            self.con.commit()
+            self.generation = generation
+        except sqlite3.OperationalError:
+            self.con.rollback()
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+
+    def invalidate(self, endpoint, params):
+        conditions = self._resolve(endpoint, params)
+        if conditions is None:
+            return
+        cur = self.con.cursor()
+        try:
+            generation = self._next_generation(cur)
+            self._retire(cur, "row_scopes", "endpoint = ? AND scope IN ('', ?)",
+                         [[endpoint, self._scope(conditions)]], generation)
+            self.con.commit()
+            self.generation = generation
+        except sqlite3.OperationalError:
+            self.con.rollback()
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+
+    def export_rows(self, endpoint):
+        """Returns the valid [[scope, expires_at], ...] and rows of endpoint."""
+        now = time.time()
+        cur = self.con.cursor()
+        scopes = cur.execute("""
+            SELECT scope, expires_at
+            FROM row_scopes
+            WHERE endpoint = ? AND expires_at > ? AND retired IS NULL;
+        """, [endpoint, now]).fetchall()
+        rows = cur.execute(f"""
+            SELECT data, codec
+            FROM {self.entities[endpoint]["table"]}
+            WHERE expires_at > ? AND retired IS NULL;
+        """, [now]).fetchall()
+        cur.close()
+        return [list(scope) for scope in scopes], [self._decode(*row) for row in rows]
+
+    def import_rows(self, endpoint, scopes, rows):
+        """Adds rows and their loaded [[scope, expires_at], ...] to the store, rows expire with the last scope."""
+        cur = self.con.cursor()
+        try:
+            generation, _ = self._write(cur, endpoint, None, rows, scopes)
+            self.con.commit()
+            self.generation = generation
+        except sqlite3.OperationalError:
+            self.con.rollback()
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+
+    def delete_endpoint(self, endpoint):
+        """Retires every row and scope of endpoint, still readable by the pinned snapshots."""
+        entity = self.entities.get(endpoint)
+        if entity is None:
+            return
+        cur = self.con.cursor()
+        try:
+            generation = self._next_generation(cur)
+            self._retire(cur, "row_scopes", "endpoint = ?", [[endpoint]], generation)
+            self._retire(cur, entity["table"], "1", [[]], generation)
+            self.con.commit()
+            self.generation = generation
+        except sqlite3.OperationalError:
+            self.con.rollback()
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+
+    def endpoint_stats(self):
+        """Returns {endpoint: {entries, bytes, first_expiry, last_expiry}} of the valid rows."""
+        now = time.time()
+        stats = {}
+        cur = self.con.cursor()
+        for endpoint, entity in self.entities.items():
+            entries, size, first_expiry, last_expiry = cur.execute(f"""
+                SELECT COUNT(1), SUM(LENGTH(data)), MIN(expires_at), MAX(expires_at)
+                FROM {entity["table"]}
+                WHERE expires_at > ? AND retired IS NULL;
+            """, [now]).fetchone()
+            if entries:
+                stats[endpoint] = {'entries': entries, 'bytes': size,
+                                   'first_expiry': first_expiry, 'last_expiry': last_expiry}
+        cur.close()
+        return stats
+
+    def contains_endpoint(self, endpoint):
+        cur = self.con.cursor()
+        res = cur.execute("""
+            SELECT 1
+            FROM row_scopes
+            WHERE endpoint = ? AND expires_at > ? AND retired IS NULL
+            LIMIT 1;
+        """, [endpoint, time.time()]).fetchone()
+        cur.close()
+        return res is not None
+
+    def total_size(self):
+        """Returns the stored size of the current rows."""
+        cur = self.con.cursor()
+        size = sum(cur.execute(f"SELECT COALESCE(SUM(LENGTH(data)), 0) FROM {entity['table']} WHERE retired IS NULL;")
+                   .fetchone()[0] for entity in self.entities.values())
+        cur.close()
+        return size
+
+    @staticmethod
+    def _conditions(scope):
+        """Returns the {column: value} conditions of a scope, values as strings."""
+        return dict(condition.split("=", 1) for condition in scope.split("&")) if scope else {}
+
+    def _overlapping(self, scope, scopes):
+        """Returns the scopes of scopes which may share rows with scope: none sets another value for one of its columns."""
+        conditions = self._conditions(scope)
+        return [other_scope for other_scope in scopes
+                if all(conditions.get(column, value) == value for column, value in self._conditions(other_scope).items())]
+
+    def _retire_uncovered(self, cur, endpoint, scopes, generation):
+        """Retires the current rows of endpoint which none of scopes covers."""
+        if "" in scopes:
+            return
+        values_by_columns = {}
+        for scope in scopes:
+            conditions = self._conditions(scope)
+            values_by_columns.setdefault(tuple(conditions), []).append(list(conditions.values()))
+        covered = []
+        params = []
+        for columns, values in values_by_columns.items():
+            row = f"({', '.join('?' for _ in columns)})"
+            covered.append(f"({', '.join(columns)}) IN (VALUES {', '.join(row for _ in values)})")
+            params.extend(value for row_values in values for value in row_values)
+        self._retire(cur, self.entities[endpoint]["table"], f"NOT ({' OR '.join(covered) or '0'})", [params],
+                     generation)
+
+    def evict(self, to_free):
+        """
+        Retires the oldest loaded scopes and their rows until to_free bytes of rows are freed,
+        and returns the number of retired scopes.
+
+        Expired rows go first. The scopes sharing rows with a retired scope are retired as well,
+        so no scope stays loaded while some of its rows are gone, and the rows no scope covers
+        anymore are retired with them.
+        """
+        self.clean_obsolete()
+        cur = self.con.cursor()
+        try:
+            generation = self._next_generation(cur)
+            oldest_scopes = cur.execute("""
+                SELECT endpoint, scope
+                FROM row_scopes
+                WHERE retired IS NULL
+                ORDER BY generation;
+            """).fetchall()
+            loaded_scopes = {}
+            for endpoint, scope in oldest_scopes:
+                loaded_scopes.setdefault(endpoint, []).append(scope)
+            evicted = []
+            for endpoint, scope in oldest_scopes:
+                if to_free <= 0:
+                    break
+                if endpoint not in self.entities or scope not in loaded_scopes[endpoint]:
+                    continue  # Unknown endpoint, or retired with an overlapping scope
+                table = self.entities[endpoint]["table"]
+                conditions = self._conditions(scope)
+                where = " AND ".join(f"{column} = ?" for column in conditions) or "1"
+                to_free -= cur.execute(f"""
+                    SELECT COALESCE(SUM(LENGTH(data)), 0)
+                    FROM {table}
+                    WHERE retired IS NULL AND {where};
+                """, list(conditions.values())).fetchone()[0]
+                self._retire(cur, table, where, [list(conditions.values())], generation)
+                for retired_scope in self._overlapping(scope, loaded_scopes[endpoint]):
+                    self._retire(cur, "row_scopes", "endpoint = ? AND scope = ?", [[endpoint, retired_scope]],
+                                 generation)
+                    loaded_scopes[endpoint].remove(retired_scope)
+                    evicted.append(endpoint)
+            for endpoint in set(evicted):
+                self._retire_uncovered(cur, endpoint, loaded_scopes[endpoint], generation)
+            self.con.commit()
+            self.generation = generation
+        except sqlite3.OperationalError:
+            self.con.rollback()
+            return 0  # TODO - Log error instead
+        finally:
+            cur.close()
+        self.evictions.update(evicted)
+        return len(evicted)
+
+    def maintain(self):
+        """Compacts the database file, and returns the duration of the run."""
+        return maintain_database(self.con)
+
+    def clean_obsolete(self):
+        now = time.time()
+        cur = self.con.cursor()
+        try:
+            cur.execute("DELETE FROM row_scopes WHERE expires_at <= ?;", [now])
+            for entity in self.entities.values():
+                cur.execute(f"DELETE FROM {entity['table']} WHERE expires_at <= ?;", [now])
+            self.con.commit()
+        except sqlite3.OperationalError:
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
+
+    def clear(self):
+        """Retires every row and scope, still readable by the pinned snapshots."""
+        cur = self.con.cursor()
+        try:
+            generation = self._next_generation(cur)
+            for table in ["row_scopes"] + [entity["table"] for entity in self.entities.values()]:
+                self._retire(cur, table, "1", [[]], generation)
+            self.con.commit()
+            self.generation = generation
+        except sqlite3.OperationalError:
+            self.con.rollback()
+            return  # TODO - Log error instead
+        finally:
+            cur.close()
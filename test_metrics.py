@@ -0,0 +1,206 @@
+import asyncio
+import os
+import pytest
+import threading
+from metrics import Metrics
+
+
+def delete_samples(metrics, module_name):
+    metrics.conn.execute("DELETE FROM fnc_exec WHERE module_name = ?", (module_name,))
+    metrics.conn.execute("DELETE FROM fnc_exec_histogram WHERE module_name = ?", (module_name,))
+    metrics.conn.execute("DELETE FROM fnc_exec_rollup WHERE module_name = ?", (module_name,))
+
+
+# Unitary tests
+def test_unitary_buffered_samples():
+    metrics = Metrics()
+    module_name = f"test_metrics_{threading.get_ident()}"
+    for _ in range(3):
+        metrics.record_fnc_exec(module_name, "foo", 0.5)
+    # Buffered, nothing is written by the measured calls
+    assert metrics.conn.execute("SELECT COUNT(1) FROM fnc_exec WHERE module_name = ?",
+                                (module_name,)).fetchone()[0] == 0
+    metrics.flush()
+    rows = metrics.conn.execute("SELECT function_name, execution_time, timestamp FROM fnc_exec WHERE module_name = ?",
+                                (module_name,)).fetchall()
+    assert len(rows) == 3 and rows[0][:2] == ("foo", 0.5) and rows[0][2] is not None
+    assert not metrics._fnc_samples
+    delete_samples(metrics, module_name)
+
+
+def test_unitary_fetch_flushes_samples():
+    metrics = Metrics()
+    module_name = f"test_metrics_fetch_{threading.get_ident()}"
+    metrics.record_fnc_exec(module_name, "bar", 0.25)
+    assert [row[:3] for row in metrics.fetch_fnc_exec() if row[0] == module_name] == [(module_name, "bar", 1)]
+    delete_samples(metrics, module_name)
+
+
+def test_unitary_full_buffer():
+    metrics = Metrics()
+    samples = metrics._fnc_samples
+    dropped_samples = metrics.dropped_samples
+    metrics.flush()
+    for i in range(samples.maxlen + 2):
+        metrics.record_fnc_exec("test_metrics_full", "baz", i)
+    # The oldest samples are dropped
+    assert metrics.dropped_samples == dropped_samples + 2
+    assert samples[0][2] == 2
+    samples.clear()
+
+
+def test_unitary_disabled_decorators(monkeypatch):
+    import metrics as metrics_module
+
+    def foo():
+        return 1
+
+    async def bar():
+        return 2
+
+    monkeypatch.setattr(metrics_module, "metrics_collect_activated", False)
+    # Not wrapped at all: no overhead when metrics are not collected
+    assert Metrics.track_sync_fnc_exec(foo) is foo
+    assert Metrics.track_async_fnc_exec(bar) is bar
+    monkeypatch.setattr(metrics_module, "metrics_collect_activated", True)
+    tracked_foo = Metrics.track_sync_fnc_exec(foo)
+    assert tracked_foo is not foo and tracked_foo() == 1
+    metrics = Metrics()
+    module_name, function_name, execution_time, _ = metrics._fnc_samples.pop()
+    assert (module_name, function_name) == (__name__, "foo") and 0 <= execution_time < 1
+
+
+def test_unitary_latency_histograms():
+    from metrics import latency_bucket, bucket_latency, histogram_percentiles
+    for seconds in (0.000002, 0.0137, 1.5, 42):
+        # Bucket upper bounds are within 19% of the recorded duration
+        assert seconds <= bucket_latency(latency_bucket(seconds)) < seconds * 1.19
+    buckets = sorted((latency_bucket(i / 1000), 1) for i in range(1, 1001))
+    p50, p90, p99, p999 = histogram_percentiles(buckets, Metrics.percentiles)
+    assert 0.5 <= p50 < 0.5 * 1.19 and 0.9 <= p90 < 0.9 * 1.19 and 0.99 <= p99 < 0.99 * 1.19 and 1 <= p999 < 1.19
+
+
+def test_unitary_compacted_histograms():
+    metrics = Metrics()
+    module_name = f"test_metrics_histogram_{threading.get_ident()}"
+    for i in range(1, 101):
+        metrics.record_fnc_exec(module_name, "foo", i / 1000)
+    metrics.flush()
+    rows = metrics.conn.execute("SELECT SUM(count), COUNT(1) FROM fnc_exec_histogram WHERE module_name = ?",
+                                (module_name,)).fetchone()
+    assert rows[0] == 100 and rows[1] < 30  # Compacted in a few buckets
+    p50, p90, p99, p999 = metrics.fetch_fnc_percentiles()[(module_name, "foo")]
+    assert 0.05 <= p50 < 0.06 and 0.09 <= p90 < 0.11 and p99 == p999
+    delete_samples(metrics, module_name)
+
+
+def test_unitary_rollups():
+    import time
+    metrics = Metrics()
+    module_name = f"test_metrics_rollup_{threading.get_ident()}"
+    now = time.time()
+    old = now - 30 * 86400
+    for execution_time, timestamp in ((0.1, old), (0.3, old), (0.2, now)):
+        metrics._fnc_samples.append((module_name, "foo", execution_time, timestamp))
+    metrics.flush()
+    rows = metrics.conn.execute("""SELECT resolution, COUNT(1), SUM(count) FROM fnc_exec_rollup
+                                   WHERE module_name = ? GROUP BY resolution""", (module_name,)).fetchall()
+    assert rows == [(60, 2, 3), (3600, 2, 3), (86400, 2, 3)]
+    row = [row for row in metrics.fetch_fnc_exec() if row[0] == module_name][0]
+    assert row[2] == 3 and row[3] == pytest.approx(0.2) and row[4:7] == (0.3, 0.1, pytest.approx(0.6))
+    metrics.prune_obsolete()
+    # The old samples are removed, but still counted in the rollups kept
+    assert metrics.conn.execute("SELECT COUNT(1) FROM fnc_exec WHERE module_name = ?", (module_name,)).fetchone()[0] == 1
+    rows = metrics.conn.execute("""SELECT resolution, SUM(count) FROM fnc_exec_rollup
+                                   WHERE module_name = ? GROUP BY resolution""", (module_name,)).fetchall()
+    assert rows == [(60, 1), (3600, 3), (86400, 3)]
+    assert [row[2] for row in metrics.fetch_fnc_exec() if row[0] == module_name] == [3]
+    delete_samples(metrics, module_name)
+
+
+@pytest.mark.asyncio
+async def test_unitary_trace_spans(monkeypatch, tmp_path):
+    import json
+    import metrics as metrics_module
+    monkeypatch.setattr(metrics_module, "metrics_tracing_activated", True)
+
+    @Metrics.track_sync_fnc_exec
+    def compute():
+        return sum(range(100000))
+
+    @Metrics.track_async_fnc_exec
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return compute()
+
+    @Metrics.record_trace
+    async def search():
+        return await asyncio.gather(fetch(), fetch())
+
+    await search()
+    await fetch()  # Not in a trace
+    trace = Metrics().traces[-1]
+    spans = {span.id: span for span in trace.spans}
+    names = sorted(span.name.rsplit(".", 1)[-1] for span in spans.values())
+    assert names == ["compute", "compute", "fetch", "fetch", "search"]
+    for span in spans.values():
+        if span.name.endswith("compute"):
+            assert spans[span.parent.id].name.endswith("fetch")
+            assert spans[span.parent.id].parent.name.endswith("search")
+        if span.name.endswith("fetch"):
+            # Waiting on the network (here a sleep) doesn't count as CPU time
+            assert span.wall >= 50_000_000 and span.cpu < span.wall / 2
+    path = tmp_path / "trace.json"
+    assert Metrics().export_trace(path)
+    events = json.loads(path.read_text())["traceEvents"]
+    assert len(events) == 5 and all(event["ph"] == "X" for event in events)
+    assert len({event["tid"] for event in events}) == 3  # The search task and the two gathered tasks
+
+
+@pytest.mark.asyncio
+async def test_unitary_profile_capture(monkeypatch, tmp_path):
+    import metrics as metrics_module
+    monkeypatch.setattr(metrics_module, "metrics_profiling_activated", True)
+    monkeypatch.setattr(metrics_module, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+
+    def hot_spot():
+        return sum(i * i for i in range(100000))
+
+    @Metrics.capture_profile
+    async def search():
+        await asyncio.sleep(0)
+        return hot_spot()
+
+    metrics = Metrics()
+    monkeypatch.setattr(metrics, "last_profile", None)
+    await search()
+    assert metrics.last_profile is None  # Not requested
+    metrics.request_profile()
+    await search()
+    await search()
+    profile = metrics.last_profile
+    assert not metrics.profile_requested and profile.name.endswith("search")
+    assert profile.stats_path.startswith(str(tmp_path)) and os.path.getsize(profile.stats_path) > 0
+    with open(profile.summary_path, encoding="utf-8") as summary_file:
+        assert "hot_spot" in summary_file.read()
+    assert len(os.listdir(os.path.dirname(profile.stats_path))) == 2  # Only the requested call
+
+
+def test_unitary_api_requests(monkeypatch):
+    import time
+    import metrics as metrics_module
+    monkeypatch.setattr(metrics_module, "metrics_collect_activated", True)
+    metrics = Metrics()
+    endpoint = f"/test_metrics_requests_{threading.get_ident()}"
+    now = time.time()
+    metrics.track_api_request("GET", endpoint, now, 0.4, 0.1, 2048, 200)
+    metrics.track_api_request("GET", endpoint, now, 0.2, 0.1, 0, 500)
+    metrics.track_api_request("GET", endpoint, now, 5.0, None, 0, None)  # Network error
+    metrics.track_api_request("POST", endpoint, now, 0.1, 0.05, 10, 200, retries=2)
+    rows = {row[0]: row[2:] for row in metrics.fetch_api_requests() if row[1] == endpoint}
+    assert rows["GET"][:4] == (3, 2, 0, 2048) and rows["GET"][4] == pytest.approx(5.6 / 3)
+    assert rows["GET"][5] == pytest.approx(0.1)  # Without the request which got no response
+    assert rows["POST"][:4] == (1, 0, 2, 10)
+    assert metrics.conn.execute("SELECT COUNT(1) FROM api_requests WHERE endpoint = ?", (endpoint,)).fetchone()[0] == 4
+    metrics.conn.execute("DELETE FROM api_requests WHERE endpoint = ?", (endpoint,))
+    metrics.conn.execute("DELETE FROM api_requests_rollup WHERE endpoint = ?", (endpoint,))
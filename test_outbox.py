@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+import aiohttp
+from types import SimpleNamespace
+from yarl import URL
+import outbox as outbox_module
+from outbox import Outbox
+
+
+class FakeSender:
+    def __init__(self, failures=0, error=None):
+        self.failures = failures
+        # Connection refused: the request never reached the API
+        self.error = error or aiohttp.ClientConnectorError(SimpleNamespace(host="api.uexcorp.space", port=443, ssl=True),
+                                                           OSError(111, "Connection refused"))
+        self.calls = []
+
+    async def __call__(self, endpoint, data):
+        self.calls.append((endpoint, data))
+        if len(self.calls) <= self.failures:
+            raise self.error
+        return {"status": "ok", "data": {"id_user_trade": len(self.calls)}}
+
+
+# Unitary tests
+@pytest.mark.asyncio
+async def test_unitary_enqueue_and_flush():
+    sender = FakeSender()
+    outbox = Outbox(sender, in_memory=True)
+    results = []
+    outbox.add_listener(lambda key, endpoint, response, error: results.append((key, response, error)))
+    key = outbox.enqueue("/user_trades_add/", {"id_terminal": 1})
+    assert outbox.pending_count() == 1
+    await outbox.flush()
+    assert outbox.pending_count() == 0
+    assert sender.calls == [("/user_trades_add/", {"id_terminal": 1})]
+    assert results[0][0] == key
+    assert results[0][2] is None
+
+
+@pytest.mark.asyncio
+async def test_unitary_retry_unsent_request():
+    sender = FakeSender(failures=1)
+    outbox = Outbox(sender, in_memory=True)
+    outbox.enqueue("/user_trades_add/", {"scu": 1})
+    await outbox.flush()
+    assert outbox.pending_count() == 1  # Rescheduled with a backoff
+    outbox.con.execute("UPDATE outbox SET next_attempt_at = 0")
+    await outbox.flush()
+    assert outbox.pending_count() == 0
+    assert [call[1] for call in sender.calls] == [{"scu": 1}, {"scu": 1}]
+
+
+@pytest.mark.asyncio
+async def test_unitary_timeout_is_not_retried():
+    # The API may have recorded the request before the response was lost
+    sender = FakeSender(failures=1, error=asyncio.TimeoutError())
+    outbox = Outbox(sender, in_memory=True)
+    outbox.enqueue("/user_trades_add/", {})
+    await outbox.flush()
+    assert outbox.pending_count() == 0
+    assert len(outbox.failed_entries()) == 1
+    assert len(sender.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_unitary_shared_outbox_claims(monkeypatch, tmp_path):
+    monkeypatch.setattr(outbox_module, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+    first_sender, second_sender = FakeSender(), FakeSender()
+    first, second = Outbox(first_sender), Outbox(second_sender)
+    key = second.enqueue("/user_trades_add/", {})
+    assert first._claim(key)
+    await second.flush()  # Claimed by the first instance, not sent twice
+    assert second_sender.calls == []
+    assert second.pending_count() == 1
+    # An expired claim may have reached the API: it is left to the user
+    first.con.execute("UPDATE outbox SET lease_until = 0")
+    first.con.commit()
+    await second.flush()
+    assert [entry["key"] for entry in second.failed_entries()] == [key]
+    assert first_sender.calls == second_sender.calls == []
+
+
+@pytest.mark.asyncio
+async def test_unitary_client_error_is_permanent():
+    request_info = aiohttp.RequestInfo(URL("https://api.uexcorp.space/2.0/data_submit/"), "POST", {})
+    error = aiohttp.ClientResponseError(request_info, (), status=403, message="Forbidden")
+    sender = FakeSender(failures=1, error=error)
+    outbox = Outbox(sender, in_memory=True)
+    outbox.enqueue("/data_submit/", {})
+    await outbox.flush()
+    assert outbox.pending_count() == 0
+    assert len(outbox.failed_entries()) == 1
+    outbox.retry_failed()
+    await outbox.flush()
+    assert outbox.failed_entries() == []
+
+
+@pytest.mark.asyncio
+async def test_unitary_retry_and_discard_failed_by_key():
+    request_info = aiohttp.RequestInfo(URL("https://api.uexcorp.space/2.0/user_trades_add/"), "POST", {})
+    error = aiohttp.ClientResponseError(request_info, (), status=400, message="Bad Request")
+    sender = FakeSender(failures=2, error=error)
+    outbox = Outbox(sender, in_memory=True)
+    first = outbox.enqueue("/user_trades_add/", {"scu": 1})
+    second = outbox.enqueue("/user_trades_add/", {"scu": 2})
+    await outbox.flush()
+    assert sorted(entry["key"] for entry in outbox.failed_entries()) == sorted([first, second])
+    outbox.retry_failed([])
+    assert len(outbox.failed_entries()) == 2
+    outbox.retry_failed([first])
+    await outbox.flush()
+    assert [entry["key"] for entry in outbox.failed_entries()] == [second]
+    outbox.discard_failed([second])
+    assert outbox.failed_entries() == []
+    assert outbox.pending_count() == 0
+    assert sender.calls[-1][1] == {"scu": 1}
@@ -1,4 +1,11 @@
-from cache_manager import CacheManager
+import asyncio
+import pytest
+from cache_manager import CacheManager, DictCacheBackend, SQLiteCacheBackend, LRUCacheTier, LogCacheBackend
+from cache_manager import canonical_params, LRUMemory
+from row_store import RowStore
+from async_cache_manager import AsyncCacheManager
+from fetch_leases import FetchLeases
+from price_history import PriceHistory
 # from global_variables import persistent_cache_activated # TODO - Add functional test with persistence activated/deactivated
 
 
@@ -47,6 +54,556 @@ def test_unitary_endpoint_exists():
     assert not sqlcache.endpoint_exists_in_cache("/bar")
 
 
+def test_unitary_canonical_params():
+    assert canonical_params(None) == canonical_params({}) == ""
+    assert canonical_params({'id_terminal': 1, 'id_commodity': 2}) == canonical_params({'id_commodity': 2, 'id_terminal': 1})
+    assert canonical_params({'id_terminal': 1}) != canonical_params({'id_terminal': '1'})
+    cache = CacheManager(backend="local")
+    cache.set('/commodities_prices', {'id_terminal': 1, 'id_commodity': 2}, ['bar'])
+    assert cache.get('/commodities_prices', {'id_commodity': 2, 'id_terminal': 1}) == ['bar']
+
+
+def test_unitary_set_many():
+    sqlcache = CacheManager(backend="persistent")
+    dictcache = CacheManager(backend="local")
+    items = [({'id': 1}, ['bar']), ({'id': 2}, ['baz'])]
+    sqlcache.set_many('/foo', items)
+    dictcache.set_many('/foo', items)
+    assert sqlcache.get('/foo', {'id': 2}) == ['baz']
+    assert dictcache.get('/foo', {'id': 1}) == ['bar']
+
+
+def test_unitary_batch():
+    sqlcache = CacheManager(backend="persistent")
+    sqlcache.invalidate('/foo', 'batch')
+    with sqlcache.batch():
+        sqlcache.set('/foo', 'batch', 'bar')
+        assert sqlcache.get('/foo', 'batch') == 'bar'  # Pending writes are readable
+        assert CacheManager(backend="persistent").get('/foo', 'batch') is None
+    assert CacheManager(backend="persistent").get('/foo', 'batch') == 'bar'
+
+
+@pytest.mark.asyncio
+async def test_unitary_batch_of_task():
+    cache = CacheManager(backend="local")
+    batch_opened = asyncio.Event()
+
+    async def other_task():
+        await batch_opened.wait()
+        cache.set('/foo', 'other', 'baz')  # Written right away, not held by the batch of the first task
+        assert cache.cache.get('/foo', '"other"') == 'baz'
+
+    async def batched_task():
+        with cache.batch():
+            cache.set('/foo', 'batched', 'bar')
+            batch_opened.set()
+            await asyncio.sleep(0.01)
+            assert cache.cache.get('/foo', '"batched"') is None
+        assert cache.cache.get('/foo', '"batched"') == 'bar'
+
+    await asyncio.gather(batched_task(), other_task())
+
+
+def test_unitary_backend_expiry():
+    for backend in (SQLiteCacheBackend(in_memory=True), DictCacheBackend()):
+        backend.set('/foo', 'expired', 'bar', ttl=-1)
+        backend.set('/foo', 'valid', 'baz', ttl=60)
+        assert backend.get('/foo', 'expired') is None
+        assert backend.get('/foo', 'valid') == 'baz'
+        assert backend.contains_endpoint('/foo')
+        backend.clean_obsolete()
+        backend.delete('/foo', 'valid')
+        assert not backend.contains_endpoint('/foo')
+
+
+def test_unitary_lru_tier():
+    backend = SQLiteCacheBackend(in_memory=True)
+    tier = LRUCacheTier(backend, max_entries=2)
+    for params in ('a', 'b', 'c'):
+        tier.set('/foo', params, params, ttl=60)
+        assert tier.get('/foo', params) == params
+    backend.delete('/foo', 'a')
+    backend.delete('/foo', 'c')
+    assert tier.get('/foo', 'a') is None  # Least recently used, evicted from memory
+    assert tier.get('/foo', 'c') == 'c'  # Still served from memory
+    tier.set('/foo', 'c', 'updated', ttl=-1)
+    assert tier.get('/foo', 'c') is None  # Write-through keeps the expiry coherent
+
+
+def test_unitary_evict():
+    backend = SQLiteCacheBackend(in_memory=True)
+    backend.set('/star_systems', 'system', 'x' * 1000, ttl=60)
+    backend.set('/commodities_prices', 'cold', 'x' * 1000, ttl=60)
+    backend.set('/commodities_prices', 'hot', 'x' * 1000, ttl=60)
+    for _ in range(10):
+        backend.get('/commodities_prices', 'hot')
+    assert backend.evict(max_bytes=10000) == 0
+    assert backend.evict(max_bytes=2500) == 1
+    assert backend.get('/commodities_prices', 'cold') is None
+    assert backend.get('/commodities_prices', 'hot') is not None
+    assert backend.get('/star_systems', 'system') is not None
+
+
+def test_unitary_stats_and_purge():
+    cache = CacheManager(backend="local")
+    cache.set('/foo', {'id': 1}, ['bar'])
+    cache.get('/foo', {'id': 1})
+    cache.get('/foo', {'id': 2})
+    cache.set_rows('/planets', {}, [{'id': 3, 'id_star_system': 1}])
+    stats = cache.get_stats()
+    assert stats['/foo']['entries'] == 1
+    assert stats['/foo']['bytes'] == len('["bar"]')
+    assert (stats['/foo']['hits'], stats['/foo']['misses']) == (1, 1)
+    assert stats['/planets']['entries'] == 1
+    assert 0 <= stats['/planets']['newest_age'] <= stats['/planets']['oldest_age'] < 5
+    cache.purge_endpoint('/planets')
+    assert cache.get_rows('/planets', {}) is None
+    assert cache.get('/foo', {'id': 1}) == ['bar']
+    assert cache.get_stats()['/planets']['entries'] == 0
+
+
+def test_unitary_snapshot(tmp_path):
+    source = CacheManager(backend="local")
+    systems = [{'id': 1, 'name': 'Stanton'}, {'id': 2, 'name': 'Pyro'}]
+    source.set_rows('/star_systems', {}, systems)
+    source.set_rows('/terminals', {'id_planet': 4}, [{'id': 10, 'id_planet': 4, 'id_star_system': 1}])
+    path = tmp_path / "cache.json.gz"
+    assert source.export_snapshot(path, endpoints=['/star_systems']) == 2
+    target = CacheManager(backend="local")
+    assert target.import_snapshot(path) == 2
+    assert target.get_rows('/star_systems', {'id_star_system': 2}) == [systems[1]]
+    assert target.get_rows('/terminals', {'id_planet': 4}) is None
+    source.export_snapshot(path)
+    assert target.import_snapshot(path, fresh=True) == 3
+    assert target.get_rows('/terminals', {'id_planet': 4, 'id_terminal': 10}) is not None
+
+
+def test_unitary_compression():
+    value = [{'commodity_name': 'Agricium', 'terminal_name': 'Area 18', 'price_sell': i} for i in range(200)]
+    for compression in ('zlib', 'lzma', 'bz2', 'none'):
+        backend = SQLiteCacheBackend(in_memory=True, compression=compression)
+        backend.set('/commodities_prices', 'large', value, ttl=60)
+        backend.set('/commodities_prices', 'small', ['foo'], ttl=60)
+        assert backend.get('/commodities_prices', 'large') == value
+        assert backend.get('/commodities_prices', 'small') == ['foo']
+        codecs = dict(backend.con.execute("SELECT params, codec FROM cache").fetchall())
+        assert codecs['small'] == 0
+        assert (codecs['large'] == 0) == (compression == 'none')
+
+
+def test_unitary_row_store():
+    store = RowStore(in_memory=True)
+    prices = [{'id_commodity': 1, 'id_terminal': 10, 'game_version': '4.0', 'price_sell': 5},
+              {'id_commodity': 2, 'id_terminal': 10, 'game_version': '4.0', 'price_sell': 7},
+              {'id_commodity': 1, 'id_terminal': 20, 'game_version': '4.0', 'price_sell': 6}]
+    assert store.supports('/commodities_prices', {'id_terminal': 10})
+    assert not store.supports('/commodities_prices', {'unknown': 10})
+    assert store.get_rows('/commodities_prices', {'id_terminal': 10}, '4.0') is None
+    store.set_rows('/commodities_prices', {'id_terminal': 10}, prices[:2], ttl=60)
+    assert store.get_rows('/commodities_prices', {'id_terminal': 10}, '4.0') == prices[:2]
+    # A loaded terminal covers any commodity of this terminal, but not the whole endpoint
+    assert store.get_rows('/commodities_prices', {'id_terminal': 10, 'id_commodity': 2}, '4.0') == [prices[1]]
+    assert store.get_rows('/commodities_prices', {'id_commodity': 1}, '4.0') is None
+    store.set_rows('/commodities_prices', {'id_terminal': 20}, prices[2:], ttl=60)
+    store.mark_loaded('/commodities_prices', {}, ttl=60)
+    assert store.get_rows('/commodities_prices', {'id_commodity': 1}, '4.0') == [prices[0], prices[2]]
+    # Storing a scope again replaces its rows
+    store.set_rows('/commodities_prices', {'id_terminal': 10}, prices[1:2], ttl=60)
+    assert store.get_rows('/commodities_prices', {'id_terminal': 10}, '4.0') == [prices[1]]
+    store.set_rows('/terminals', {}, [{'id': 10, 'id_planet': 3, 'id_star_system': 1}], ttl=-1)
+    assert store.get_rows('/terminals', {'id_terminal': 10}) is None
+    store.clear()
+    assert not store.contains_endpoint('/commodities_prices')
+
+
+def test_unitary_row_store_snapshot():
+    store = RowStore(in_memory=True)
+    old_prices = [{'id_commodity': 1, 'id_terminal': 10, 'game_version': '4.0', 'price_sell': 5}]
+    new_prices = [{'id_commodity': 1, 'id_terminal': 10, 'game_version': '4.0', 'price_sell': 8}]
+    store.set_rows('/commodities_prices', {'id_terminal': 10}, old_prices, ttl=60)
+    snapshot = store.pin_snapshot()
+    store.set_rows('/commodities_prices', {'id_terminal': 10}, new_prices, ttl=60)
+    store.set_rows('/commodities_prices', {'id_terminal': 20}, [], ttl=60)
+    # The pinned snapshot keeps its generation, new readers see the new one
+    assert store.get_rows('/commodities_prices', {'id_terminal': 10}, '4.0', snapshot) == old_prices
+    assert store.get_rows('/commodities_prices', {'id_terminal': 20}, '4.0', snapshot) is None
+    assert store.get_rows('/commodities_prices', {'id_terminal': 10}, '4.0') == new_prices
+    store.release_snapshot(snapshot)
+    assert store.con.execute("SELECT COUNT(1) FROM commodities_prices").fetchone()[0] == 1
+    assert store.con.execute("SELECT COUNT(1) FROM row_scopes").fetchone()[0] == 2
+    # Purged and cleared rows stay readable by a pinned snapshot
+    snapshot = store.pin_snapshot()
+    store.delete_endpoint('/commodities_prices')
+    assert store.get_rows('/commodities_prices', {'id_terminal': 10}, '4.0') is None
+    store.clear()
+    assert store.get_rows('/commodities_prices', {'id_terminal': 10}, '4.0', snapshot) == new_prices
+    store.release_snapshot(snapshot)
+    assert store.con.execute("SELECT COUNT(1) FROM commodities_prices").fetchone()[0] == 0
+
+
+def test_unitary_row_store_eviction():
+    store = RowStore(in_memory=True, compression_threshold=100)
+    terminals = {planet: [{'id': planet * 10 + i, 'id_planet': planet, 'id_star_system': 1, 'name': 'x' * 200}
+                          for i in range(2)] for planet in (1, 2, 3)}
+    for planet, rows in terminals.items():
+        store.set_rows('/terminals', {'id_planet': planet}, rows, ttl=60)
+    store.mark_loaded('/terminals', {'id_star_system': 1}, ttl=60)
+    # Large rows are compressed, and read back
+    assert store.con.execute("SELECT MIN(codec) FROM terminals").fetchone()[0] == 1
+    assert store.get_rows('/terminals', {'id_planet': 2}) == terminals[2]
+    assert 0 < store.total_size() < 6 * 200
+    # The oldest scope goes first, with the scopes sharing its rows
+    assert store.evict(1) == 2
+    assert store.get_rows('/terminals', {'id_planet': 1}) is None
+    assert store.get_rows('/terminals', {'id_star_system': 1}) is None
+    assert store.get_rows('/terminals', {'id_planet': 2}) == terminals[2]
+    assert store.con.execute("SELECT COUNT(1) FROM terminals").fetchone()[0] == 4
+    assert store.evictions['/terminals'] == 2
+    # Rows no scope covers anymore are evicted with the scopes
+    store.set_rows('/planets', {'id_star_system': 1}, [{'id': 1, 'id_star_system': 1}], ttl=60)
+    store.set_rows('/planets', {}, [{'id': 1, 'id_star_system': 1}, {'id': 2, 'id_star_system': 2}], ttl=60)
+    store.evict(store.total_size())
+    assert store.total_size() == 0
+    assert not store.contains_endpoint('/planets')
+
+
+def test_unitary_cache_size_budget():
+    class ConfigManager:
+        @staticmethod
+        def get_cache_max_size():
+            return 0.001  # 1048 bytes
+
+    cache = CacheManager(backend="local", config_manager=ConfigManager())
+    for system in range(10):
+        cache.set_rows('/planets', {'id_star_system': system},
+                       [{'id': system * 10 + i, 'id_star_system': system, 'name': 'x' * 20} for i in range(5)])
+    cache.enforce_max_size()
+    assert cache.store.total_size() <= 1048
+    assert cache.get_rows('/planets', {'id_star_system': 0}) is None
+    assert cache.get_rows('/planets', {'id_star_system': 9}) is not None
+    assert cache.get_stats()['/planets']['evictions'] > 0
+
+
+def test_unitary_memory_rows():
+    cache = CacheManager(backend="local")
+    cache.rows_memory = LRUMemory()
+    systems = [{'id': 1, 'name': 'Stanton'}]
+    cache.set_rows('/star_systems', {}, systems)
+    assert cache.get_rows('/star_systems', {}) == systems
+    cache.store.con.execute("DELETE FROM star_systems;")
+    assert cache.get_rows('/star_systems', {}) == systems  # Served from memory
+    # Written by another process sharing the store: read from the store again, in snapshots as well
+    cache.store.set_rows('/star_systems', {}, [{'id': 3, 'name': 'Nyx'}], ttl=60)
+    snapshot = cache.pin_snapshot()
+    assert cache.get_rows('/star_systems', {}, snapshot=snapshot) == [{'id': 3, 'name': 'Nyx'}]
+    assert cache.get_rows('/star_systems', {}) == [{'id': 3, 'name': 'Nyx'}]
+    cache.set_rows('/star_systems', {}, [{'id': 2, 'name': 'Pyro'}])
+    # Older snapshots are read from the store
+    assert cache.get_rows('/star_systems', {}, snapshot=snapshot) == [{'id': 3, 'name': 'Nyx'}]
+    assert cache.get_rows('/star_systems', {}) == [{'id': 2, 'name': 'Pyro'}]
+    cache.release_snapshot(snapshot)
+    cache.invalidate('/star_systems', {})
+    assert cache.get_rows('/star_systems', {}) is None
+
+
+@pytest.mark.asyncio
+async def test_unitary_async_cache():
+    cache = AsyncCacheManager(backend="local")
+    write = cache.set('/foo', {'id': 1}, ['bar'])
+    cache.set('/foo', {'id': 2}, ['baz'])
+    assert await cache.get('/foo', {'id': 1}) == ['bar']  # Answered from the write queue
+    await write
+    assert cache.sync.get('/foo', {'id': 2}) == ['baz']  # Written by the same batch
+    assert await cache.endpoint_exists_in_cache('/foo')
+    cache.invalidate('/foo', {'id': 1})
+    assert await cache.get('/foo', {'id': 1}) is None
+    cache.set_rows('/planets', {}, [{'id': 3, 'id_star_system': 1}])
+    assert await cache.get_rows('/planets', {'id_planet': 3}) == [{'id': 3, 'id_star_system': 1}]
+    await cache.clear()
+    assert await cache.get('/foo', {'id': 2}) is None
+
+
+def test_unitary_row_store_partitions():
+    store = RowStore(in_memory=True)
+    prices = [{'id_commodity': 1, 'id_terminal': 10, 'game_version': '4.0', 'price_sell': 5},
+              {'id_commodity': 1, 'id_terminal': 10, 'game_version': '4.1', 'price_sell': 6}]
+    assert not store.supports('/commodities_prices', {'game_version': '4.0'})
+    store.set_rows('/commodities_prices', {'id_terminal': 10}, prices, ttl=60)
+    assert store.get_rows('/commodities_prices', {'id_terminal': 10}, partition='4.0') == [prices[0]]
+    assert store.get_rows('/commodities_prices', {'id_terminal': 10}, partition='4.1') == [prices[1]]
+    assert store.get_rows('/commodities_prices', {'id_terminal': 10}, partition='3.0') == []
+    assert store.filter_partition('/commodities_prices', prices, '4.1') == [prices[1]]
+    assert store.filter_partition('/terminals', prices, '4.1') == prices
+
+
+def test_unitary_maintenance(tmp_path):
+    backend = SQLiteCacheBackend(in_memory=True)
+    backend.set_many([('/foo', str(i), 'x' * 1000, 60) for i in range(100)])
+    backend.clear()
+    assert backend.maintain() >= 0
+    assert backend.con.execute("PRAGMA auto_vacuum;").fetchone()[0] == 2
+    assert backend.con.execute("PRAGMA freelist_count;").fetchone()[0] == 0
+
+
+def test_unitary_incremental_vacuum_new_file(monkeypatch, tmp_path):
+    import cache_manager
+    monkeypatch.setattr(cache_manager, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+    backend = SQLiteCacheBackend()
+    # Enabled before the file was switched to WAL, no conversion left to the maintenance
+    assert backend.con.execute("PRAGMA auto_vacuum;").fetchone()[0] == 2
+    assert backend.con.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+    backend.con.close()
+
+
+@pytest.mark.asyncio
+async def test_unitary_idle_maintenance():
+    cache = AsyncCacheManager(backend="local")
+    assert not cache._is_maintenance_due()  # Nothing to do yet
+    await cache.clean_obsolete()
+    cache._last_activity -= 3600
+    assert cache._is_maintenance_due()
+    await cache.maintain()
+    assert not cache._is_maintenance_due()
+
+
+@pytest.mark.asyncio
+async def test_unitary_background_failure_logged(caplog):
+    cache = AsyncCacheManager(backend="local")
+
+    def purge_endpoint(endpoint):
+        raise ValueError(endpoint)
+
+    cache.sync.purge_endpoint = purge_endpoint
+    cache.purge_endpoint('/foo')  # Not awaited
+    await cache.flush()
+    await asyncio.sleep(0)  # Done callbacks
+    assert "Cache operation purge_endpoint failed" in caplog.text
+
+
+def test_unitary_fetch_leases():
+    # Two instances sharing cache.db, as two running processes
+    leases1 = FetchLeases()
+    leases2 = FetchLeases()
+    leases1.release_all()
+    assert leases1.acquire('/foo?')
+    assert not leases1.acquire('/foo?')  # Held by another task of the same process
+    assert not leases2.acquire('/foo?')
+    assert leases2.acquire('/bar?')
+    leases1.release('/bar?')  # Only released by its owner
+    assert not leases1.acquire('/bar?')
+    leases1.release('/foo?')
+    assert leases2.acquire('/foo?')
+    leases2.release_all()
+    expired = FetchLeases(in_memory=True, ttl=-1)
+    assert expired.acquire('/foo?')
+    expired.owner = 'crashed'
+    assert expired.acquire('/foo?')  # Taken over once expired
+
+
+def test_unitary_row_store_shared():
+    # Two stores sharing cache.db, as two running processes
+    store1 = RowStore()
+    store2 = RowStore()
+    store1.clear()
+    planets = [{'id': 3, 'id_star_system': 1}]
+    snapshot = store1.pin_snapshot()
+    store1.set_rows('/planets', {}, planets, ttl=60)
+    store2.set_rows('/planets', {}, [], ttl=60)  # Next generation, retired rows kept for store1
+    assert store2.generation == store1.current_generation() == snapshot + 2
+    assert store1.get_rows('/planets', {}, snapshot=snapshot + 1) == planets
+    assert store1.get_rows('/planets', {}) == []
+    store1.release_snapshot(snapshot)
+    assert store1.con.execute("SELECT COUNT(1) FROM planets").fetchone()[0] == 0
+    store1.clear()
+
+
+@pytest.mark.asyncio
+async def test_unitary_fetch_lease_wait(monkeypatch):
+    import api as api_module
+    monkeypatch.setattr(api_module, "cache_lease_poll_interval", 0.01)
+    cache = AsyncCacheManager(backend="local")
+    api = object.__new__(api_module.API)
+    api.cache = cache
+    api.metrics = type("Metrics", (), {"track_api_call": lambda *args, **kwargs: None})()
+    fetched = []
+
+    async def fetch():
+        fetched.append(1)
+        await asyncio.sleep(0.05)
+        cache.set('/foo', None, ['bar'])
+        return ['bar'], False
+
+    read_cache = lambda: api._get_cached_data('/foo', None)  # noqa: E731
+    results = await asyncio.gather(api._fetch_leased('/foo', None, read_cache, fetch),
+                                   api._fetch_leased('/foo', None, read_cache, fetch))
+    assert results == [(['bar'], False), (['bar'], True)]
+    assert fetched == [1]  # Fetched once, the other waited for the result
+
+
+def test_unitary_log_backend(tmp_path):
+    backend = LogCacheBackend(directory=tmp_path, compression_threshold=100)
+    backend.set_many([('/foo', '1', ['bar'], 60), ('/foo', '2', 'x' * 1000, 60), ('/baz', '', 'old', -1)])
+    backend.set('/foo', '1', ['baz'], 60)
+    backend.delete('/foo', '2')
+    assert backend.get('/foo', '1') == ['baz']
+    assert backend.get('/foo', '2') is None
+    assert backend.get('/baz', '') is None  # Expired
+    assert backend.contains_endpoint('/foo') and not backend.contains_endpoint('/baz')
+    backend.set('/foo', '3', 'x' * 1000, 60)
+    backend.close()
+    # Replayed from the segments, a record torn by a crash is dropped
+    with open(tmp_path / "segment-000001.log", "ab") as segment_file:
+        segment_file.write(b"torn record")
+    backend = LogCacheBackend(directory=tmp_path)
+    assert backend.get('/foo', '1') == ['baz']
+    assert backend.get('/foo', '2') is None
+    assert backend.get('/foo', '3') == 'x' * 1000
+    assert backend.endpoint_stats()['/foo']['entries'] == 2
+    backend.set('/bar', '', 'y', 60)
+    assert backend.get('/bar', '') == 'y'  # Read from the remapped active segment
+
+
+def test_unitary_log_backend_lock(monkeypatch, tmp_path, caplog):
+    import cache_manager
+    monkeypatch.setattr(cache_manager, "user_data_dir", lambda *args, **kwargs: str(tmp_path))
+    backend = LogCacheBackend()
+    with pytest.raises(OSError):
+        LogCacheBackend()  # A single process appends to the log
+    cache = CacheManager(backend="log")
+    assert isinstance(cache.cache.backend if isinstance(cache.cache, LRUCacheTier) else cache.cache, SQLiteCacheBackend)
+    assert "Cache log unavailable" in caplog.text
+    backend.close()
+    LogCacheBackend().close()
+
+
+def test_unitary_log_backend_compaction(tmp_path):
+    backend = LogCacheBackend(directory=tmp_path, segment_size=1024)
+    for i in range(10):
+        backend.set_many([('/foo', str(j), 'x' * 100, 60) for j in range(10)])
+    assert len(list(tmp_path.glob("segment-*.log"))) > 1
+    assert backend.maintain() >= 0
+    segments = list(tmp_path.glob("segment-*.log"))
+    assert len(segments) == 1 and segments[0].stat().st_size < 2048
+    assert all(backend.get('/foo', str(j)) == 'x' * 100 for j in range(10))
+    assert backend.evict(500) > 0
+    assert backend.total_size() <= 500
+    backend.clear()
+    assert not backend.contains_endpoint('/foo')
+    backend.close()
+    assert LogCacheBackend(directory=tmp_path).get('/foo', '0') is None
+
+
+def test_unitary_log_cache():
+    logcache1 = CacheManager(backend="log")
+    logcache1.set('/foo', 'foo', 'bar')
+    assert logcache1.get('/foo', 'foo') == 'bar'
+    assert logcache1.maintain() >= 0
+    logcache2 = CacheManager(backend="log")
+    assert logcache2.get('/foo', 'foo') == 'bar'
+    logcache2.clear()
+
+
+def test_unitary_price_history():
+    history = PriceHistory(in_memory=True, retention_days=36500)
+    day = 86400 * 20000
+    price = {'id_terminal': 10, 'id_commodity': 1, 'game_version': '4.0', 'price_buy': 5, 'price_sell': 0,
+             'scu_buy': 100, 'scu_sell': 0, 'date_modified': day + 60}
+    assert history.record([price]) == 1
+    assert history.record([dict(price, date_modified=day + 120)]) == 0  # Unchanged
+    assert history.record([dict(price, price_buy=6, date_modified=day + 86400 + 30),
+                           dict(price, id_terminal=20, date_modified=day + 90)]) == 2
+    samples = history.get_history(id_commodity=1, start=day, end=day + 2 * 86400)
+    assert [(sample['id_terminal'], sample['timestamp'], sample['price_buy']) for sample in samples] == \
+        [(10, day + 60, 5), (20, day + 90, 5), (10, day + 86400 + 30, 6)]
+    assert len(history.get_history(id_terminal=10, start=day + 86400, end=day + 2 * 86400)) == 1
+    assert history.get_history(game_version='3.0', start=day, end=day + 2 * 86400) == []
+    assert history.con.execute("SELECT seconds FROM price_history WHERE id_terminal = 20").fetchone()[0] == 90
+    history.retention_days = 90
+    history.clean_obsolete()  # Older than the retention period
+    assert history.get_history(start=day, end=day + 2 * 86400) == []
+    # A price unchanged since then is sampled again in the retained window
+    assert history.record([dict(price, price_buy=6, date_modified=None)]) == 1
+    assert [sample['price_buy'] for sample in history.get_history(id_terminal=10)] == [6]
+    # A price last modified before the retention period is not sampled again
+    assert history.record([dict(price, id_terminal=20, price_buy=7)]) == 0
+    assert history.get_history(id_terminal=20) == []
+
+
+def test_unitary_price_history_from_rows():
+    cache = CacheManager(backend="local")
+    prices = [{'id_commodity': 1, 'id_terminal': 10, 'game_version': '4.0', 'price_sell': 5}]
+    cache.set_rows('/commodities_prices', {'id_terminal': 10}, prices)
+    cache.set_rows('/commodities_prices', {'id_terminal': 10}, prices)
+    cache.set_rows('/terminals', {}, [{'id': 10}])
+    assert [sample['price_sell'] for sample in cache.get_price_history(game_version='4.0')] == [5]
+
+
+def test_unitary_row_store_warmup():
+    store = RowStore(in_memory=True)
+    store.set_rows('/commodities_prices', {'id_terminal': 10}, [], ttl=60)
+    store.set_rows('/commodities_prices', {'id_terminal': 20}, [], ttl=30)
+    assert set(store.loaded_checkpoints('/commodities_prices', 'id_terminal', [10, 20, 30])) == {10, 20}
+    assert not store.complete('/commodities_prices', 'id_terminal', [10, 20, 30])
+    assert not store.is_loaded('/commodities_prices', {})  # Incomplete sweep
+    store.set_rows('/commodities_prices', {'id_terminal': 30}, [], ttl=60)
+    assert store.complete('/commodities_prices', 'id_terminal', [10, 20, 30])
+    assert store.is_loaded('/commodities_prices', {})
+    expires_at = store.con.execute("SELECT expires_at FROM row_scopes WHERE scope = ''").fetchone()[0]
+    assert expires_at == store.loaded_checkpoints('/commodities_prices', 'id_terminal', [20])[20]
+
+
+@pytest.mark.asyncio
+async def test_unitary_warmup_resume():
+    import api as api_module
+    cache = AsyncCacheManager(backend="local")
+    api = object.__new__(api_module.API)
+    api.cache = cache
+
+    async def fetch_all_terminals():
+        return [{'id': 10}, {'id': 20}, {'id': 30}]
+
+    api.fetch_all_terminals = fetch_all_terminals
+    fetched = []
+
+    async def fetch(id_terminal):
+        if id_terminal == 30 and None not in fetched:
+            raise ConnectionError()  # Interrupted sweep
+        fetched.append(id_terminal)
+        await cache.set_rows('/commodities_prices', {'id_terminal': id_terminal}, [])
+
+    with pytest.raises(ConnectionError):
+        await api._warm_up('/commodities_prices', 'id_terminal', fetch)
+    assert not await cache.is_warm('/commodities_prices')
+    fetched.append(None)
+    assert await api._warm_up('/commodities_prices', 'id_terminal', fetch) == (True, [10, 20, 30])
+    assert fetched == [10, 20, None, 30]  # Resumed with the terminal left
+    assert await cache.is_warm('/commodities_prices')
+
+
+@pytest.mark.asyncio
+async def test_unitary_incomplete_warmup():
+    import api as api_module
+    cache = AsyncCacheManager(backend="local")
+    api = object.__new__(api_module.API)
+    api.cache = cache
+
+    async def fetch_all_terminals():
+        return [{'id': 10}, {'id': 20}]
+
+    requested = []
+
+    async def fetch_commodities_prices(params):
+        requested.append(params)
+        if params.get('id_terminal') == 10:  # Failed requests are not cached
+            await cache.set_rows('/commodities_prices', params, [{'id_commodity': 1, 'id_terminal': 10}])
+        return [{'id_commodity': 1, 'id_terminal': params['id_terminal']}] if params.get('id_terminal') == 10 else []
+
+    api.fetch_all_terminals = fetch_all_terminals
+    api._fetch_commodities_prices = fetch_commodities_prices
+    assert await api.fetch_all_commodities_prices() == [{'id_commodity': 1, 'id_terminal': 10}]
+    assert {} not in requested  # The whole endpoint is never requested
+
+
 def test_unitary_invalid_backend():
     try:
         CacheManager(backend="unknown")
@@ -23,6 +23,22 @@ def days_difference_from_now(timestamp=0):
     return rounded_days
 
 
+@Metrics.track_sync_fnc_exec
+def format_duration(seconds):
+    for unit, unit_seconds in (("d", 24 * 3600), ("h", 3600), ("m", 60)):
+        if seconds >= unit_seconds:
+            return f"{int(seconds // unit_seconds)}{unit}"
+    return f"{int(seconds)}s"
+
+
+@Metrics.track_sync_fnc_exec
+def format_size(size):
+    for unit, unit_size in (("MB", 1024 * 1024), ("KB", 1024)):
+        if size >= unit_size:
+            return f"{size / unit_size:.1f}{unit}"
+    return f"{size}B"
+
+
 @Metrics.track_async_fnc_exec
 async def translate(key):
     config_manager = await ConfigManager.get_instance()
@@ -0,0 +1,114 @@
+# tracing.py
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+
+# Span of the decorated function running in the current task, inherited by the tasks it creates
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Trace:
+    """
+    The spans recorded during one traced call (a search), exportable as a
+    Chrome trace (chrome://tracing, Perfetto) to be read as a flame chart.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.created_at = time.time()
+        self.spans = []
+        self._ids = itertools.count(1)
+
+    def to_chrome_trace(self):
+        """
+        Returns the trace in the Chrome trace event format: one complete event per span, on the
+        track of the task (or thread) which ran it, with its CPU time and parent span in args.
+        """
+        start = min((span.start for span in self.spans), default=0)
+        tracks = {}
+        events = []
+        for span in sorted(self.spans, key=lambda span: span.start):
+            events.append({
+                "name": span.name,
+                "cat": span.module,
+                "ph": "X",
+                "ts": (span.start - start) / 1000,
+                "dur": span.wall / 1000,
+                "pid": os.getpid(),
+                "tid": tracks.setdefault(span.track, len(tracks) + 1),
+                "args": {"cpu_ms": span.cpu / 1e6, "span_id": span.id,
+                         "parent_id": span.parent.id if span.parent else None}
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"name": self.name, "created_at": self.created_at}}
+
+    def export(self, path):
+        with open(path, "w", encoding="utf-8") as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
+
+
+class Span:
+    """
+    A call of a decorated function, child of the span running in the same task when it started.
+    Wall and CPU times are in nanoseconds, CPU time is the time spent running the call on its thread.
+    """
+    __slots__ = ("trace", "id", "parent", "module", "name", "track", "start", "wall", "cpu")
+
+    def __init__(self, trace, module, name, parent=None):
+        self.trace = trace
+        self.id = next(trace._ids)
+        self.parent = parent
+        self.module = module
+        self.name = name
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None  # Not in a coroutine, on the cache I/O thread for instance
+        self.track = (threading.get_ident(), id(task))
+
+    @staticmethod
+    def open(func):
+        """Starts the span of a call of func when a trace is being recorded, and returns (span, token) or None."""
+        parent = current_span.get()
+        if parent is None:
+            return None
+        span = Span(parent.trace, func.__module__, func.__qualname__, parent)
+        return span, current_span.set(span)
+
+    def close(self, start, end, cpu):
+        self.start = start
+        self.wall = end - start
+        self.cpu = cpu
+        self.trace.spans.append(self)
+
+
+class CpuTimedCoroutine:
+    """
+    Awaits a coroutine while measuring the CPU time of its own steps: the time
+    spent on the thread between two suspensions, without the time of the
+    other tasks which ran while it was waiting.
+    """
+    def __init__(self, coro):
+        self.coro = coro
+        self.cpu = 0
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            start_cpu = time.thread_time_ns()
+            try:
+                yielded = self.coro.throw(error) if error is not None else self.coro.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.cpu += time.thread_time_ns() - start_cpu
+            try:
+                value, error = (yield yielded), None
+            except GeneratorExit:
+                self.coro.close()
+                raise
+            except BaseException as e:
+                value, error = None, e
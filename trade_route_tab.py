@@ -289,6 +289,8 @@ class TradeRouteTab(QWidget):
         self.trade_route_table.setColumnCount(len(self.columns))
         self.trade_route_table.setHorizontalHeaderLabels(self.columns)
 
+    @Metrics.capture_profile
+    @Metrics.record_trace
     @Metrics.track_async_fnc_exec
     async def find_trade_routes(self):
         await self.ensure_initialized()
@@ -301,7 +303,9 @@ class TradeRouteTab(QWidget):
         self.progress_bar.setValue(0)
         self.main_progress_bar.setValue(0)
 
+        pinned_snapshot = None
         try:
+            pinned_snapshot = await self.api.pin_cache_snapshot()
             await self.validate_inputs()
             self.current_trades = await self.fetch_and_process_departure_commodities()
 
@@ -322,6 +326,8 @@ class TradeRouteTab(QWidget):
             await self.main_widget.set_gui_enabled(True)
             self.progress_bar.setVisible(False)
             self.main_progress_bar.setVisible(False)
+            if pinned_snapshot is not None:
+                self.api.release_cache_snapshot(pinned_snapshot)
 
     @Metrics.track_sync_fnc_exec
     def get_validated_inputs(self):
@@ -25,6 +25,7 @@ class TradeTab(QWidget):
         self.translation_manager = None
         self._current_terminal_commodities = []
         self._unfiltered_terminals = []
+        self._failed_trades_box = None
         asyncio.ensure_future(self.load_systems())
 
     @Metrics.track_async_fnc_exec
@@ -34,8 +35,11 @@ class TradeTab(QWidget):
                 self.config_manager = await ConfigManager.get_instance()
                 self.api = await API.get_instance(self.config_manager)
                 self.translation_manager = await TranslationManager.get_instance()
+                self.api.outbox.add_listener(self.on_outbox_result)
                 await self.init_ui()
                 self._initialized.set()
+                # Trades which failed during a previous session
+                asyncio.ensure_future(self.review_failed_trades())
 
     async def ensure_initialized(self):
         if not self._initialized.is_set():
@@ -290,20 +294,11 @@ class TradeTab(QWidget):
                 "price": float(price),
             }
 
-            result = await self.api.perform_trade(data)
-
-            await self.handle_trade_result(result, logger)
-        except aiohttp.ClientResponseError as e:
-            if e.status == 403:
-                logger.warning("API Key given is absent or invalid")
-                self.main_widget.show_messagebox(await translate("error_input_api_invalid"),
-                                                 await translate("error_input_api_invalid_details"),
-                                                 QMessageBox.Icon.Warning)
-            else:
-                logger.exception("An unexpected error occurred: %s", e)
-                self.main_widget.show_messagebox(await translate("error_error"),
-                                                 await translate("error_generic") + ": " + str(e),
-                                                 QMessageBox.Icon.Critical)
+            trade_key = await self.api.perform_trade(data)
+            logger.info("Trade queued - Key: %s", trade_key)
+            self.main_widget.show_messagebox(await translate("success_success"),
+                                             await translate("success_trade_queued"),
+                                             QMessageBox.Icon.Information)
         except ValueError as e:
             logger.warning("Input Error: %s", e)
             self.main_widget.show_messagebox(await translate("error_input_error"), str(e),
@@ -316,6 +311,68 @@ class TradeTab(QWidget):
                                              await translate("error_generic") + ": " + str(e),
                                              QMessageBox.Icon.Critical)
 
+    @Metrics.track_sync_fnc_exec
+    def on_outbox_result(self, key, endpoint, result, error):
+        if endpoint != "/user_trades_add/":
+            return
+        asyncio.ensure_future(self.handle_outbox_result(key, result, error))
+
+    @Metrics.track_async_fnc_exec
+    async def handle_outbox_result(self, key, result, error):
+        logger = logging.getLogger(__name__)
+        if error is None:
+            await self.handle_trade_result(result, logger)
+        elif isinstance(error, aiohttp.ClientResponseError) and error.status == 403:
+            logger.warning("API Key given is absent or invalid")
+            self.main_widget.show_messagebox(await translate("error_input_api_invalid"),
+                                             await translate("error_input_api_invalid_details"),
+                                             QMessageBox.Icon.Warning)
+        else:
+            logger.error("Trade %s failed: %s", key, error)
+        if error is not None:
+            await self.review_failed_trades()
+
+    @Metrics.track_async_fnc_exec
+    async def review_failed_trades(self):
+        if self._failed_trades_box is not None or not self.main_widget.show_qmessagebox:
+            return
+        failed_trades = [entry for entry in self.api.outbox.failed_entries()
+                         if entry["endpoint"] == "/user_trades_add/"]
+        if not failed_trades:
+            return
+        scu = await translate("scu")
+        details = []
+        for trade in failed_trades:
+            data = trade["data"]
+            details.append(f"{data.get('operation', '')} {data.get('scu', '')} {scu}: {trade['error']}")
+        box = QMessageBox(QMessageBox.Icon.Critical, await translate("error_error"),
+                          await translate("error_trades_failed") + f" ({len(failed_trades)}):\n" + "\n".join(details),
+                          parent=self.main_widget)
+        retry_button = box.addButton(await translate("retry"), QMessageBox.AcceptRole)
+        discard_button = box.addButton(await translate("discard"), QMessageBox.DestructiveRole)
+        box.addButton(await translate("later"), QMessageBox.RejectRole)
+        keys = [trade["key"] for trade in failed_trades]
+        box.finished.connect(lambda _: self.on_failed_trades_reviewed(box, retry_button, discard_button, keys))
+        # Not modal on its own event loop: the outbox keeps sending while the box is open
+        self._failed_trades_box = box
+        box.open()
+
+    @Metrics.track_sync_fnc_exec
+    def on_failed_trades_reviewed(self, box, retry_button, discard_button, keys):
+        self._failed_trades_box = None
+        logger = logging.getLogger(__name__)
+        # Only the entries shown which are still failed are retried or discarded
+        if box.clickedButton() == retry_button:
+            logger.info("Retrying %d failed trade(s)", len(keys))
+            self.api.outbox.retry_failed(keys)
+        elif box.clickedButton() == discard_button:
+            logger.info("Discarding %d failed trade(s)", len(keys))
+            self.api.outbox.discard_failed(keys)
+        if any(entry["endpoint"] == "/user_trades_add/" and entry["key"] not in keys
+               for entry in self.api.outbox.failed_entries()):
+            # Trades which failed while the box was open
+            asyncio.ensure_future(self.review_failed_trades())
+
     @Metrics.track_async_fnc_exec
     async def validate_trade_inputs(self, terminal_id, id_commodity, quantity, price):
         await self.ensure_initialized()
@@ -345,7 +402,7 @@ class TradeTab(QWidget):
                                              + await translate("trade_id") + f": {trade_id}",
                                              QMessageBox.Icon.Information)
         else:
-            error_message = result.get('message', 'Unknown error')
+            error_message = result.get('message', 'Unknown error') if result else 'Unknown error'
             logger.error("Trade failed: %s", error_message)
             self.main_widget.show_messagebox(await translate("error_error"),
                                              await translate("error_trade_failed") + f": {error_message}",